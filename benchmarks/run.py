@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from urllib.parse import urlsplit, urlunsplit
+import requests
+from pymongo import MongoClient
+
+from seed import LOANS_DB, seed
+from stub_google_books import start_stub_google_books, stub_url
+from workload import DEFAULT_MIX, run_workload
+
+logger = logging.getLogger('benchmarks')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Seconds to wait for mongod and the services to come up
+STARTUP_TIMEOUT = 60
+# Allowed p95 latency increase of a route, as a fraction, before 'compare' reports a regression
+DEFAULT_THRESHOLD = 0.1
+
+
+def parse_size(size):
+    # '1k' -> 1000, '1m' -> 1000000
+    multipliers = {'k': 1000, 'm': 1000000}
+    size = size.strip().lower()
+    if size[-1:] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until(check, what, timeout=STARTUP_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except Exception:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{what} didn't start within {timeout} seconds")
+
+
+def with_database(mongo_uri, db_name):
+    # The URI with the path replaced by the database name, keeping its options
+    parts = urlsplit(mongo_uri)
+    return urlunsplit((parts.scheme, parts.netloc, f'/{db_name}', parts.query, parts.fragment))
+
+
+class ThrowawayMongo:
+    # A single node replica set in a temporary directory - the services need one for transactions
+    def __init__(self, mongod):
+        self.dbpath = tempfile.mkdtemp(prefix='bench-mongo-')
+        self.port = free_port()
+        self.uri = f'mongodb://127.0.0.1:{self.port}/?replicaSet=rs0'
+        self.process = subprocess.Popen(
+            [mongod, '--replSet', 'rs0', '--port', str(self.port), '--bind_ip', '127.0.0.1',
+             '--dbpath', self.dbpath, '--quiet'], stdout=subprocess.DEVNULL)
+        client = MongoClient(port=self.port, directConnection=True, serverSelectionTimeoutMS=1000)
+        wait_until(lambda: client.admin.command('ping'), 'mongod')
+        members = [{'_id': 0, 'host': f'127.0.0.1:{self.port}'}]
+        client.admin.command('replSetInitiate', {'_id': 'rs0', 'members': members})
+        wait_until(lambda: client.admin.command('hello')['isWritablePrimary'], 'The replica set primary')
+        client.close()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+        shutil.rmtree(self.dbpath, ignore_errors=True)
+
+
+class Service:
+    # A service served by gunicorn, with its production settings - from its directory, importing the shared modules
+    # from the repository root. Its schema is migrated first, as in its container
+    def __init__(self, name, port, env, ready_path):
+        self.name = name
+        self.url = f'http://127.0.0.1:{port}'
+        cwd = os.path.join(ROOT, name)
+        env = dict(os.environ, PORT=str(port), LOG_LEVEL='WARNING', PYTHONPATH=ROOT, **env)
+        subprocess.run([sys.executable, '-m', 'services.schema_manager', 'migrate'], cwd=cwd, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'], cwd=cwd, env=env)
+        wait_until(lambda: self.process.poll() is None and requests.get(self.url + ready_path, timeout=1).ok, name)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    mongo = None
+    mongo_uri = args.mongo_uri
+    if not mongo_uri:
+        mongod = shutil.which('mongod')
+        if not mongod:
+            sys.exit("No --mongo-uri given and no 'mongod' found on the PATH")
+        mongo = ThrowawayMongo(mongod)
+        mongo_uri = mongo.uri
+
+    stub = start_stub_google_books()
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'seed': args.seed,
+            'mix': DEFAULT_MIX,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'results': {},
+    }
+
+    try:
+        for size in args.size.split(','):
+            logger.info("Seeding %s books", size)
+            book_ids, isbns = seed(mongo_uri, parse_size(size), args.seed)
+
+            books_port, loans_port = free_port(), free_port()
+            common_env = {'WEB_CONCURRENCY': str(args.workers)}
+            # The services apply their schema on startup, so they're started after every seeding
+            books = Service('books', books_port, dict(
+                common_env, MONGO_URI=mongo_uri, GOOGLE_BOOKS_API_URL=stub_url(stub),
+                LOANS_SERVICE_URLS=f'http://127.0.0.1:{loans_port}'), '/books?limit=1')
+            try:
+                loans = Service('loans', loans_port, dict(
+                    common_env, MONGO_URI=with_database(mongo_uri, LOANS_DB), BOOKS_SERVICE_URL=books.url),
+                    '/loans?limit=1')
+                try:
+                    logger.info("Running the workload against %s books", size)
+                    report['results'][size] = run_workload(books.url, loans.url, book_ids, isbns, DEFAULT_MIX,
+                                                           args.concurrency, args.duration, args.warmup, args.seed)
+                finally:
+                    loans.stop()
+            finally:
+                books.stop()
+    finally:
+        stub.shutdown()
+        if mongo:
+            mongo.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+        logger.info("Wrote the report to %s", args.output)
+    else:
+        print(output)
+
+
+def compare(args):
+    # Compare the p95 latency of every route of two reports, failing on regressions beyond the threshold
+    with open(args.old) as file:
+        old = json.load(file)['results']
+    with open(args.new) as file:
+        new = json.load(file)['results']
+
+    regressions = 0
+    print(f"{'size':>6}  {'route':<28} {'old p95':>10} {'new p95':>10} {'change':>8}")
+    for size in sorted(set(old) & set(new), key=parse_size):
+        for route in sorted(set(old[size]['routes']) & set(new[size]['routes'])):
+            old_p95 = old[size]['routes'][route].get('p95_ms')
+            new_p95 = new[size]['routes'][route].get('p95_ms')
+            if not old_p95 or new_p95 is None:
+                continue
+            change = new_p95 / old_p95 - 1
+            regressed = change > args.threshold
+            regressions += regressed
+            print(f"{size:>6}  {route:<28} {old_p95:>10.2f} {new_p95:>10.2f} {change:>+8.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+
+    if regressions:
+        print(f"{regressions} route(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the books and loans services with a mixed workload")
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help="Seed, serve and load the services, and report the latencies")
+    run_parser.add_argument('--mongo-uri', help="MongoDB replica set to use - a throwaway mongod by default. "
+                                                "Its 'books', 'ratings' and 'bench_loans' databases are replaced")
+    run_parser.add_argument('--size', default='1k,100k,1m', help="Comma separated catalog sizes, e.g. '1k,100k,1m'")
+    run_parser.add_argument('--duration', type=float, default=60, help="Measured seconds per catalog size")
+    run_parser.add_argument('--warmup', type=float, default=10, help="Unmeasured seconds before the measurement")
+    run_parser.add_argument('--concurrency', type=int, default=32, help="Number of concurrent clients")
+    run_parser.add_argument('--workers', type=int, default=os.cpu_count(), help="gunicorn workers per service")
+    run_parser.add_argument('--seed', type=int, default=0, help="Random seed of the catalog and the workload")
+    run_parser.add_argument('--output', help="File to write the JSON report to, stdout by default")
+
+    compare_parser = subparsers.add_parser('compare', help="Compare two reports, exiting with 1 on p95 regressions")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help="Allowed p95 increase, as a fraction")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'compare':
+        compare(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
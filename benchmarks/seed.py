@@ -0,0 +1,69 @@
+import os
+import sys
+import random
+import logging
+from bson import ObjectId
+from pymongo import MongoClient
+
+# The books service models, so the seeded documents have the service's own shape
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'books'))
+from models.book import Book  # noqa: E402
+from models.rating import RATING_VALUES, Rating  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+GENRES = ['Fiction', 'Children', 'Biography', 'Science', 'Science Fiction', 'Fantasy', 'Other']
+# Number of distinct titles - so that title filters match a few books each
+TITLES = 10000
+# Documents inserted per insert_many call
+SEED_BATCH_SIZE = 10000
+# Maximal number of seeded votes of a book
+MAX_VOTES = 20
+
+# Databases of the services - the books service's names are fixed, the loans service's comes from its MONGO_URI
+BOOKS_DB = 'books'
+RATINGS_DB = 'ratings'
+LOANS_DB = 'bench_loans'
+
+
+def seeded_isbn(index):
+    return f'978{index:010d}'
+
+
+def seed(mongo_uri, size, random_seed=0):
+    # Replace the services' databases with a catalog of 'size' books, each with a rating of random votes.
+    # Returns the books' IDs and ISBNs
+    rng = random.Random(random_seed)
+    client = MongoClient(mongo_uri)
+    for db_name in (BOOKS_DB, RATINGS_DB, LOANS_DB):
+        client.drop_database(db_name)
+    books_collection = client[BOOKS_DB]['books']
+    ratings_collection = client[RATINGS_DB]['ratings']
+
+    book_ids = []
+    isbns = []
+    for start in range(0, size, SEED_BATCH_SIZE):
+        books = []
+        ratings = []
+        for index in range(start, min(start + SEED_BATCH_SIZE, size)):
+            book = Book(f'Title {rng.randrange(TITLES)}', seeded_isbn(index), rng.choice(GENRES))
+            book.authors = f'Author {rng.randrange(1000)} and Author {rng.randrange(1000)}'
+            book.publisher = f'Publisher {rng.randrange(100)}'
+            book.published_date = f'{rng.randrange(1950, 2025)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}'
+            book_id = ObjectId()
+            books.append(dict(book.to_dict(), _id=book_id))
+
+            rating = Rating(book.title)
+            for _ in range(rng.randrange(MAX_VOTES + 1)):
+                rating.add_value(rng.choice(RATING_VALUES))
+            ratings.append(dict(rating.to_dict(), _id=book_id))
+
+            book_ids.append(str(book_id))
+            isbns.append(book.isbn)
+
+        books_collection.insert_many(books, ordered=False)
+        ratings_collection.insert_many(ratings, ordered=False)
+        logger.info("Seeded %s of %s books", len(book_ids), size)
+
+    client.close()
+    return book_ids, isbns
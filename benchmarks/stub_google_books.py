@@ -0,0 +1,46 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# ISBNs starting with this prefix have no Google Books items
+UNKNOWN_ISBN_PREFIX = '0000'
+
+
+class GoogleBooksHandler(BaseHTTPRequestHandler):
+    # Answers '/volumes?q=isbn:<isbn>' like the Google Books API, with data derived from the ISBN
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query).get('q', [''])[0]
+        isbn = query.split(':', 1)[1] if query.startswith('isbn:') else ''
+
+        if not isbn or isbn.startswith(UNKNOWN_ISBN_PREFIX):
+            body = {'kind': 'books#volumes', 'totalItems': 0}
+        else:
+            body = {'kind': 'books#volumes', 'totalItems': 1, 'items': [{'volumeInfo': {
+                'authors': [f'Author {isbn[-3:]}', f'Author {isbn[-5:-3]}'],
+                'publisher': f'Publisher {isbn[-2:]}',
+                'publishedDate': f'{1950 + int(isbn[-2:])}-01-01',
+            }}]}
+
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_google_books(port=0):
+    # Serve in a background thread, returns the server - its URL is the books service's GOOGLE_BOOKS_API_URL
+    server = ThreadingHTTPServer(('127.0.0.1', port), GoogleBooksHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='stub-google-books', daemon=True).start()
+    return server
+
+
+def stub_url(server):
+    return f'http://127.0.0.1:{server.server_address[1]}/volumes'
@@ -0,0 +1,161 @@
+import time
+import random
+import threading
+from collections import defaultdict, deque
+import requests
+
+from seed import GENRES, TITLES
+
+# Default weights of the mixed workload's operations
+DEFAULT_MIX = {
+    'books_by_genre': 20,
+    'books_by_title': 15,
+    'book_by_id': 20,
+    'top': 15,
+    'rate': 15,
+    'checkout': 13,
+    'create_book': 2,
+}
+
+# Seconds to wait for a response before counting the request as an error
+REQUEST_TIMEOUT = 30
+
+
+class Recorder:
+    # Latencies and statuses of the requests, per route
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.recording = False
+
+    def record(self, route, duration, status):
+        if not self.recording:
+            return
+        with self.lock:
+            self.latencies[route].append(duration)
+            self.statuses[route][str(status)] += 1
+
+    def report(self, duration):
+        routes = {}
+        with self.lock:
+            for route in sorted(self.latencies):
+                routes[route] = route_stats(self.latencies[route], self.statuses[route], duration)
+            all_latencies = [latency for latencies in self.latencies.values() for latency in latencies]
+            all_statuses = defaultdict(int)
+            for statuses in self.statuses.values():
+                for status, count in statuses.items():
+                    all_statuses[status] += count
+        return {'routes': routes, 'total': route_stats(all_latencies, all_statuses, duration)}
+
+
+def percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1, len(sorted_values) * percent // 100)
+    return round(sorted_values[index] * 1000, 2)
+
+
+def route_stats(latencies, statuses, duration):
+    latencies = sorted(latencies)
+    errors = sum(count for status, count in statuses.items() if status == 'error' or status.startswith('5'))
+    stats = {'requests': len(latencies), 'errors': errors, 'rps': round(len(latencies) / duration, 2),
+             'statuses': dict(sorted(statuses.items()))}
+    if latencies:
+        stats.update(p50_ms=percentile(latencies, 50), p95_ms=percentile(latencies, 95),
+                     p99_ms=percentile(latencies, 99), max_ms=round(latencies[-1] * 1000, 2))
+    return stats
+
+
+class Client:
+    # A simulated client - a keep-alive session issuing the workload's operations one after the other
+    def __init__(self, number, books_url, loans_url, book_ids, isbns, mix, recorder, random_seed):
+        self.number = number
+        self.books_url = books_url
+        self.loans_url = loans_url
+        self.book_ids = book_ids
+        self.isbns = isbns
+        self.recorder = recorder
+        self.rng = random.Random(random_seed * 1000 + number)
+        self.session = requests.Session()
+        self.operations = list(mix)
+        self.weights = [mix[operation] for operation in self.operations]
+        self.loans = deque()
+        self.created_books = 0
+
+    def request(self, route, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+            response.content  # read the whole body
+            status = response.status_code
+        except requests.exceptions.RequestException:
+            response = None
+            status = 'error'
+        self.recorder.record(route, time.perf_counter() - start, status)
+        return response
+
+    def run(self, stopped):
+        while not stopped.is_set():
+            operation = self.rng.choices(self.operations, self.weights)[0]
+            getattr(self, operation)()
+
+    def books_by_genre(self):
+        genre = self.rng.choice(GENRES)
+        self.request('GET /books?genre&limit', 'GET', f'{self.books_url}/books',
+                     params={'genre': genre, 'limit': 50})
+
+    def books_by_title(self):
+        title = f'Title {self.rng.randrange(TITLES)}'
+        self.request('GET /books?title', 'GET', f'{self.books_url}/books', params={'title': title})
+
+    def book_by_id(self):
+        book_id = self.rng.choice(self.book_ids)
+        self.request('GET /books/<id>', 'GET', f'{self.books_url}/books/{book_id}')
+
+    def top(self):
+        self.request('GET /top', 'GET', f'{self.books_url}/top')
+
+    def rate(self):
+        book_id = self.rng.choice(self.book_ids)
+        self.request('POST /ratings/<id>/values', 'POST', f'{self.books_url}/ratings/{book_id}/values',
+                     json={'value': self.rng.randrange(1, 6)})
+
+    def checkout(self):
+        # Every client is a member, returning their oldest loan before a new one once they're at the limit
+        if len(self.loans) >= 2:
+            loan_id = self.loans.popleft()
+            self.request('DELETE /loans/<id>', 'DELETE', f'{self.loans_url}/loans/{loan_id}')
+
+        loan = {'memberName': f'member-{self.number}', 'ISBN': self.rng.choice(self.isbns), 'loanDate': '2024-01-01'}
+        response = self.request('POST /loans', 'POST', f'{self.loans_url}/loans', json=loan)
+        if response is not None and response.status_code == 201:
+            self.loans.append(response.json()['loanID'])
+
+    def create_book(self):
+        # New ISBNs, apart from the seeded ones - enriched from the stub Google Books API
+        self.created_books += 1
+        book = {'title': f'New Title {self.number}', 'ISBN': f'979{self.number:04d}{self.created_books:06d}',
+                'genre': self.rng.choice(GENRES)}
+        self.request('POST /books', 'POST', f'{self.books_url}/books', json=book)
+
+
+def run_workload(books_url, loans_url, book_ids, isbns, mix, concurrency, duration, warmup, random_seed):
+    # Drive the mixed workload with 'concurrency' clients, recording only after the warmup seconds
+    recorder = Recorder()
+    stopped = threading.Event()
+    clients = [Client(number, books_url, loans_url, book_ids, isbns, mix, recorder, random_seed)
+               for number in range(concurrency)]
+    threads = [threading.Thread(target=client.run, args=(stopped,), daemon=True) for client in clients]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(warmup)
+    recorder.recording = True
+    start = time.perf_counter()
+    time.sleep(duration)
+    recorder.recording = False
+    measured = time.perf_counter() - start
+
+    stopped.set()
+    for thread in threads:
+        thread.join(REQUEST_TIMEOUT)
+    return recorder.report(measured)
@@ -1,12 +1,23 @@
 import os
 from flask import Flask
-from controllers import controllers_bp
+from common.json_provider import configure_json
+from common.metrics import configure_metrics
+from common.structured_logging import configure_logging
+
+# Set up logging before anything logs
+configure_logging()
+
+from controllers import controllers_bp, init_worker_process
 
 app = Flask(__name__)
+configure_json(app)
+configure_metrics(app)
 app.register_blueprint(controllers_bp)
 
 # Get the port from the environment variable, default to 5001 if not set
 port = int(os.environ.get("PORT", 5001))
 
+# Development server - in production the app is served by gunicorn, see gunicorn.conf.py
 if __name__ == '__main__':
+    init_worker_process()
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,49 @@
+import os
+import asyncio
+from quart import Quart
+from common.json_provider import configure_json
+from common.metrics import configure_async_metrics
+from common.structured_logging import configure_logging
+
+# Set up logging before anything logs
+configure_logging()
+
+from async_controllers import controllers_bp, init_event_loop, shutdown_event_loop
+from services.mongodb_service import MongoDBService
+from services.schema_manager import check_schema
+
+# asyncio variant of app.py - served by an ASGI server, e.g. 'hypercorn -b 0.0.0.0:5001 asgi_app:app'
+app = Quart(__name__)
+# No limit on the request bodies, as with Flask - the imports stream whole catalogs
+app.config['MAX_CONTENT_LENGTH'] = None
+configure_json(app)
+configure_async_metrics(app)
+app.register_blueprint(controllers_bp)
+
+
+# Checks the schema version, and relays the outbox events in a background thread
+blocking_mongodb_service = None
+
+
+@app.before_serving
+async def startup():
+    # Check the schema version with the blocking driver, then serve with the asyncio one
+    global blocking_mongodb_service
+    blocking_mongodb_service = await asyncio.to_thread(MongoDBService, books_db_name='books',
+                                                       ratings_db_name='ratings')
+    await asyncio.to_thread(check_schema, blocking_mongodb_service)
+    await init_event_loop(blocking_mongodb_service)
+
+
+@app.after_serving
+async def shutdown():
+    await shutdown_event_loop()
+    blocking_mongodb_service.client.close()
+
+
+# Get the port from the environment variable, default to 5001 if not set
+port = int(os.environ.get("PORT", 5001))
+
+# Development server
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=port)
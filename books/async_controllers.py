@@ -0,0 +1,733 @@
+import json
+import asyncio
+import inspect
+import logging
+import functools
+from bson import ObjectId
+from quart import Blueprint, Response, current_app, jsonify, make_response, request, stream_with_context
+from common.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry as metrics_registry
+from common.stats_cache import StatsCache
+from common.transfer import (GZIP_CONTENT_TYPE, NDJSON_CONTENT_TYPE, ExportWriter, Importer, ImportFailed,
+                             export_cursor, export_headers, get_export_args, get_import_args)
+from common.pagination import (PAGINATION_PARAMS, STREAM_CHUNK_SIZE, STREAM_FORMATS, get_pagination_args,
+                               stream_delimiters)
+from models.book import Book, BOOK_FIELDS, PENDING
+from models.rating import Rating, RATING_FIELDS, TOP_RATED_MIN_VALUES
+from controllers import (ADMIN_API_KEY, API_KEY, BULK_ENRICHMENT_WORKERS, BULK_MAX_BOOKS, ENRICHMENT_MODE,
+                         ENRICHMENT_STOP_TIMEOUT, ISBN_BATCH_MAX, PUBLISHED_DATE_RANGE_PARAMS, RATINGS_WRITE_MODE,
+                         TRANSFER_COLLECTIONS, book_filter_by_field, books_read_key, books_reads, catalog_statistics,
+                         get_books_sort, get_bulk_book, get_new_book_error, get_search_args, get_suggest_args,
+                         get_updated_book_errors, set_authors_publisher_published_date, top_reads,
+                         transfer_collections, validate_query_params)
+from services import async_google_books_service
+from services.async_enrichment_worker import AsyncEnrichmentWorkers
+from services.async_google_books_service import AsyncGoogleBooksCache
+from services.async_mongodb_service import AsyncMongoDBService
+from services.loans_service import LoansServiceClient
+from services.outbox_relay import OutboxRelay
+from services.suggest_index import SuggestIndex
+from services.vote_buffer import VOTE_ACK, VOTE_FLUSH_TIMEOUT, VoteBuffer
+from services.http_caching import catalog_etag, catalog_last_modified, set_catalog_cache_headers
+
+# asyncio version of the controllers_bp routes of controllers.py - same URLs, validation and responses
+controllers_bp = Blueprint('async_controllers', __name__)
+
+logger = logging.getLogger(__name__)
+
+# Created when the app starts serving, on its event loop - see init_event_loop
+mongodb_service = None
+google_books_cache = None
+enrichment_workers = None
+outbox_relay = None
+suggest_index = None
+stats_cache = None
+# MongoDBService of the imports, written in a thread
+import_mongodb_service = None
+vote_buffer = None
+
+
+async def init_event_loop(blocking_mongodb_service):
+    # The outbox relay and the suggestions index are background threads over a MongoDBService, and the statistics
+    # are computed by it in a thread
+    global mongodb_service, google_books_cache, enrichment_workers, outbox_relay, suggest_index, stats_cache
+    global import_mongodb_service, vote_buffer
+    outbox_relay = OutboxRelay(blocking_mongodb_service, LoansServiceClient().deliver_book_events)
+    outbox_relay.start()
+    suggest_index = SuggestIndex(blocking_mongodb_service)
+    suggest_index.start()
+    stats_cache = StatsCache(blocking_mongodb_service, catalog_statistics(blocking_mongodb_service))
+    import_mongodb_service = blocking_mongodb_service
+    # The buffered votes are written by a thread too, which bumps the ratings version of the direct ones
+    vote_buffer = VoteBuffer(blocking_mongodb_service)
+    vote_buffer.start()
+    mongodb_service = AsyncMongoDBService(books_db_name='books', ratings_db_name='ratings')
+    google_books_cache = AsyncGoogleBooksCache(mongodb_service.google_books_cache_collection)
+    async_google_books_service.open_google_books_client(google_books_cache)
+    enrichment_workers = AsyncEnrichmentWorkers(mongodb_service, enrich_book, give_up_enrich_book)
+    enrichment_workers.start()
+
+
+async def shutdown_event_loop():
+    if vote_buffer:
+        await asyncio.to_thread(vote_buffer.stop, timeout=ENRICHMENT_STOP_TIMEOUT)
+    await enrichment_workers.stop(timeout=ENRICHMENT_STOP_TIMEOUT)
+    await asyncio.to_thread(outbox_relay.stop, timeout=ENRICHMENT_STOP_TIMEOUT)
+    await asyncio.to_thread(suggest_index.stop, timeout=ENRICHMENT_STOP_TIMEOUT)
+    await async_google_books_service.close_google_books_client()
+    mongodb_service.client.close()
+
+
+def conditional_get(*collections):
+    # See controllers.conditional_get
+    def decorator(view):
+        @functools.wraps(view)
+        async def conditional_view(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view(*args, **kwargs)
+
+            try:
+                versions = await mongodb_service.get_versions(collections)
+            except Exception as e:
+                logger.warning("Error fetching collection versions: %s", e)
+                return await view(*args, **kwargs)
+
+            etag = catalog_etag(versions, collections, request.full_path)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class('', status=304)
+            else:
+                response = await make_response(await view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            return set_catalog_cache_headers(response, etag, catalog_last_modified(versions))
+        return conditional_view
+    return decorator
+
+
+# Define /books route for GET and POST requests
+@controllers_bp.route('/books', methods=['GET', 'POST'])
+@conditional_get('books')
+async def books():
+    if request.method == 'GET':
+        keys = list(request.args.keys())
+
+        # Define a list of allowed query parameters
+        allowed_params = {'id', 'ID', 'title', 'authors', 'isbn', 'ISBN', 'genre', 'publisher', 'publishedDate'}
+        list_params = PAGINATION_PARAMS | PUBLISHED_DATE_RANGE_PARAMS | {'sort'}
+        # Check for invalid query parameters
+        invalid_params = [key for key in keys if key not in allowed_params | list_params]
+        if invalid_params:
+            parameters_allowed = (allowed_params | list_params) - {'id', 'isbn'}
+            return jsonify({"error": f"Invalid query parameters: {', '.join(invalid_params)}. "
+                                     f"Parameters allowed - {parameters_allowed}"}), 422
+
+        # Validate parameters' values
+        errors = validate_query_params(request.args)
+        if errors:
+            return jsonify(errors), 422
+
+        pagination, errors = get_pagination_args(request.args, BOOK_FIELDS)
+        if errors:
+            return jsonify(errors), 422
+
+        # Collect the (field, value) filters of the query, to be matched by the database
+        filters = []
+        for key in keys:
+            if key in allowed_params and (key + '=') in request.url:
+                for value in request.args.getlist(key):
+                    filters.append(book_filter_by_field(key, value))
+            if key in PUBLISHED_DATE_RANGE_PARAMS:
+                for value in request.args.getlist(key):
+                    filters.append((key, value))
+
+        try:
+            # Return a list of all the books, or a page of them - see controllers.books
+            sort = get_books_sort(request.args)
+            if pagination['stream']:
+                res_books = await mongodb_service.iter_books(filters, pagination['limit'], pagination['after'],
+                                                             pagination['fields'], sort)
+            else:
+                res_books = await books_reads.do_async(books_read_key(filters, pagination, sort), lambda: read_all(
+                    mongodb_service.iter_books(filters, pagination['limit'], pagination['after'], pagination['fields'],
+                                               sort)))
+            return await list_response(res_books, pagination, 'id')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 422
+        except Exception as e:
+            error_message = f"Error fetching books from the database: {str(e)}"
+            return jsonify({'error': error_message}), 500
+
+    elif request.method == 'POST':
+        # Check if the request content type is JSON
+        if request.content_type != 'application/json':
+            return jsonify({"error": "Unsupported media type. Only JSON data is supported."}), 415
+
+        # Get the JSON data from the request
+        book_data = await request.get_json()
+        title = book_data.get('title')
+        genre = book_data.get('genre')
+        isbn = book_data.get('isbn')
+        if not isbn:
+            isbn = book_data.get('ISBN')
+
+        if not title or not isbn or not genre:
+            return jsonify({"error": "Please provide all three fields - 'title', 'ISBN', and 'genre'"}), 422
+
+        try:
+            found_book = await mongodb_service.get_book_by_isbn(isbn)
+            if found_book:
+                return jsonify({"error": "There already exists a book with the provided ISBN number"}), 422
+        except Exception as e:
+            error_message = f"Error accessing the database: {str(e)}"
+            return jsonify({'error': error_message}), 500
+
+        error = get_new_book_error(title, isbn, genre)
+        if error:
+            return jsonify(error), 422
+
+        # Set new book instance with received data - 'title', 'ISBN', 'genre'
+        new_book = Book(title, isbn, genre)
+
+        # Get additional book data - 'authors', 'publisher', 'publishedDate' - from the Google Books API,
+        # either now or in the background
+        enrich_async = ENRICHMENT_MODE == 'async' or 'respond-async' in request.headers.get('Prefer', '')
+        if enrich_async:
+            new_book.authors = new_book.publisher = new_book.published_date = PENDING
+        else:
+            res_err = await load_authors_publisher_published_date(new_book)
+            if res_err:
+                return jsonify(res_err[0]), res_err[1]
+
+        try:
+            # Insert the new Book instance and its Rating instance, using the book's ID as the rating's ID
+            book_id = await mongodb_service.insert_book_with_rating(new_book, Rating(new_book.title))
+            logger.info("Inserted book and rating with ID: %s", book_id)
+
+            if enrich_async:
+                # Queue the book for the enrichment workers
+                job_id = await mongodb_service.insert_enrichment_job(book_id, new_book.isbn)
+                enrichment_workers.notify()
+                logger.info("Inserted enrichment job with ID: %s", job_id)
+
+        except Exception as e:
+            error_message = f"Error storing data in database: {str(e)}"
+            return jsonify({'error': error_message}), 500
+
+        if enrich_async:
+            return jsonify({"bookID": f"{book_id}"}), 202, {'Location': f"/books/{book_id}/enrichment"}
+
+        return jsonify({"bookID": f"{book_id}"}), 201
+
+
+async def load_authors_publisher_published_date(book):
+    res = await async_google_books_service.get_book_authors_publisher_published_date(book.isbn)
+    return set_authors_publisher_published_date(book, res)
+
+
+async def enrich_book(job):
+    # Load the Google Books API data of a book created with asynchronous enrichment
+    book = Book(None, job['ISBN'], None)
+    res_err = await load_authors_publisher_published_date(book)
+    if res_err:
+        return res_err
+
+    await mongodb_service.update_pending_book(job['bookId'], {
+        'authors': book.authors,
+        'publisher': book.publisher,
+        'publishedDate': book.published_date
+    })
+
+
+async def give_up_enrich_book(job):
+    # The Google Books API data of the book couldn't be loaded
+    await mongodb_service.update_pending_book(job['bookId'], {
+        'authors': 'missing',
+        'publisher': 'missing',
+        'publishedDate': 'missing'
+    })
+
+
+# Define /books/search route for GET request
+@controllers_bp.route('/books/search', methods=['GET'])
+@conditional_get('books')
+async def search_books():
+    search, errors = get_search_args(request.args)
+    if errors:
+        return jsonify(errors), 422
+
+    try:
+        return jsonify(await mongodb_service.search_books(search['q'], search['limit'], search['fields'])), 200
+    except Exception as e:
+        error_message = f"Error searching books in the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+# Define /books/suggest route for GET request
+@controllers_bp.route('/books/suggest', methods=['GET'])
+async def suggest_books():
+    suggest, errors = get_suggest_args(request.args)
+    if errors:
+        return jsonify(errors), 422
+
+    suggestions = suggest_index.suggest(suggest['prefix'], suggest['limit'])
+    if suggestions is None:
+        try:
+            suggestions = await mongodb_service.get_books_by_title_prefix(suggest['prefix'], suggest['limit'])
+        except Exception as e:
+            error_message = f"Error fetching books from the database: {str(e)}"
+            return jsonify({'error': error_message}), 500
+    return jsonify(suggestions), 200
+
+
+# Define /books/bulk route for POST request - create many books at once, from a JSON array or NDJSON
+@controllers_bp.route('/books/bulk', methods=['POST'])
+async def books_bulk():
+    if request.mimetype == 'application/json':
+        books_data = await request.get_json(silent=True)
+        if not isinstance(books_data, list):
+            return jsonify({"error": "Request body must be a JSON array of books"}), 422
+    elif request.mimetype == 'application/x-ndjson':
+        try:
+            body = await request.get_data(as_text=True)
+            books_data = [json.loads(line) for line in body.splitlines() if line.strip()]
+        except ValueError as e:
+            return jsonify({"error": f"Invalid NDJSON request body: {str(e)}"}), 422
+    else:
+        return jsonify({"error": "Unsupported media type. Only JSON and NDJSON data are supported."}), 415
+
+    if len(books_data) > BULK_MAX_BOOKS:
+        return jsonify({"error": f"At most {BULK_MAX_BOOKS} books can be created in a single request"}), 413
+
+    # Validate every book, and set new book instances for the valid ones
+    results = [{"index": index} for index in range(len(books_data))]
+    new_books = {}
+    for index, book_data in enumerate(books_data):
+        book, error = get_bulk_book(book_data)
+        if error:
+            results[index].update(status=422, **error)
+        else:
+            results[index]['ISBN'] = book.isbn
+            new_books[index] = book
+
+    # Reject ISBNs repeated in the request or already stored, with a single query
+    try:
+        existing_isbns = await mongodb_service.get_existing_isbns([book.isbn for book in new_books.values()])
+    except Exception as e:
+        error_message = f"Error accessing the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+    seen_isbns = set()
+    for index, book in list(new_books.items()):
+        if book.isbn in existing_isbns or book.isbn in seen_isbns:
+            results[index].update(status=422, error="There already exists a book with the provided ISBN number")
+            del new_books[index]
+        seen_isbns.add(book.isbn)
+
+    # Get additional books' data from the Google Books API, at most BULK_ENRICHMENT_WORKERS calls at a time
+    books_to_load = {index: book for index, book in new_books.items() if book.authors is None}
+    semaphore = asyncio.Semaphore(BULK_ENRICHMENT_WORKERS)
+
+    async def load(book):
+        async with semaphore:
+            return await load_authors_publisher_published_date(book)
+
+    load_results = await asyncio.gather(*(load(book) for book in books_to_load.values()))
+    for index, res_err in zip(books_to_load, load_results):
+        if res_err:
+            results[index].update(status=res_err[1], **res_err[0])
+            del new_books[index]
+
+    # Insert the new books and their ratings, each in a single batch
+    if new_books:
+        try:
+            book_ids, errors = await mongodb_service.insert_books_with_ratings(
+                list(new_books.values()), [Rating(book.title) for book in new_books.values()])
+            for index, book_id, error in zip(new_books, book_ids, errors):
+                if error:
+                    results[index].update(status=500, error=f"Error storing data in database: {error}")
+                else:
+                    results[index].update(status=201, bookID=f"{book_id}")
+
+        except Exception as e:
+            error_message = f"Error storing data in database: {str(e)}"
+            return jsonify({'error': error_message}), 500
+
+    created = sum(1 for result in results if result['status'] == 201)
+    return jsonify({"created": created, "failed": len(results) - created, "results": results}), 200
+
+
+# Define /books/{id} route for GET, DELETE and PUT requests
+@controllers_bp.route('/books/<id>', methods=['GET', 'DELETE', 'PUT'])
+@conditional_get('books')
+async def book_by_id(id):
+    try:
+        # Attempt to get the book from the database
+        book = await mongodb_service.get_book(id)
+
+        if book:
+            if request.method == 'GET':
+                return jsonify(book), 200
+
+            elif request.method == 'DELETE':
+                # Delete the book and its ratings, and let the loans service know
+                await mongodb_service.delete_book_with_rating(id)
+                outbox_relay.notify()
+                return jsonify({"success": f"Book with ID={id} has been successfully deleted"}), 200
+
+            elif request.method == 'PUT':
+                # Check if the request content type is JSON
+                if request.content_type != 'application/json':
+                    return jsonify({"error": "Unsupported media type. Only JSON data is supported"}), 415
+
+                updated_book_data = await request.get_json()
+                errors = get_updated_book_errors(updated_book_data)
+                if errors:
+                    return jsonify(errors), 422
+
+                # Update the book and the relevant book title in the ratings db as well, and let the loans service know
+                await mongodb_service.update_book_with_rating(id, updated_book_data)
+                outbox_relay.notify()
+
+                return jsonify({"success": f"Book with ID={id} has been successfully updated"}), 200
+
+        # If no book was found with the given ID
+        return jsonify({"error": f"No book found with ID={id}"}), 404
+
+    except Exception as e:
+        error_message = f"Error accessing the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+# Define /books/{id}/enrichment route for GET request - the status of a book's asynchronous enrichment
+@controllers_bp.route('/books/<id>/enrichment', methods=['GET'])
+async def book_enrichment(id):
+    try:
+        job = await mongodb_service.get_enrichment_job(id)
+        if not job:
+            return jsonify({"error": f"No enrichment job found for book with ID={id}"}), 404
+
+        return jsonify({
+            "bookID": id,
+            "status": job['status'],
+            "attempts": job['attempts'],
+            "error": job['error'],
+            "nextAttemptAt": job['nextAttemptAt'],
+            "updatedAt": job['updatedAt']
+        }), 200
+
+    except Exception as e:
+        error_message = f"Error accessing the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+# Define a /ratings route for GET request
+@controllers_bp.route('/ratings', methods=['GET'])
+@conditional_get('ratings')
+async def get_all_ratings():
+    pagination, errors = get_pagination_args(request.args, RATING_FIELDS)
+    if errors:
+        return jsonify(errors), 422
+
+    try:
+        ratings = mongodb_service.iter_ratings(pagination['limit'], pagination['after'], pagination['fields'])
+        return await list_response(ratings, pagination, 'id')
+    except Exception as e:
+        error_message = f"Error fetching ratings from the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+# Define a /ratings/{id} route for GET request
+@controllers_bp.route('/ratings/<id>', methods=['GET'])
+@conditional_get('ratings')
+async def get_rating(id):
+    try:
+        rating = await mongodb_service.get_rating(id)
+        if not rating:
+            return jsonify({"error": f"ID={id} not found"}), 404
+        rating['id'] = str(rating.pop('_id'))  # change _id to id and convert ObjectId to string
+        return jsonify(rating), 200
+
+    except Exception as e:
+        error_message = f"Error fetching rating from the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+# Define a /ratings/{id}/values route for POST request
+@controllers_bp.route('/ratings/<id>/values', methods=['POST'])
+async def ratings_id_value(id):
+    try:
+        # Unknown books first, whatever the request body
+        if not await mongodb_service.rating_exists(id):
+            return jsonify({"error": f"ID={id} not found"}), 404
+
+        # Check if the request content type is JSON
+        if request.content_type != 'application/json':
+            return jsonify({"error": "Unsupported media type. Only JSON data is supported."}), 415
+
+        # Extract the value from the JSON request
+        data = await request.get_json()
+        if 'value' not in data:
+            return jsonify({"error": "Missing 'value' field in the request body"}), 422
+        new_value = data.get('value')
+
+        # Validate the value
+        if not new_value or not isinstance(new_value, int) or new_value < 1 or new_value > 5:
+            return jsonify({"error": "Invalid rating value. Must be an integer between 1 and 5."}), 422
+
+        flushed = False
+        if RATINGS_WRITE_MODE == 'buffered':
+            # See controllers.ratings_id_value - the flush is awaited without holding a thread
+            rating_id = str(ObjectId(id))
+            batch = vote_buffer.add(rating_id, new_value)
+            if VOTE_ACK == 'buffer':
+                return jsonify({"status": "accepted"}), 202
+            flushed = await wait_for_flush(batch, VOTE_FLUSH_TIMEOUT)
+            if not flushed and not vote_buffer.withdraw(batch, rating_id, new_value):
+                if not await wait_for_flush(batch, VOTE_FLUSH_TIMEOUT):
+                    return jsonify({"status": "accepted"}), 202
+                flushed = True
+            if flushed:
+                average = batch.result(rating_id)
+        if not flushed:
+            # Add the new rating value and get the updated average, in a single atomic update
+            rating = await mongodb_service.add_rating_value(id, new_value)
+            average = rating['average'] if rating else None
+            if rating:
+                vote_buffer.add_written()
+        if average is None:
+            return jsonify({"error": f"ID={id} not found"}), 404
+
+        return jsonify({"average": f"{average}"}), 201
+
+    except Exception as e:
+        error_message = f"Error accessing the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+async def wait_for_flush(batch, timeout):
+    # Wait until the votes batch is written, by the vote buffer's thread - returns whether it was within the timeout
+    loop = asyncio.get_running_loop()
+    flushed = asyncio.Event()
+    batch.add_done_callback(lambda: loop.call_soon_threadsafe(flushed.set))
+    try:
+        await asyncio.wait_for(flushed.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+# Define a /top route for GET request
+@controllers_bp.route('/top', methods=['GET'])
+@conditional_get('ratings')
+async def top_rated_books():
+    try:
+        top_books_ratings = await top_reads.do_async(
+            'top', lambda: mongodb_service.get_top_ratings(TOP_RATED_MIN_VALUES, 3))
+    except Exception as e:
+        error_message = f"Error fetching ratings from the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+    return jsonify([{
+        "id": book_rating['id'],
+        "title": book_rating['title'],
+        "average": book_rating['average']
+    } for book_rating in top_books_ratings]), 200
+
+
+# Define a /google-books/cache route for GET request - the Google Books lookups cache counters
+@controllers_bp.route('/google-books/cache', methods=['GET'])
+async def get_google_books_cache_stats():
+    return jsonify(google_books_cache.stats()), 200
+
+
+# Define a /outbox/stats route for GET request - the delivery of the books' events to the loans service
+@controllers_bp.route('/outbox/stats', methods=['GET'])
+async def get_outbox_stats():
+    try:
+        return jsonify(await asyncio.to_thread(outbox_relay.stats)), 200
+    except Exception as e:
+        error_message = f"Error accessing the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+# Define /stats route for GET request
+@controllers_bp.route('/stats', methods=['GET'])
+async def get_all_stats():
+    try:
+        return jsonify({name: await asyncio.to_thread(stats_cache.get, name) for name in stats_cache.names()}), 200
+    except Exception as e:
+        error_message = f"Error computing statistics: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+# Define /stats/<name> route for GET request
+@controllers_bp.route('/stats/<name>', methods=['GET'])
+async def get_stats(name):
+    if name not in stats_cache.names():
+        return jsonify({"error": f"No statistics named '{name}' - one of {', '.join(stats_cache.names())}"}), 404
+    try:
+        return jsonify(await asyncio.to_thread(stats_cache.get, name)), 200
+    except Exception as e:
+        error_message = f"Error computing statistics: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+def get_import_gzip():
+    # See controllers.get_import_gzip
+    if request.mimetype == GZIP_CONTENT_TYPE or request.content_encoding == 'gzip':
+        return True
+    return False if request.mimetype == NDJSON_CONTENT_TYPE else None
+
+
+# Define /admin/export route for GET request
+@controllers_bp.route('/admin/export', methods=['GET'])
+async def admin_export():
+    if request.headers.get('API-KEY') != ADMIN_API_KEY:
+        return jsonify({'error': 'Forbidden: Invalid API key'}), 403
+
+    export, errors = get_export_args(request.args, TRANSFER_COLLECTIONS)
+    if errors:
+        return jsonify(errors), 422
+
+    collections = transfer_collections(mongodb_service, export['collections'])
+    chunks = stream_with_context(export_chunks)(collections.items(), export['gzip'])
+    return Response(chunks, headers=export_headers('books', export['gzip'])), 200
+
+
+async def export_chunks(collections, gzip):
+    # See transfer.export_chunks - over Motor cursors
+    writer = ExportWriter(gzip)
+    for name, collection in collections:
+        async for document in export_cursor(collection):
+            chunk = writer.write(name, document)
+            if chunk:
+                yield chunk
+    yield writer.close()
+
+
+# Define /admin/import route for POST request - the documents are written in a thread, a batch at a time
+@controllers_bp.route('/admin/import', methods=['POST'])
+async def admin_import():
+    if request.headers.get('API-KEY') != ADMIN_API_KEY:
+        return jsonify({'error': 'Forbidden: Invalid API key'}), 403
+
+    gzip = get_import_gzip()
+    if gzip is None:
+        return jsonify({"error": f"Unsupported media type. Only {NDJSON_CONTENT_TYPE} data, "
+                                 f"optionally gzipped, is supported."}), 415
+
+    args, errors = get_import_args(request.args)
+    if errors:
+        return jsonify(errors), 422
+
+    importer = await asyncio.to_thread(
+        Importer, transfer_collections(import_mongodb_service), import_mongodb_service.import_checkpoints_collection,
+        args['mode'], args['checkpoint'], gzip)
+    try:
+        async for data in request.body:
+            await asyncio.to_thread(importer.feed, data)
+        return jsonify(await asyncio.to_thread(importer.finish)), 200
+    except ImportFailed as e:
+        return jsonify(dict(importer.summary(), error=str(e))), 422
+    except Exception as e:
+        error_message = f"Error importing into the database: {str(e)}"
+        return jsonify(dict(importer.summary(), error=error_message)), 500
+    finally:
+        await asyncio.to_thread(import_mongodb_service.finish_import, importer.counts)
+
+
+# Define a /metrics route for GET request - the requests, MongoDB commands and outgoing calls, for Prometheus
+@controllers_bp.route('/metrics', methods=['GET'])
+async def get_metrics():
+    return await asyncio.to_thread(metrics_registry.render), 200, {'Content-Type': METRICS_CONTENT_TYPE}
+
+
+@controllers_bp.route('/books/isbn/<isbn>', methods=['GET'])
+async def get_book_title_and_id(isbn):
+    # Check for the API key in the request headers
+    api_key = request.headers.get('API-KEY')
+    if api_key != API_KEY:
+        return jsonify({'error': 'Forbidden: Invalid API key'}), 403
+
+    try:
+        book = await mongodb_service.get_book_by_isbn(isbn)
+        if book:
+            return {
+                "title": book['title'],
+                "id": book['id']
+            }
+        else:
+            return {}
+
+    except Exception as e:
+        error_message = f"Error accessing the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+@controllers_bp.route('/books/isbn:batch', methods=['POST'])
+async def get_books_titles_and_ids():
+    # Check for the API key in the request headers
+    api_key = request.headers.get('API-KEY')
+    if api_key != API_KEY:
+        return jsonify({'error': 'Forbidden: Invalid API key'}), 403
+
+    # Check if the request content type is JSON
+    if request.content_type != 'application/json':
+        return jsonify({"error": "Unsupported media type. Only JSON data is supported."}), 415
+
+    isbns = (await request.get_json(silent=True) or {}).get('isbns')
+    if not isinstance(isbns, list) or not all(isinstance(isbn, str) for isbn in isbns):
+        return jsonify({"error": "Please provide 'isbns' - a list of ISBN strings"}), 422
+    if len(isbns) > ISBN_BATCH_MAX:
+        return jsonify({"error": f"At most {ISBN_BATCH_MAX} ISBNs can be resolved in a single request"}), 422
+
+    try:
+        books = await mongodb_service.get_books_by_isbns(isbns)
+        return jsonify({isbn: {"title": books[isbn]['title'], "id": books[isbn]['id']} if isbn in books else {}
+                        for isbn in isbns}), 200
+
+    except Exception as e:
+        error_message = f"Error accessing the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+async def read_all(items):
+    # The items of an async iterator, or of the one returned by an awaitable
+    if inspect.isawaitable(items):
+        items = await items
+    return [item async for item in items]
+
+
+async def list_response(items, pagination, id_key):
+    # See pagination.list_response - items is an async iterator, or a list when not streamed
+    if pagination['stream']:
+        chunks = stream_with_context(stream_items)(items, pagination['stream'])
+        return Response(chunks, mimetype=STREAM_FORMATS[pagination['stream']]), 200
+
+    if not isinstance(items, list):
+        items = await read_all(items)
+    response = jsonify(items)
+    if pagination['limit'] and len(items) == pagination['limit']:
+        response.headers['X-Next-After'] = items[-1][id_key]
+    return response, 200
+
+
+async def stream_items(items, stream_format):
+    dumps = current_app.json.dumps
+    opening, separator, closing = stream_delimiters(stream_format)
+
+    buffer = [opening]
+    buffer_size = 0
+    first = True
+    async for item in items:
+        document = dumps(item)
+        buffer.append(document if first else separator + document)
+        buffer_size += len(document) + 1
+        first = False
+        if buffer_size >= STREAM_CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            buffer_size = 0
+
+    if not first or stream_format == 'json':
+        buffer.append(closing)
+    yield ''.join(buffer)
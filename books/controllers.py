@@ -1,52 +1,201 @@
-from flask import Blueprint, jsonify, request
-from models.book import Book
-from models.rating import Rating
-from services.google_books_service import get_book_authors_publisher_published_date
-from services.mongodb_service import MongoDBService
+import os
+import json
+import logging
 import re
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from flask import Blueprint, Response, current_app, jsonify, make_response, request, stream_with_context
+from common.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry as metrics_registry
+from common.process_local import ProcessLocal
+from common.single_flight import SingleFlight
+from common.stats_cache import StatsCache
+from common.transfer import (GZIP_CONTENT_TYPE, NDJSON_CONTENT_TYPE, Importer, ImportFailed, export_chunks,
+                             export_headers, get_export_args, get_import_args, import_stream)
+from common.pagination import PAGINATION_PARAMS, get_pagination_args, list_response
+from models.book import Book, BOOK_FIELDS, PENDING, RANGE_OPERATORS, SORT_FIELDS, parse_published_date
+from models.rating import Rating, RATING_FIELDS, TOP_RATED_MIN_VALUES
+from services.google_books_cache import GoogleBooksCache
+from services.enrichment_worker import EnrichmentWorkers
+from services.google_books_service import get_book_authors_publisher_published_date, set_google_books_cache
+from services.http_caching import catalog_etag, catalog_last_modified, set_catalog_cache_headers
+from services.loans_service import LoansServiceClient
+from services.mongodb_service import MongoDBService
+from services.outbox_relay import OutboxRelay
+from services.schema_manager import check_schema
+from services.suggest_index import SUGGEST_MAX_LIMIT, SuggestIndex
+from services.vote_buffer import VOTE_ACK, VOTE_FLUSH_TIMEOUT, VoteBuffer
 
 controllers_bp = Blueprint('controllers', __name__)
 
-# Create a global instance of MongoDBService
-mongodb_service = MongoDBService(books_db_name='books', ratings_db_name='ratings')
+logger = logging.getLogger(__name__)
+
+# Range filters of GET /books, e.g. 'publishedDate[gte]=2010&publishedDate[lt]=2016'
+PUBLISHED_DATE_RANGE_PARAMS = {f'publishedDate[{operator}]' for operator in RANGE_OPERATORS}
+# Number of books returned by GET /books/search and suggestions by GET /books/suggest without a 'limit'
+SEARCH_DEFAULT_LIMIT = int(os.getenv('SEARCH_DEFAULT_LIMIT', 20))
+SUGGEST_DEFAULT_LIMIT = int(os.getenv('SUGGEST_DEFAULT_LIMIT', 10))
+# Maximal number of books created by a single POST /books/bulk request
+BULK_MAX_BOOKS = int(os.getenv('BULK_MAX_BOOKS', 5000))
+# Number of concurrent Google Books API calls of a single POST /books/bulk request
+BULK_ENRICHMENT_WORKERS = int(os.getenv('BULK_ENRICHMENT_WORKERS', 8))
+# Either 'sync' - POST /books waits for the Google Books API, or 'async' - the book's data is loaded in the
+# background and POST /books returns 202. A request may also ask for 'async' with a 'Prefer: respond-async' header
+ENRICHMENT_MODE = os.getenv('ENRICHMENT_MODE', 'sync')
+# Seconds to wait for the running enrichment jobs when a worker process exits
+ENRICHMENT_STOP_TIMEOUT = float(os.getenv('ENRICHMENT_STOP_TIMEOUT', 10))
+# Either 'direct' - every POST /ratings/{id}/values updates its rating, or 'buffered' - the votes are buffered and
+# written in batches, see VoteBuffer
+RATINGS_WRITE_MODE = os.getenv('RATINGS_WRITE_MODE', 'direct')
+
+# Create a global instance of MongoDBService, connecting on first use in every worker process
+mongodb_service = ProcessLocal(lambda: MongoDBService(books_db_name='books', ratings_db_name='ratings'))
+
+# Cache the Google Books lookups in-process and in MongoDB
+google_books_cache = ProcessLocal(lambda: GoogleBooksCache(mongodb_service.google_books_cache_collection))
+set_google_books_cache(google_books_cache)
+
+# Load the Google Books API data of books created with asynchronous enrichment in the background
+# (the handlers are defined below, hence looked up when called)
+enrichment_workers = ProcessLocal(lambda: EnrichmentWorkers(mongodb_service, lambda job: enrich_book(job),
+                                                            lambda job: give_up_enrich_book(job)))
+
+# Deliver the books' update and delete events to the loans service in the background
+outbox_relay = ProcessLocal(lambda: OutboxRelay(mongodb_service, LoansServiceClient().deliver_book_events))
+
+# Title prefixes of GET /books/suggest, kept up to date in the background
+suggest_index = ProcessLocal(lambda: SuggestIndex(mongodb_service))
+
+
+def catalog_statistics(mongodb_service):
+    # The statistics of GET /stats - by name, the collections each is computed from and its computation
+    return {
+        'genres': (['books'], lambda: mongodb_service.count_books_by('genre')),
+        'publishers': (['books'], lambda: mongodb_service.count_books_by('publisher')),
+        'ratings-by-genre': (['books', 'ratings'], mongodb_service.get_ratings_by_genre),
+    }
+
+
+# Cache the statistics until the books or ratings are written
+stats_cache = ProcessLocal(lambda: StatsCache(mongodb_service, catalog_statistics(mongodb_service)))
+
+# Votes of POST /ratings/{id}/values waiting for their batched write, in 'buffered' RATINGS_WRITE_MODE - in any mode,
+# it bumps the ratings version of the votes written directly
+vote_buffer = ProcessLocal(lambda: VoteBuffer(mongodb_service))
+
+# Identical concurrent catalog reads share a single query - e.g. when their HTTP caches expire together
+books_reads = SingleFlight('books')
+top_reads = SingleFlight('top')
+
+
+def books_read_key(filters, pagination, sort):
+    # The identity of a GET /books read - its filters in any order, page and fields
+    fields = tuple(pagination['fields']) if pagination['fields'] else None
+    return tuple(sorted(filters)), pagination['limit'], pagination['after'], fields, sort
+
+
+def init_worker_process():
+    # Connect to MongoDB, check its schema was migrated and start the background threads, once per worker process
+    check_schema(mongodb_service.instance())
+    enrichment_workers.start()
+    outbox_relay.start()
+    suggest_index.start()
+    vote_buffer.start()
+
+
+def shutdown_worker_process():
+    # Let the background threads finish their current jobs before the worker process exits - the buffered votes
+    # are written first, their requests having been served
+    vote_buffer.stop(timeout=ENRICHMENT_STOP_TIMEOUT)
+    enrichment_workers.stop(timeout=ENRICHMENT_STOP_TIMEOUT)
+    outbox_relay.stop(timeout=ENRICHMENT_STOP_TIMEOUT)
+    suggest_index.stop(timeout=ENRICHMENT_STOP_TIMEOUT)
+
+
+def conditional_get(*collections):
+    # Make the GET responses of a catalog read cacheable, and answer 304 Not Modified while none of the given
+    # collections was written since the client's ETag - without reading the result set. The versions are read
+    # before the result set, so a response is never tagged with a version newer than its data
+    def decorator(view):
+        @functools.wraps(view)
+        def conditional_view(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+
+            try:
+                versions = mongodb_service.get_versions(collections)
+            except Exception as e:
+                logger.warning("Error fetching collection versions: %s", e)
+                return view(*args, **kwargs)
+
+            etag = catalog_etag(versions, collections, request.full_path)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            return set_catalog_cache_headers(response, etag, catalog_last_modified(versions))
+        return conditional_view
+    return decorator
 
 
 # Define /books route for GET and POST requests
 @controllers_bp.route('/books', methods=['GET', 'POST'])
+@conditional_get('books')
 def books():
     if request.method == 'GET':
-        try:
-            res_books_list = mongodb_service.get_all_books()
-        except Exception as e:
-            error_message = f"Error fetching books from the database: {str(e)}"
-            return jsonify({'error': error_message}), 500
-
         keys = list(request.args.keys())
 
         # Define a list of allowed query parameters
         allowed_params = {'id', 'ID', 'title', 'authors', 'isbn', 'ISBN', 'genre', 'publisher', 'publishedDate'}
+        list_params = PAGINATION_PARAMS | PUBLISHED_DATE_RANGE_PARAMS | {'sort'}
         # Check for invalid query parameters
-        invalid_params = [key for key in keys if key not in allowed_params]
+        invalid_params = [key for key in keys if key not in allowed_params | list_params]
         if invalid_params:
+            parameters_allowed = (allowed_params | list_params) - {'id', 'isbn'}
             return jsonify({"error": f"Invalid query parameters: {', '.join(invalid_params)}. "
-                                     f"Parameters allowed - {allowed_params - {'id', 'isbn'} }"}), 422
+                                     f"Parameters allowed - {parameters_allowed}"}), 422
 
         # Validate parameters' values
-        errors = validate_query_params()
+        errors = validate_query_params(request.args)
         if errors:
             return jsonify(errors), 422
 
-        # Filter books according to query
+        pagination, errors = get_pagination_args(request.args, BOOK_FIELDS)
+        if errors:
+            return jsonify(errors), 422
+
+        # Collect the (field, value) filters of the query, to be matched by the database
+        filters = []
         for key in keys:
             # Check if books need to be filtered by some field
             fields = allowed_params
             if key in fields and (key + '=') in request.url:
                 values = request.args.getlist(key)
                 for value in values:
-                    res_books_list = filtered_book_by_field(res_books_list, key, value)
+                    filters.append(book_filter_by_field(key, value))
+            if key in PUBLISHED_DATE_RANGE_PARAMS:
+                for value in request.args.getlist(key):
+                    filters.append((key, value))
 
-        # Return a list of all the books
-        return jsonify(res_books_list), 200
+        try:
+            # Return a list of all the books, or a page of them - streamed from the cursor, or read once for all the
+            # identical concurrent requests
+            sort = get_books_sort(request.args)
+            if pagination['stream']:
+                res_books = mongodb_service.iter_books(filters, pagination['limit'], pagination['after'],
+                                                       pagination['fields'], sort)
+            else:
+                res_books = books_reads.do(books_read_key(filters, pagination, sort), lambda: list(
+                    mongodb_service.iter_books(filters, pagination['limit'], pagination['after'], pagination['fields'],
+                                               sort)))
+            return list_response(res_books, pagination, 'id')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 422
+        except Exception as e:
+            error_message = f"Error fetching books from the database: {str(e)}"
+            return jsonify({'error': error_message}), 500
 
     elif request.method == 'POST':
         # Check if the request content type is JSON
@@ -72,47 +221,60 @@ def books():
             error_message = f"Error accessing the database: {str(e)}"
             return jsonify({'error': error_message}), 500
 
-        if title and not isinstance(title, str):
-            return jsonify({"error": "'title' must be a string"}), 422
-
-        if isbn and (not isinstance(isbn, str) or not isbn.isnumeric() or not len(isbn) == 13):
-            return jsonify({"error": "'ISBN' must be a string of 13 digit"}), 422
-
-        if (genre and genre not in
-                ['Fiction', 'Children', 'Biography', 'Science', 'Science Fiction', 'Fantasy', 'Other']):
-            return jsonify({"error": "'genre' must be one of 'Fiction', 'Children', 'Biography', 'Science',"
-                                     "'Science Fiction', 'Fantasy', or 'Other'"}), 422
+        error = get_new_book_error(title, isbn, genre)
+        if error:
+            return jsonify(error), 422
 
         # Set new book instance with received data - 'title', 'ISBN', 'genre'
         new_book = Book(title, isbn, genre)
 
-        # Get additional book data - 'authors', 'publisher', 'publishedDate' - from the Google Books API
-        res_err = load_authors_publisher_published_date(new_book)
-        if res_err:
-            return jsonify(res_err[0]), res_err[1]
+        # Get additional book data - 'authors', 'publisher', 'publishedDate' - from the Google Books API,
+        # either now or in the background
+        enrich_async = ENRICHMENT_MODE == 'async' or 'respond-async' in request.headers.get('Prefer', '')
+        if enrich_async:
+            new_book.authors = new_book.publisher = new_book.published_date = PENDING
+        else:
+            res_err = load_authors_publisher_published_date(new_book)
+            if res_err:
+                return jsonify(res_err[0]), res_err[1]
 
         try:
-            # Insert the new Book instance and its Rating instance to their appropriate Mongo databases
-            # Use the MongoDB's generated IDs as the book and rating IDs
-            book_id = mongodb_service.insert_book(new_book)
-            print(f"Inserted book with ID: {book_id}")
-
-            # Set a new Rating instance with the new book's id and title
-            new_value = Rating(new_book.title)
+            # Insert the new Book instance and a new Rating instance with its title to their appropriate Mongo
+            # databases, together. Use the MongoDB's generated ID as the book and rating IDs
+            book_id = mongodb_service.insert_book_with_rating(new_book, Rating(new_book.title))
+            logger.info("Inserted book and rating with ID: %s", book_id)
 
-            rating_id = mongodb_service.insert_rating(new_value, book_id)
-            print(f"Inserted rating with ID: {rating_id}")
+            if enrich_async:
+                # Queue the book for the enrichment workers
+                job_id = mongodb_service.insert_enrichment_job(book_id, new_book.isbn)
+                enrichment_workers.notify()
+                logger.info("Inserted enrichment job with ID: %s", job_id)
 
         except Exception as e:
             error_message = f"Error storing data in database: {str(e)}"
             return jsonify({'error': error_message}), 500
 
+        if enrich_async:
+            return jsonify({"bookID": f"{book_id}"}), 202, {'Location': f"/books/{book_id}/enrichment"}
+
         # return jsonify({"success": f"A new book record has been created, with id={book_id}"}), 201
         return jsonify({"bookID": f"{book_id}"}), 201
 
 
-def validate_query_params():
-    params = request.args
+def get_new_book_error(title, isbn, genre):
+    if title and not isinstance(title, str):
+        return {"error": "'title' must be a string"}
+
+    if isbn and (not isinstance(isbn, str) or not isbn.isnumeric() or not len(isbn) == 13):
+        return {"error": "'ISBN' must be a string of 13 digit"}
+
+    if (genre and genre not in
+            ['Fiction', 'Children', 'Biography', 'Science', 'Science Fiction', 'Fantasy', 'Other']):
+        return {"error": "'genre' must be one of 'Fiction', 'Children', 'Biography', 'Science',"
+                         "'Science Fiction', 'Fantasy', or 'Other'"}
+
+
+def validate_query_params(params):
     errors = []
 
     # Validate ID
@@ -167,26 +329,43 @@ def validate_query_params():
             errors.append("'publishedDate' must be of format YYYY or YYYY-MM-DD, or 'missing'")
             break
 
+    # Validate publishedDate ranges
+    for key in sorted(PUBLISHED_DATE_RANGE_PARAMS):
+        for range_value in params.getlist(key):
+            if not re.match(r'^\d{4}(-\d{2}-\d{2})?$', range_value) or not parse_published_date(range_value):
+                errors.append(f"'{key}' must be a valid date of format YYYY or YYYY-MM-DD")
+                break
+
+    # Validate sort
+    sort_values = params.getlist('sort')
+    if len(sort_values) > 1 or (sort_values and sort_values[0].removeprefix('-') not in SORT_FIELDS):
+        errors.append(f"'sort' must be one of {', '.join(SORT_FIELDS)}, prefixed with '-' for descending order")
+
     if errors:
         return {"error": "; ".join(errors)}
 
 
-def filtered_book_by_field(res_books_list, key, value):
-    if key != 'publishedDate':
-        if key == 'isbn': key = 'ISBN'
-        if key == 'ID': key = 'id'
-        filtered_book_list = [book for book in res_books_list if book[key] == value]
-    else:
-        # '2014' query will find either '2014-01-01' or '2014'
-        filtered_book_list = [book for book in res_books_list if
-                              (book[key] == value or value == book[key].split('-')[0])]
+def get_books_sort(params):
+    # The (stored field, direction) order of the 'sort' parameter, e.g. '-publishedDate' for the newest books first
+    sort = params.get('sort')
+    if not sort:
+        return None
+    return SORT_FIELDS[sort.removeprefix('-')], -1 if sort.startswith('-') else 1
 
-    return filtered_book_list
+
+def book_filter_by_field(key, value):
+    # Normalize the query parameter name to the book's field name
+    if key == 'isbn': key = 'ISBN'
+    if key == 'ID': key = 'id'
+    return key, value
 
 
 def load_authors_publisher_published_date(book):
     res = get_book_authors_publisher_published_date(book.isbn)
+    return set_authors_publisher_published_date(book, res)
+
 
+def set_authors_publisher_published_date(book, res):
     # If a numerical error was raised (0 or -1) -> return appropriate error
     if isinstance(res, int):
         if res == 0:
@@ -201,6 +380,29 @@ def load_authors_publisher_published_date(book):
         book.authors = authors_list_to_str(book.authors)
 
 
+def enrich_book(job):
+    # Load the Google Books API data of a book created with asynchronous enrichment
+    book = Book(None, job['ISBN'], None)
+    res_err = load_authors_publisher_published_date(book)
+    if res_err:
+        return res_err
+
+    mongodb_service.update_pending_book(job['bookId'], {
+        'authors': book.authors,
+        'publisher': book.publisher,
+        'publishedDate': book.published_date
+    })
+
+
+def give_up_enrich_book(job):
+    # The Google Books API data of the book couldn't be loaded
+    mongodb_service.update_pending_book(job['bookId'], {
+        'authors': 'missing',
+        'publisher': 'missing',
+        'publishedDate': 'missing'
+    })
+
+
 def authors_list_to_str(authors_list):
     if len(authors_list) == 1:
         return authors_list[0]
@@ -212,8 +414,177 @@ def authors_list_to_str(authors_list):
     return authors_str
 
 
+# Define /books/search route for GET request - the books matching words of their title, authors or publisher,
+# most relevant first
+@controllers_bp.route('/books/search', methods=['GET'])
+@conditional_get('books')
+def search_books():
+    search, errors = get_search_args(request.args)
+    if errors:
+        return jsonify(errors), 422
+
+    try:
+        return jsonify(mongodb_service.search_books(search['q'], search['limit'], search['fields'])), 200
+    except Exception as e:
+        error_message = f"Error searching books in the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+def get_search_args(params):
+    # Validate the 'q', 'limit' and 'fields' query parameters of a search, returns (search, errors)
+    invalid_params = [key for key in params.keys() if key not in {'q', 'limit', 'fields'}]
+    if invalid_params:
+        return None, {"error": f"Invalid query parameters: {', '.join(invalid_params)}. "
+                               f"Parameters allowed - {{'q', 'limit', 'fields'}}"}
+    if not params.get('q', '').strip():
+        return None, {"error": "'q' must have the words to search for"}
+
+    pagination, errors = get_pagination_args(params, BOOK_FIELDS)
+    if errors:
+        return None, errors
+    return {'q': params['q'], 'limit': pagination['limit'] or SEARCH_DEFAULT_LIMIT,
+            'fields': pagination['fields']}, None
+
+
+# Define /books/suggest route for GET request - titles starting with a prefix, for autocompletion
+@controllers_bp.route('/books/suggest', methods=['GET'])
+def suggest_books():
+    suggest, errors = get_suggest_args(request.args)
+    if errors:
+        return jsonify(errors), 422
+
+    suggestions = suggest_index.suggest(suggest['prefix'], suggest['limit'])
+    if suggestions is None:
+        # The index is still loading - look the prefix up by the title index instead
+        try:
+            suggestions = mongodb_service.get_books_by_title_prefix(suggest['prefix'], suggest['limit'])
+        except Exception as e:
+            error_message = f"Error fetching books from the database: {str(e)}"
+            return jsonify({'error': error_message}), 500
+    return jsonify(suggestions), 200
+
+
+def get_suggest_args(params):
+    # Validate the 'prefix' and 'limit' query parameters of the suggestions, returns (suggest, errors)
+    invalid_params = [key for key in params.keys() if key not in {'prefix', 'limit'}]
+    if invalid_params:
+        return None, {"error": f"Invalid query parameters: {', '.join(invalid_params)}. "
+                               f"Parameters allowed - {{'prefix', 'limit'}}"}
+    if not params.get('prefix', '').strip():
+        return None, {"error": "'prefix' must have a value"}
+
+    limit = params.get('limit', str(SUGGEST_DEFAULT_LIMIT))
+    if not limit.isdigit() or not 1 <= int(limit) <= SUGGEST_MAX_LIMIT:
+        return None, {"error": f"'limit' must be a positive integer, at most {SUGGEST_MAX_LIMIT}"}
+    return {'prefix': params['prefix'], 'limit': int(limit)}, None
+
+
+# Define /books/bulk route for POST request - create many books at once, from a JSON array or NDJSON
+@controllers_bp.route('/books/bulk', methods=['POST'])
+def books_bulk():
+    if request.mimetype == 'application/json':
+        books_data = request.get_json(silent=True)
+        if not isinstance(books_data, list):
+            return jsonify({"error": "Request body must be a JSON array of books"}), 422
+    elif request.mimetype == 'application/x-ndjson':
+        try:
+            books_data = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        except ValueError as e:
+            return jsonify({"error": f"Invalid NDJSON request body: {str(e)}"}), 422
+    else:
+        return jsonify({"error": "Unsupported media type. Only JSON and NDJSON data are supported."}), 415
+
+    if len(books_data) > BULK_MAX_BOOKS:
+        return jsonify({"error": f"At most {BULK_MAX_BOOKS} books can be created in a single request"}), 413
+
+    # Validate every book, and set new book instances for the valid ones
+    results = [{"index": index} for index in range(len(books_data))]
+    new_books = {}
+    for index, book_data in enumerate(books_data):
+        book, error = get_bulk_book(book_data)
+        if error:
+            results[index].update(status=422, **error)
+        else:
+            results[index]['ISBN'] = book.isbn
+            new_books[index] = book
+
+    # Reject ISBNs repeated in the request or already stored, with a single query
+    try:
+        existing_isbns = mongodb_service.get_existing_isbns([book.isbn for book in new_books.values()])
+    except Exception as e:
+        error_message = f"Error accessing the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+    seen_isbns = set()
+    for index, book in list(new_books.items()):
+        if book.isbn in existing_isbns or book.isbn in seen_isbns:
+            results[index].update(status=422, error="There already exists a book with the provided ISBN number")
+            del new_books[index]
+        seen_isbns.add(book.isbn)
+
+    # Get additional books' data from the Google Books API, for the books which didn't provide it
+    books_to_load = {index: book for index, book in new_books.items() if book.authors is None}
+    with ThreadPoolExecutor(max_workers=BULK_ENRICHMENT_WORKERS) as executor:
+        load_results = executor.map(load_authors_publisher_published_date, books_to_load.values())
+        for index, res_err in zip(books_to_load, load_results):
+            if res_err:
+                results[index].update(status=res_err[1], **res_err[0])
+                del new_books[index]
+
+    # Insert the new books and their ratings, each in a single batch
+    if new_books:
+        try:
+            book_ids, errors = mongodb_service.insert_books_with_ratings(
+                list(new_books.values()), [Rating(book.title) for book in new_books.values()])
+            for index, book_id, error in zip(new_books, book_ids, errors):
+                if error:
+                    results[index].update(status=500, error=f"Error storing data in database: {error}")
+                else:
+                    results[index].update(status=201, bookID=f"{book_id}")
+
+        except Exception as e:
+            error_message = f"Error storing data in database: {str(e)}"
+            return jsonify({'error': error_message}), 500
+
+    created = sum(1 for result in results if result['status'] == 201)
+    return jsonify({"created": created, "failed": len(results) - created, "results": results}), 200
+
+
+def get_bulk_book(book_data):
+    # Validate a book of a bulk request and set its Book instance, returns (book, error)
+    if not isinstance(book_data, dict):
+        return None, {"error": "Each book must be a JSON object"}
+
+    title = book_data.get('title')
+    genre = book_data.get('genre')
+    isbn = book_data.get('isbn')
+    if not isbn:
+        isbn = book_data.get('ISBN')
+
+    if not title or not isbn or not genre:
+        return None, {"error": "Please provide all three fields - 'title', 'ISBN', and 'genre'"}
+
+    book = Book(title, isbn, genre)
+
+    # A book providing all its fields is stored as is, without calling the Google Books API
+    if all(field in book_data for field in ['authors', 'publisher', 'publishedDate']):
+        error = get_book_errors(dict(book_data, ISBN=isbn))
+        if error:
+            return None, error
+        book.authors = book_data['authors']
+        book.publisher = book_data['publisher']
+        book.published_date = book_data['publishedDate']
+        return book, None
+
+    error = get_new_book_error(title, isbn, genre)
+    if error:
+        return None, error
+    return book, None
+
+
 # Define /books/{id} route for GET, DELETE and PUT requests
 @controllers_bp.route('/books/<id>', methods=['GET', 'DELETE', 'PUT'])
+@conditional_get('books')
 def book_by_id(id):
     try:
         # Attempt to get the book from the database
@@ -225,9 +596,9 @@ def book_by_id(id):
                 return jsonify(book), 200
 
             elif request.method == 'DELETE':
-                # Delete the book and its ratings
-                mongodb_service.delete_book(id)
-                mongodb_service.delete_rating(id)
+                # Delete the book and its ratings, and let the loans service know
+                mongodb_service.delete_book_with_rating(id)
+                outbox_relay.notify()
                 return jsonify({"success": f"Book with ID={id} has been successfully deleted"}), 200
 
             elif request.method == 'PUT':
@@ -238,13 +609,6 @@ def book_by_id(id):
                 # Get the JSON data from the request
                 updated_book_data = request.json
                 res = update_book(id, updated_book_data)
-
-                # If the book was successfully updated, update the relevant book title in the ratings db as well
-                if res[1] == 200:
-                    book_rating = mongodb_service.get_rating(id)
-                    book_rating['title'] = book['title']
-                    mongodb_service.update_rating(id, book_rating)
-
                 return jsonify(res[0]), res[1]
 
         # If no book was found with the given ID
@@ -255,7 +619,41 @@ def book_by_id(id):
         return jsonify({'error': error_message}), 500
 
 
+# Define /books/{id}/enrichment route for GET request - the status of a book's asynchronous enrichment
+@controllers_bp.route('/books/<id>/enrichment', methods=['GET'])
+def book_enrichment(id):
+    try:
+        job = mongodb_service.get_enrichment_job(id)
+        if not job:
+            return jsonify({"error": f"No enrichment job found for book with ID={id}"}), 404
+
+        return jsonify({
+            "bookID": id,
+            "status": job['status'],
+            "attempts": job['attempts'],
+            "error": job['error'],
+            "nextAttemptAt": job['nextAttemptAt'],
+            "updatedAt": job['updatedAt']
+        }), 200
+
+    except Exception as e:
+        error_message = f"Error accessing the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
 def update_book(id, updated_book_data):
+    errors = get_updated_book_errors(updated_book_data)
+    if errors:
+        return errors, 422
+
+    # Update the book and the relevant book title in the ratings db as well, and let the loans service know
+    mongodb_service.update_book_with_rating(id, updated_book_data)
+    outbox_relay.notify()
+
+    return {"success": f"Book with ID={id} has been successfully updated"}, 200
+
+
+def get_updated_book_errors(updated_book_data):
     # Ensure that all required fields are provided in the request JSON
     required_fields = ['title', 'ISBN', 'genre', 'authors', 'publisher', 'publishedDate']
     missing_fields = []
@@ -264,17 +662,10 @@ def update_book(id, updated_book_data):
             missing_fields.append(field)
 
     if missing_fields:
-        return {"error": f"Missing required fields: {missing_fields}"}, 422
+        return {"error": f"Missing required fields: {missing_fields}"}
 
     # Validate the updated book information
-    errors = get_book_errors(updated_book_data)
-    if errors:
-        return errors, 422
-
-    # Update the book
-    mongodb_service.update_book(id, updated_book_data)
-
-    return {"success": f"Book with ID={id} has been successfully updated"}, 200
+    return get_book_errors(updated_book_data)
 
 
 def get_book_errors(book_info):
@@ -318,10 +709,15 @@ def get_book_errors(book_info):
 
 # Define a /ratings route for GET request
 @controllers_bp.route('/ratings', methods=['GET'])
+@conditional_get('ratings')
 def get_all_ratings():
+    pagination, errors = get_pagination_args(request.args, RATING_FIELDS)
+    if errors:
+        return jsonify(errors), 422
+
     try:
-        ratings = mongodb_service.get_all_ratings()
-        return jsonify(ratings), 200
+        ratings = mongodb_service.iter_ratings(pagination['limit'], pagination['after'], pagination['fields'])
+        return list_response(ratings, pagination, 'id')
     except Exception as e:
         error_message = f"Error fetching ratings from the database: {str(e)}"
         return jsonify({'error': error_message}), 500
@@ -329,6 +725,7 @@ def get_all_ratings():
 
 # Define a /ratings/{id} route for GET request
 @controllers_bp.route('/ratings/<id>', methods=['GET'])
+@conditional_get('ratings')
 def get_rating(id):
     try:
         rating = mongodb_service.get_rating(id)
@@ -346,8 +743,8 @@ def get_rating(id):
 @controllers_bp.route('/ratings/<id>/values', methods=['POST'])
 def ratings_id_value(id):
     try:
-        rating = mongodb_service.get_rating(id)
-        if not rating:
+        # Unknown books first, whatever the request body
+        if not mongodb_service.rating_exists(id):
             return jsonify({"error": f"ID={id} not found"}), 404
 
         # Check if the request content type is JSON
@@ -364,15 +761,34 @@ def ratings_id_value(id):
         if not new_value or not isinstance(new_value, int) or new_value < 1 or new_value > 5:
             return jsonify({"error": "Invalid rating value. Must be an integer between 1 and 5."}), 422
 
-        # Add the new rating value and updated average
-        rating['values'].append(new_value)
-        rating['average'] = round(sum(rating['values']) / len(rating['values']), 2)
-        mongodb_service.update_rating(id, rating)
+        flushed = False
+        if RATINGS_WRITE_MODE == 'buffered':
+            # Buffer the value, and wait for its batch to be written unless votes are acknowledged once buffered.
+            # A vote whose batch isn't flushed within VOTE_FLUSH_TIMEOUT is taken back and written on its own
+            rating_id = str(ObjectId(id))
+            batch = vote_buffer.add(rating_id, new_value)
+            if VOTE_ACK == 'buffer':
+                return jsonify({"status": "accepted"}), 202
+            flushed = batch.done.wait(VOTE_FLUSH_TIMEOUT)
+            if not flushed and not vote_buffer.withdraw(batch, rating_id, new_value):
+                # Its batch is being flushed already - accepted, if that takes too long as well
+                if not batch.done.wait(VOTE_FLUSH_TIMEOUT):
+                    return jsonify({"status": "accepted"}), 202
+                flushed = True
+            if flushed:
+                average = batch.result(rating_id)
+        if not flushed:
+            # Add the new rating value and get the updated average, in a single atomic update
+            rating = mongodb_service.add_rating_value(id, new_value)
+            average = rating['average'] if rating else None
+            if rating:
+                vote_buffer.add_written()
+        if average is None:
+            return jsonify({"error": f"ID={id} not found"}), 404
 
         # Return the updated average rating
         # return jsonify({"success": f"Average rating of '{rating['title']}' is {rating['average']}"}), 200
-        return jsonify({"average": f"{rating['average']}"}), 201
-
+        return jsonify({"average": f"{average}"}), 201
 
     except Exception as e:
         error_message = f"Error accessing the database: {str(e)}"
@@ -381,33 +797,16 @@ def ratings_id_value(id):
 
 # Define a /top route for GET request
 @controllers_bp.route('/top', methods=['GET'])
+@conditional_get('ratings')
 def top_rated_books():
     try:
-        books_ratings = mongodb_service.get_all_ratings()
+        # Books' ratings that have at least 3 values, with the top 3 unique average ratings,
+        # sorted by their average rating in descending order
+        top_books_ratings = top_reads.do('top', lambda: mongodb_service.get_top_ratings(TOP_RATED_MIN_VALUES, 3))
     except Exception as e:
         error_message = f"Error fetching ratings from the database: {str(e)}"
         return jsonify({'error': error_message}), 500
 
-    # Filter books' ratings that have at least 3 values
-    filtered_books_ratings = [book_rating for book_rating in books_ratings if len(book_rating['values']) >= 3]
-    if len(filtered_books_ratings) == 0:
-        return jsonify([]), 200
-
-    # Sort the filtered_book_ratings based on their average rating in descending order
-    sorted_books_ratings = sorted(filtered_books_ratings, key=lambda obj: obj['average'], reverse=True)
-
-    # Extract unique average ratings from sorted_book_ratings
-    unique_averages = list(set(book_rating['average'] for book_rating in sorted_books_ratings))
-
-    # Select the top 3 unique average ratings
-    top_3_unique_averages = sorted(unique_averages, reverse=True)[:3]
-
-    top_books_ratings = []
-    # Iterate over sorted_book_ratings and append book_rating with average in top_3_unique_averages
-    for book_rating in sorted_books_ratings:
-        if book_rating['average'] in top_3_unique_averages:
-            top_books_ratings.append(book_rating)
-
     # Create a JSON array of top-rated books
     top_books_json = []
     for book_rating in top_books_ratings:
@@ -421,6 +820,111 @@ def top_rated_books():
     return jsonify(top_books_json), 200
 
 
+# Define a /google-books/cache route for GET request - the Google Books lookups cache counters
+@controllers_bp.route('/google-books/cache', methods=['GET'])
+def get_google_books_cache_stats():
+    return jsonify(google_books_cache.stats()), 200
+
+
+# Define a /outbox/stats route for GET request - the delivery of the books' events to the loans service
+@controllers_bp.route('/outbox/stats', methods=['GET'])
+def get_outbox_stats():
+    try:
+        return jsonify(outbox_relay.stats()), 200
+    except Exception as e:
+        error_message = f"Error accessing the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+# Define /stats route for GET request - all the catalog statistics, for the dashboards
+@controllers_bp.route('/stats', methods=['GET'])
+def get_all_stats():
+    try:
+        return jsonify({name: stats_cache.get(name) for name in stats_cache.names()}), 200
+    except Exception as e:
+        error_message = f"Error computing statistics: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+# Define /stats/<name> route for GET request - a single catalog statistic
+@controllers_bp.route('/stats/<name>', methods=['GET'])
+def get_stats(name):
+    if name not in stats_cache.names():
+        return jsonify({"error": f"No statistics named '{name}' - one of {', '.join(stats_cache.names())}"}), 404
+    try:
+        return jsonify(stats_cache.get(name)), 200
+    except Exception as e:
+        error_message = f"Error computing statistics: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+# Secure API key of the admin routes - exports and imports of the whole catalog
+ADMIN_API_KEY = os.getenv('ADMIN_API_KEY', 'admin-api-key')
+
+# Collections of GET /admin/export and POST /admin/import, in the export's order - the ratings follow their books
+TRANSFER_COLLECTIONS = ('books', 'ratings', 'votes')
+
+
+def transfer_collections(mongodb_service, names=TRANSFER_COLLECTIONS):
+    return {name: getattr(mongodb_service, f'{name}_collection') for name in names}
+
+
+def get_import_gzip():
+    # Whether the body of an import is gzipped, None if it isn't NDJSON at all
+    if request.mimetype == GZIP_CONTENT_TYPE or request.content_encoding == 'gzip':
+        return True
+    return False if request.mimetype == NDJSON_CONTENT_TYPE else None
+
+
+# Define /admin/export route for GET request - the catalog as NDJSON, streamed from the database
+@controllers_bp.route('/admin/export', methods=['GET'])
+def admin_export():
+    if request.headers.get('API-KEY') != ADMIN_API_KEY:
+        return jsonify({'error': 'Forbidden: Invalid API key'}), 403
+
+    export, errors = get_export_args(request.args, TRANSFER_COLLECTIONS)
+    if errors:
+        return jsonify(errors), 422
+
+    collections = transfer_collections(mongodb_service, export['collections'])
+    chunks = export_chunks(collections.items(), export['gzip'])
+    return Response(stream_with_context(chunks), headers=export_headers('books', export['gzip'])), 200
+
+
+# Define /admin/import route for POST request - write an export's documents, keeping their IDs
+@controllers_bp.route('/admin/import', methods=['POST'])
+def admin_import():
+    if request.headers.get('API-KEY') != ADMIN_API_KEY:
+        return jsonify({'error': 'Forbidden: Invalid API key'}), 403
+
+    gzip = get_import_gzip()
+    if gzip is None:
+        return jsonify({"error": f"Unsupported media type. Only {NDJSON_CONTENT_TYPE} data, "
+                                 f"optionally gzipped, is supported."}), 415
+
+    args, errors = get_import_args(request.args)
+    if errors:
+        return jsonify(errors), 422
+
+    importer = Importer(transfer_collections(mongodb_service), mongodb_service.import_checkpoints_collection,
+                        args['mode'], args['checkpoint'], gzip)
+    try:
+        return jsonify(import_stream(request.stream.read, importer)), 200
+    except ImportFailed as e:
+        return jsonify(dict(importer.summary(), error=str(e))), 422
+    except Exception as e:
+        error_message = f"Error importing into the database: {str(e)}"
+        return jsonify(dict(importer.summary(), error=error_message)), 500
+    finally:
+        mongodb_service.finish_import(importer.counts)
+
+
+# Define a /metrics route for GET request - the requests, MongoDB commands and outgoing calls, for Prometheus
+@controllers_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    return metrics_registry.render(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
+
+
 # Secure API key
 # THIS IS A SIMPLIFIED MEASURE TO ENSURE THAT 'get_book_title_and_id(isbn)' IS TRIGGERED ONLY BY THE LOANS SERVICE
 API_KEY = 'loans-service-api-key'
@@ -447,3 +951,35 @@ def get_book_title_and_id(isbn):
     except Exception as e:
         error_message = f"Error accessing the database: {str(e)}"
         return jsonify({'error': error_message}), 500
+
+
+# Maximal number of ISBNs resolved by a single POST /books/isbn:batch request
+ISBN_BATCH_MAX = int(os.getenv('ISBN_BATCH_MAX', 100))
+
+
+@controllers_bp.route('/books/isbn:batch', methods=['POST'])
+def get_books_titles_and_ids():
+    # Check for the API key in the request headers
+    api_key = request.headers.get('API-KEY')
+    if api_key != API_KEY:
+        return jsonify({'error': 'Forbidden: Invalid API key'}), 403
+
+    # Check if the request content type is JSON
+    if request.content_type != 'application/json':
+        return jsonify({"error": "Unsupported media type. Only JSON data is supported."}), 415
+
+    isbns = (request.get_json(silent=True) or {}).get('isbns')
+    if not isinstance(isbns, list) or not all(isinstance(isbn, str) for isbn in isbns):
+        return jsonify({"error": "Please provide 'isbns' - a list of ISBN strings"}), 422
+    if len(isbns) > ISBN_BATCH_MAX:
+        return jsonify({"error": f"At most {ISBN_BATCH_MAX} ISBNs can be resolved in a single request"}), 422
+
+    try:
+        # Get all the books with a single query, each ISBN maps to its book's title and id, or to {} if not found
+        books = mongodb_service.get_books_by_isbns(isbns)
+        return jsonify({isbn: {"title": books[isbn]['title'], "id": books[isbn]['id']} if isbn in books else {}
+                        for isbn in isbns}), 200
+
+    except Exception as e:
+        error_message = f"Error accessing the database: {str(e)}"
+        return jsonify({'error': error_message}), 500
@@ -1,3 +1,7 @@
+import re
+from datetime import date
+
+
 class Book:
     def __init__(self, title, isbn, genre):
         self.title = title
@@ -17,3 +21,56 @@ class Book:
             'publisher': self.publisher,
             'publishedDate': self.published_date
         }
+
+
+# Value of the fields loaded from the Google Books API, while the book waits for them
+PENDING = 'pending'
+
+# Fields of a returned book, which may be selected with the 'fields' query parameter
+BOOK_FIELDS = {'id', 'title', 'ISBN', 'genre', 'authors', 'publisher', 'publishedDate'}
+
+# Fields stored with a book, derived from its 'publishedDate' - indexed for the year and date range filters and the
+# sorting by date, and never returned
+DERIVED_FIELDS = ('publishedYear', 'publishedDateSort')
+
+# Fields GET /books may be sorted by, and the stored field each of them is sorted by
+SORT_FIELDS = {'title': 'title', 'authors': 'authors', 'genre': 'genre', 'publisher': 'publisher',
+               'publishedDate': 'publishedDateSort'}
+
+# Operators of the 'publishedDate' range filters of GET /books, e.g. 'publishedDate[gte]=2010'
+RANGE_OPERATORS = ('gt', 'gte', 'lt', 'lte')
+
+
+# A 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD' published date
+PUBLISHED_DATE_PATTERN = re.compile(r'(\d{4})(?:-(\d{2})(?:-(\d{2}))?)?')
+
+
+def parse_published_date(published_date):
+    # The (year, month, day) strings of a published date, None for a missing month or day - None for any other
+    # value, e.g. 'missing', 'pending' or '2015-13'
+    match = PUBLISHED_DATE_PATTERN.fullmatch(published_date) if isinstance(published_date, str) else None
+    if not match:
+        return None
+    year, month, day = match.groups()
+    try:
+        date(int(year), int(month or 1), int(day or 1))
+    except ValueError:
+        return None
+    return year, month, day
+
+
+def published_date_fields(published_date):
+    # The year, and the date as a sortable 'YYYY-MM-DD' with '00' for a missing month or day, of a valid published
+    # date - see parse_published_date
+    parsed = parse_published_date(published_date)
+    if not parsed:
+        return {'publishedYear': None, 'publishedDateSort': None}
+    year, month, day = parsed
+    return {'publishedYear': int(year), 'publishedDateSort': f"{year}-{month or '00'}-{day or '00'}"}
+
+
+def with_derived_fields(book_data):
+    # The book's fields to store - with the derived fields whenever 'publishedDate' is set
+    if 'publishedDate' not in book_data:
+        return book_data
+    return dict(book_data, **published_date_fields(book_data['publishedDate']))
@@ -1,18 +1,34 @@
+# Minimal number of values a rating must have for its book to be considered a top rated book
+TOP_RATED_MIN_VALUES = 3
+
+# Allowed rating values
+RATING_VALUES = [1, 2, 3, 4, 5]
+
+# Fields of a returned rating, which may be selected with the 'fields' query parameter
+RATING_FIELDS = {'id', 'title', 'count', 'sum', 'histogram', 'average'}
+
+
 class Rating:
     def __init__(self, title):
         self.title = title
-        self.values = []
+        self.count = 0
+        self.sum = 0
+        self.histogram = {str(value): 0 for value in RATING_VALUES}
         self.average = 0
 
     def to_dict(self):
         # Convert the Rating object to a dictionary
         return {
             'title': self.title,
-            'values': self.values,
+            'count': self.count,
+            'sum': self.sum,
+            'histogram': self.histogram,
             'average': self.average,
         }
 
     def add_value(self, new_rating):
-        # Add a new value to the values array
-        self.values.append(new_rating)
-
+        # Add a new value to the aggregated values
+        self.count += 1
+        self.sum += new_rating
+        self.histogram[str(new_rating)] += 1
+        self.average = round(self.sum / self.count, 2)
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+from services.enrichment_worker import (ENRICHMENT_LEASE_SECONDS, ENRICHMENT_POLL_SECONDS, ENRICHMENT_WORKERS,
+                                        retry_delay, should_retry)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEnrichmentWorkers:
+    # EnrichmentWorkers as asyncio tasks, over an AsyncMongoDBService - enrich(job) and give_up(job) are coroutines
+    def __init__(self, mongodb_service, enrich, give_up, workers=ENRICHMENT_WORKERS):
+        self.mongodb_service = mongodb_service
+        self.enrich = enrich
+        self.give_up = give_up
+        self.workers = workers
+        self.wakeup = asyncio.Event()
+        self.stopped = False
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.run()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=None):
+        self.stopped = True
+        self.wakeup.set()
+        if self.tasks:
+            await asyncio.wait(self.tasks, timeout=timeout)
+
+    def notify(self):
+        # Wake up an idle worker - a job was just queued
+        self.wakeup.set()
+
+    async def run(self):
+        while not self.stopped:
+            try:
+                job = await self.mongodb_service.claim_enrichment_job(ENRICHMENT_LEASE_SECONDS)
+            except Exception as e:
+                logger.error("Error claiming enrichment job: %s", e)
+                job = None
+
+            if not job:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), ENRICHMENT_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+
+            try:
+                await self.process(job)
+            except Exception as e:
+                logger.error("Error processing enrichment job %s: %s", job['_id'], e, exc_info=True)
+
+    async def process(self, job):
+        try:
+            res_err = await self.enrich(job)
+        except Exception as e:
+            res_err = {"error": f"Error loading book data: {str(e)}"}, 500
+
+        if not res_err:
+            await self.mongodb_service.finish_enrichment_job(job['_id'], 'done')
+            return
+
+        error, status = res_err
+        if should_retry(job, status):
+            await self.mongodb_service.retry_enrichment_job(job['_id'], retry_delay(job), error['error'])
+        else:
+            logger.warning("Enrichment job %s of ISBN %s failed: %s", job['_id'], job['ISBN'], error['error'])
+            await self.give_up(job)
+            await self.mongodb_service.finish_enrichment_job(job['_id'], 'failed', error['error'])
@@ -0,0 +1,81 @@
+import time
+import logging
+import httpx
+from common.metrics import observe_call
+from services.google_books_cache import GoogleBooksCache
+from services.google_books_service import (GOOGLE_BOOK_BY_ISBN_API, GOOGLE_BOOKS_TIMEOUT, lookups,
+                                           parse_google_books_response)
+
+logger = logging.getLogger(__name__)
+
+# Reuse connections to the Google Books API between requests - opened by the ASGI app when it starts serving
+client = None
+
+# Optional AsyncGoogleBooksCache of the lookups by ISBN
+cache = None
+
+
+class AsyncGoogleBooksCache(GoogleBooksCache):
+    # GoogleBooksCache over a Motor collection
+    async def get(self, isbn):
+        found, result = self.get_from_memory(isbn)
+        if found:
+            return found, result
+
+        try:
+            document = await self.collection.find_one(self.document_query(isbn))
+        except Exception as e:
+            logger.warning("Error reading Google Books cache for ISBN %s: %s", isbn, e)
+            document = None
+            self.count('errors')
+        return self.get_from_document(isbn, document)
+
+    async def set(self, isbn, result):
+        document = self.remember_result(isbn, result)
+        try:
+            await self.collection.replace_one({'_id': isbn}, document, upsert=True)
+        except Exception as e:
+            logger.warning("Error writing Google Books cache for ISBN %s: %s", isbn, e)
+            self.count('errors')
+
+
+def open_google_books_client(google_books_cache=None):
+    global client, cache
+    client = httpx.AsyncClient(timeout=GOOGLE_BOOKS_TIMEOUT)
+    cache = google_books_cache
+
+
+async def close_google_books_client():
+    await client.aclose()
+
+
+async def get_book_authors_publisher_published_date(isbn):
+    # See google_books_service.get_book_authors_publisher_published_date
+    return await lookups.do_async(isbn, lambda: lookup_book_authors_publisher_published_date(isbn))
+
+
+async def lookup_book_authors_publisher_published_date(isbn):
+    if cache:
+        found, result = await cache.get(isbn)
+        if found:
+            return result
+
+    result = await fetch_book_authors_publisher_published_date(isbn)
+
+    # Cache found books and ISBNs with no items, but not connection errors
+    if cache and result != -1:
+        await cache.set(isbn, result)
+    return result
+
+
+async def fetch_book_authors_publisher_published_date(isbn):
+    # Make a request to Google books API to get the book's authors, publisher and published date
+    start = time.perf_counter()
+    try:
+        response = await client.get(f'{GOOGLE_BOOK_BY_ISBN_API}{isbn}')
+    except Exception:
+        observe_call('google_books', start)
+        return -1
+    observe_call('google_books', start, response)
+
+    return parse_google_books_response(response)
@@ -0,0 +1,336 @@
+import os
+import re
+import logging
+from datetime import datetime, timedelta
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from common.metrics import mongo_event_listeners
+from common.structured_logging import log_sampled, summarize
+from models.book import DERIVED_FIELDS, PENDING, with_derived_fields
+from services.mongodb_service import BOOK_PROJECTION, MongoDBService
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMongoDBService:
+    # asyncio counterpart of MongoDBService over the Motor driver - same collections, documents and queries.
+    # The schema is applied by MongoDBService, see asgi_app.py
+    def __init__(self, host='mongo', port=27017, books_db_name='books', ratings_db_name='ratings'):
+        mongo_uri = os.getenv('MONGO_URI', f'mongodb://{host}:{port}/')
+        self.client = AsyncIOMotorClient(mongo_uri, event_listeners=mongo_event_listeners())
+        self.books_db = self.client[books_db_name]
+        self.ratings_db = self.client[ratings_db_name]
+        self.books_collection = self.books_db['books']
+        self.ratings_collection = self.ratings_db['ratings']
+        self.votes_collection = self.ratings_db['votes']
+        self.log_votes = os.getenv('RATINGS_VOTE_LOG', '0') == '1'
+        self.google_books_cache_collection = self.books_db['google_books_cache']
+        self.enrichment_jobs_collection = self.books_db['enrichment_jobs']
+        self.versions_collection = self.books_db['collection_versions']
+        self.outbox_collection = self.books_db['outbox']
+        self.counters_collection = self.books_db['counters']
+        self.transactions = None
+        logger.debug("AsyncMongoDBService initialized with URI: %s", mongo_uri)
+
+    # Books Collection Operations
+    async def get_book(self, id):
+        log_sampled(logger, "Fetching book with ID: %s", id)
+        book = await self.books_collection.find_one({'_id': ObjectId(id)}, BOOK_PROJECTION)
+        if book:
+            book['id'] = str(book.pop('_id'))  # change _id to id and convert ObjectId to string
+        log_sampled(logger, "Found book: %s", summarize(book))
+        return book
+
+    async def get_book_by_isbn(self, isbn):
+        log_sampled(logger, "Fetching book with ISBN: %s", isbn)
+        book = await self.books_collection.find_one({'ISBN': isbn}, BOOK_PROJECTION)
+        if book:
+            book['id'] = str(book.pop('_id'))
+        log_sampled(logger, "Found book: %s", summarize(book))
+        return book
+
+    async def iter_books(self, filters=None, limit=None, after=None, fields=None, sort=None):
+        # See MongoDBService.iter_books - returns the cursor, an async iterator, once the 'after' book is found, so
+        # that an invalid one raises before a response is streamed
+        log_sampled(logger, "Iterating books with filters: %s, limit: %s, after: %s, fields: %s, sort: %s",
+                    filters, limit, after, fields, sort)
+        after_value = await self.get_sort_value(after, sort[0]) if after and sort else None
+        pipeline = MongoDBService.page_pipeline(MongoDBService.build_books_query(filters), limit, after, 'id', fields,
+                                                sort, after_value, DERIVED_FIELDS)
+        return self.books_collection.aggregate(pipeline)
+
+    async def get_sort_value(self, after, field):
+        book = await self.books_collection.find_one({'_id': ObjectId(after)}, {field: 1})
+        if not book:
+            raise ValueError("'after' must be an ID returned by a previous page")
+        return book.get(field)
+
+    async def search_books(self, text, limit, fields=None):
+        log_sampled(logger, "Searching books for: %s, limit: %s", text, limit)
+        return await self.books_collection.aggregate(MongoDBService.search_pipeline(text, limit, fields)).to_list(None)
+
+    async def get_books_by_title_prefix(self, prefix, limit):
+        books = self.books_collection.find({'title': {'$regex': f'^{re.escape(prefix)}'}}, {'title': 1})
+        return [{'id': str(book['_id']), 'title': book['title']}
+                async for book in books.sort('title', 1).limit(limit)]
+
+    async def get_books_by_isbns(self, isbns):
+        log_sampled(logger, "Fetching books of %s ISBNs", len(isbns))
+        if not isbns:
+            return {}
+        books = {}
+        async for book in self.books_collection.find({'ISBN': {'$in': list(set(isbns))}}, BOOK_PROJECTION):
+            book['id'] = str(book.pop('_id'))
+            books[book['ISBN']] = book
+        return books
+
+    async def get_existing_isbns(self, isbns):
+        log_sampled(logger, "Fetching existing ISBNs out of %s ISBNs", len(isbns))
+        if not isbns:
+            return set()
+        books = self.books_collection.find({'ISBN': {'$in': list(isbns)}}, {'ISBN': 1, '_id': 0})
+        return {book['ISBN'] async for book in books}
+
+    async def insert_books_with_ratings(self, books, ratings):
+        # See MongoDBService.insert_books_with_ratings
+        book_dicts = [with_derived_fields(book.to_dict()) for book in books]
+        log_sampled(logger, "Inserting %s books into MongoDB", len(book_dicts))
+        failed = {}
+        try:
+            try:
+                await self.books_collection.insert_many(book_dicts, ordered=False)
+            except BulkWriteError as e:
+                failed = {error['index']: error['errmsg'] for error in e.details['writeErrors']}
+            rating_dicts = [dict(rating.to_dict(), _id=book_dict['_id'])
+                            for index, (book_dict, rating) in enumerate(zip(book_dicts, ratings))
+                            if index not in failed]
+            if rating_dicts:
+                await self.ratings_collection.insert_many(rating_dicts, ordered=False)
+        finally:
+            await self.bump_version('books', 'ratings')
+        log_sampled(logger, "Inserted %s books", len(book_dicts) - len(failed))
+
+        book_ids = [None if index in failed else book_dict['_id'] for index, book_dict in enumerate(book_dicts)]
+        errors = [failed.get(index) for index in range(len(book_dicts))]
+        return book_ids, errors
+
+    async def update_book(self, id, updated_data):
+        log_sampled(logger, "Updating book with ID: %s with data: %s", id, summarize(updated_data))
+        result = await self.books_collection.update_one({'_id': ObjectId(id)},
+                                                        {'$set': with_derived_fields(updated_data)})
+        if result.modified_count:
+            await self.bump_version('books')
+        return result.modified_count
+
+    async def update_pending_book(self, id, updated_data):
+        log_sampled(logger, "Updating pending book with ID: %s with data: %s", id, summarize(updated_data))
+        result = await self.books_collection.update_one({'_id': ObjectId(id), 'authors': PENDING},
+                                                        {'$set': with_derived_fields(updated_data)})
+        if result.modified_count:
+            await self.bump_version('books')
+        return result.modified_count
+
+    async def delete_book(self, id):
+        log_sampled(logger, "Deleting book with ID: %s", id)
+        result = await self.books_collection.delete_one({'_id': ObjectId(id)})
+        if result.deleted_count:
+            await self.bump_version('books')
+        return result.deleted_count
+
+    # Ratings Collection Operations
+    async def get_rating(self, id):
+        log_sampled(logger, "Fetching rating with ID: %s", id)
+        return await self.ratings_collection.find_one({'_id': ObjectId(id)})
+
+    async def rating_exists(self, id):
+        # See MongoDBService.rating_exists
+        if not ObjectId.is_valid(id):
+            return False
+        return await self.ratings_collection.find_one({'_id': ObjectId(id)}, {'_id': 1}) is not None
+
+    async def iter_ratings(self, limit=None, after=None, fields=None):
+        log_sampled(logger, "Iterating ratings with limit: %s, after: %s, fields: %s", limit, after, fields)
+        pipeline = MongoDBService.page_pipeline({}, limit, after, 'id', fields)
+        async for rating in self.ratings_collection.aggregate(pipeline):
+            yield rating
+
+    async def get_top_ratings(self, min_values, top_averages):
+        # See MongoDBService.get_top_ratings
+        log_sampled(logger, "Fetching ratings of the top %s averages", top_averages)
+        cursor = (self.ratings_collection.find({'count': {'$gte': min_values}}, {'title': 1, 'average': 1})
+                  .sort([('average', -1), ('_id', 1)]))
+        top_ratings = []
+        averages = set()
+        async for rating in cursor:
+            if rating['average'] not in averages:
+                if len(averages) == top_averages:
+                    break
+                averages.add(rating['average'])
+            rating['id'] = str(rating.pop('_id'))
+            top_ratings.append(rating)
+        await cursor.close()
+        return top_ratings
+
+    async def update_rating(self, rating_id, updated_data):
+        log_sampled(logger, "Updating rating with ID: %s with data: %s", rating_id, summarize(updated_data))
+        result = await self.ratings_collection.update_one({'_id': ObjectId(rating_id)}, {'$set': updated_data})
+        if result.modified_count:
+            await self.bump_version('ratings')
+        return result.modified_count
+
+    async def add_rating_value(self, id, value):
+        # See MongoDBService.add_rating_value
+        value = int(value)
+        log_sampled(logger, "Adding value %s to rating with ID: %s", value, id)
+        rating = await self.ratings_collection.find_one_and_update({'_id': ObjectId(id)}, [
+            {'$set': {'count': {'$add': ['$count', 1]},
+                      'sum': {'$add': ['$sum', value]},
+                      f'histogram.{value}': {'$add': [f'$histogram.{value}', 1]}}},
+            {'$set': {'average': {'$round': [{'$divide': ['$sum', '$count']}, 2]}}},
+        ], return_document=ReturnDocument.AFTER)
+
+        if rating and self.log_votes:
+            vote = {'ratingId': rating['_id'], 'value': value, 'createdAt': datetime.utcnow()}
+            await self.votes_collection.insert_one(vote)
+        return rating
+
+    async def delete_rating(self, id):
+        log_sampled(logger, "Deleting rating with ID: %s", id)
+        result = await self.ratings_collection.delete_one({'_id': ObjectId(id)})
+        if result.deleted_count:
+            await self.bump_version('ratings')
+        if self.log_votes:
+            await self.votes_collection.delete_many({'ratingId': ObjectId(id)})
+        return result.deleted_count
+
+    # Books Mutations with their Outbox Events
+    async def insert_book_with_rating(self, book, rating):
+        # See MongoDBService.insert_book_with_rating
+        book_dict = with_derived_fields(book.to_dict())
+
+        async def insert(session):
+            book_id = (await self.books_collection.insert_one(dict(book_dict), session=session)).inserted_id
+            await self.ratings_collection.insert_one(dict(rating.to_dict(), _id=book_id), session=session)
+            await self.bump_version('books', 'ratings', session=session)
+            return book_id
+
+        log_sampled(logger, "Inserting book and rating into MongoDB: %s", summarize(book_dict))
+        return await self.run_write_unit(insert)
+
+    async def update_book_with_rating(self, id, updated_data):
+        # See MongoDBService.update_book_with_rating
+        async def update(session):
+            result = await self.books_collection.update_one({'_id': ObjectId(id)},
+                                                            {'$set': with_derived_fields(updated_data)},
+                                                            session=session)
+            if result.modified_count:
+                if 'title' in updated_data:
+                    await self.ratings_collection.update_one({'_id': ObjectId(id)},
+                                                             {'$set': {'title': updated_data['title']}},
+                                                             session=session)
+                event_data = {key: updated_data[key] for key in ('title', 'ISBN') if key in updated_data}
+                await self.append_event('book.updated', id, event_data, session)
+                await self.bump_version('books', 'ratings', session=session)
+            return result.modified_count
+
+        log_sampled(logger, "Updating book with ID: %s with data: %s", id, summarize(updated_data))
+        return await self.run_write_unit(update)
+
+    async def delete_book_with_rating(self, id):
+        # See MongoDBService.delete_book_with_rating
+        async def delete(session):
+            result = await self.books_collection.delete_one({'_id': ObjectId(id)}, session=session)
+            if result.deleted_count:
+                await self.ratings_collection.delete_one({'_id': ObjectId(id)}, session=session)
+                await self.append_event('book.deleted', id, {}, session)
+                await self.bump_version('books', 'ratings', session=session)
+            return result.deleted_count
+
+        log_sampled(logger, "Deleting book and rating with ID: %s", id)
+        deleted_count = await self.run_write_unit(delete)
+        if deleted_count and self.log_votes:
+            await self.votes_collection.delete_many({'ratingId': ObjectId(id)})
+        return deleted_count
+
+    async def run_write_unit(self, write):
+        # See MongoDBService.run_write_unit - write(session) is a coroutine function
+        if self.transactions is None:
+            self.transactions = await self.supports_transactions()
+        if not self.transactions:
+            return await write(None)
+        async with await self.client.start_session() as session:
+            return await session.with_transaction(write)
+
+    async def supports_transactions(self):
+        try:
+            hello = await self.client.admin.command('hello')
+            transactions = 'setName' in hello or hello.get('msg') == 'isdbgrid'
+        except Exception as e:
+            logger.warning("Error checking MongoDB transactions support: %s", e)
+            transactions = False
+        if not transactions:
+            logger.warning("MongoDB doesn't support transactions - outbox events are written after their mutations")
+        return transactions
+
+    # Outbox Collection Operations
+    async def append_event(self, event_type, book_id, data, session=None):
+        # See MongoDBService.append_event
+        counter = await self.counters_collection.find_one_and_update(
+            {'_id': 'outbox'}, {'$inc': {'seq': 1}}, upsert=True, return_document=ReturnDocument.AFTER,
+            session=session)
+        event = {'seq': counter['seq'], 'type': event_type, 'bookId': str(book_id), 'data': data,
+                 'status': 'pending', 'createdAt': datetime.utcnow()}
+        await self.outbox_collection.insert_one(event, session=session)
+
+    # Collection Versions Operations
+    async def bump_version(self, *names, session=None):
+        # See MongoDBService.bump_version
+        result = await self.versions_collection.update_many(
+            {'_id': {'$in': list(names)}}, {'$inc': {'version': 1}, '$currentDate': {'updatedAt': True}},
+            session=session)
+        if result.matched_count == len(names):
+            return
+        for name in names:
+            await self.versions_collection.update_one(
+                {'_id': name}, {'$setOnInsert': {'version': 1, 'updatedAt': datetime.utcnow(),
+                                                 'epoch': str(ObjectId())}}, upsert=True, session=session)
+
+    async def get_versions(self, names):
+        # The version documents of the given collections, by name - missing for never written collections
+        versions = self.versions_collection.find({'_id': {'$in': list(names)}})
+        return {version['_id']: version async for version in versions}
+
+    # Enrichment Jobs Collection Operations
+    async def insert_enrichment_job(self, book_id, isbn):
+        now = datetime.utcnow()
+        job = {'bookId': book_id, 'ISBN': isbn, 'status': 'queued', 'attempts': 0, 'error': None,
+               'nextAttemptAt': now, 'createdAt': now, 'updatedAt': now}
+        result = await self.enrichment_jobs_collection.insert_one(job)
+        return result.inserted_id
+
+    async def claim_enrichment_job(self, lease_seconds):
+        # See MongoDBService.claim_enrichment_job
+        now = datetime.utcnow()
+        return await self.enrichment_jobs_collection.find_one_and_update(
+            {'$or': [{'status': 'queued', 'nextAttemptAt': {'$lte': now}},
+                     {'status': 'running', 'lockedUntil': {'$lt': now}}]},
+            {'$set': {'status': 'running', 'lockedUntil': now + timedelta(seconds=lease_seconds), 'updatedAt': now},
+             '$inc': {'attempts': 1}},
+            sort=[('nextAttemptAt', 1)], return_document=ReturnDocument.AFTER)
+
+    async def finish_enrichment_job(self, job_id, status, error=None):
+        await self.enrichment_jobs_collection.update_one(
+            {'_id': job_id}, {'$set': {'status': status, 'error': error, 'updatedAt': datetime.utcnow()},
+                              '$unset': {'lockedUntil': ''}})
+
+    async def retry_enrichment_job(self, job_id, delay_seconds, error):
+        now = datetime.utcnow()
+        await self.enrichment_jobs_collection.update_one(
+            {'_id': job_id}, {'$set': {'status': 'queued', 'error': error, 'updatedAt': now,
+                                       'nextAttemptAt': now + timedelta(seconds=delay_seconds)},
+                              '$unset': {'lockedUntil': ''}})
+
+    async def get_enrichment_job(self, book_id):
+        return await self.enrichment_jobs_collection.find_one({'bookId': ObjectId(book_id)}, sort=[('_id', -1)])
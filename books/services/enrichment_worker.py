@@ -0,0 +1,92 @@
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Number of background threads loading books' data from the Google Books API
+ENRICHMENT_WORKERS = int(os.getenv('ENRICHMENT_WORKERS', 2))
+# Attempts of a job before it fails, and the retries backoff - doubled on every attempt, up to the max
+ENRICHMENT_MAX_ATTEMPTS = int(os.getenv('ENRICHMENT_MAX_ATTEMPTS', 5))
+ENRICHMENT_BACKOFF_SECONDS = float(os.getenv('ENRICHMENT_BACKOFF_SECONDS', 2))
+ENRICHMENT_MAX_BACKOFF_SECONDS = float(os.getenv('ENRICHMENT_MAX_BACKOFF_SECONDS', 300))
+# A running job whose worker didn't finish it within the lease is taken by another worker
+ENRICHMENT_LEASE_SECONDS = int(os.getenv('ENRICHMENT_LEASE_SECONDS', 60))
+# How often idle workers check for jobs queued by other replicas
+ENRICHMENT_POLL_SECONDS = float(os.getenv('ENRICHMENT_POLL_SECONDS', 5))
+
+
+def should_retry(job, status):
+    # Server and connection errors are retried, until the job ran out of attempts
+    return status >= 500 and job['attempts'] < ENRICHMENT_MAX_ATTEMPTS
+
+
+def retry_delay(job):
+    # Exponential backoff - doubled on every attempt, up to the max
+    return min(ENRICHMENT_BACKOFF_SECONDS * 2 ** (job['attempts'] - 1), ENRICHMENT_MAX_BACKOFF_SECONDS)
+
+
+class EnrichmentWorkers:
+    # Background workers processing the enrichment jobs queued in MongoDB.
+    # enrich(job) returns None on success, or an (error, status code) pair - 5xx errors are retried,
+    # give_up(job) is called once a job failed for good
+    def __init__(self, mongodb_service, enrich, give_up, workers=ENRICHMENT_WORKERS):
+        self.mongodb_service = mongodb_service
+        self.enrich = enrich
+        self.give_up = give_up
+        self.workers = workers
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self.run, name=f'enrichment-worker-{number}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def notify(self):
+        # Wake up an idle worker - a job was just queued
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                job = self.mongodb_service.claim_enrichment_job(ENRICHMENT_LEASE_SECONDS)
+            except Exception as e:
+                logger.error("Error claiming enrichment job: %s", e)
+                job = None
+
+            if not job:
+                self.wakeup.wait(ENRICHMENT_POLL_SECONDS)
+                self.wakeup.clear()
+                continue
+
+            try:
+                self.process(job)
+            except Exception as e:
+                logger.error("Error processing enrichment job %s: %s", job['_id'], e, exc_info=True)
+
+    def process(self, job):
+        try:
+            res_err = self.enrich(job)
+        except Exception as e:
+            res_err = {"error": f"Error loading book data: {str(e)}"}, 500
+
+        if not res_err:
+            self.mongodb_service.finish_enrichment_job(job['_id'], 'done')
+            return
+
+        error, status = res_err
+        if should_retry(job, status):
+            self.mongodb_service.retry_enrichment_job(job['_id'], retry_delay(job), error['error'])
+        else:
+            logger.warning("Enrichment job %s of ISBN %s failed: %s", job['_id'], job['ISBN'], error['error'])
+            self.give_up(job)
+            self.mongodb_service.finish_enrichment_job(job['_id'], 'failed', error['error'])
@@ -0,0 +1,99 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# How long Google Books results are cached - found books, and ISBNs with no items ('totalItems' == 0)
+GOOGLE_BOOKS_CACHE_TTL = int(os.getenv('GOOGLE_BOOKS_CACHE_TTL', 7 * 24 * 60 * 60))
+GOOGLE_BOOKS_NEGATIVE_CACHE_TTL = int(os.getenv('GOOGLE_BOOKS_NEGATIVE_CACHE_TTL', 60 * 60))
+# Number of ISBNs kept in the in-process cache
+GOOGLE_BOOKS_CACHE_SIZE = int(os.getenv('GOOGLE_BOOKS_CACHE_SIZE', 10000))
+
+
+class GoogleBooksCache:
+    # Two-tier cache of Google Books lookups by ISBN - an in-process LRU in front of a MongoDB collection
+    # whose documents are expired by a TTL index on 'expiresAt'
+    def __init__(self, collection, max_size=GOOGLE_BOOKS_CACHE_SIZE, ttl=GOOGLE_BOOKS_CACHE_TTL,
+                 negative_ttl=GOOGLE_BOOKS_NEGATIVE_CACHE_TTL):
+        self.collection = collection
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'mongo_hits': 0, 'misses': 0, 'errors': 0}
+
+    def get(self, isbn):
+        # Returns (found, result) - result being the book's volume info, or 0 if the ISBN has no items
+        found, result = self.get_from_memory(isbn)
+        if found:
+            return found, result
+
+        try:
+            document = self.collection.find_one(self.document_query(isbn))
+        except Exception as e:
+            logger.warning("Error reading Google Books cache for ISBN %s: %s", isbn, e)
+            document = None
+            self.count('errors')
+        return self.get_from_document(isbn, document)
+
+    def set(self, isbn, result):
+        document = self.remember_result(isbn, result)
+        try:
+            self.collection.replace_one({'_id': isbn}, document, upsert=True)
+        except Exception as e:
+            logger.warning("Error writing Google Books cache for ISBN %s: %s", isbn, e)
+            self.count('errors')
+
+    def get_from_memory(self, isbn):
+        with self.lock:
+            entry = self.entries.get(isbn)
+            if entry and entry[1] > time.time():
+                self.entries.move_to_end(isbn)
+                self.counters['memory_hits'] += 1
+                return True, entry[0]
+        return False, None
+
+    @staticmethod
+    def document_query(isbn):
+        return {'_id': isbn, 'expiresAt': {'$gt': datetime.utcnow()}}
+
+    def get_from_document(self, isbn, document):
+        if not document:
+            self.count('misses')
+            return False, None
+
+        self.count('mongo_hits')
+        result = document['data'] if document['data'] is not None else 0
+        expires_in = (document['expiresAt'] - datetime.utcnow()).total_seconds()
+        self.remember(isbn, result, time.time() + expires_in)
+        return True, result
+
+    def remember_result(self, isbn, result):
+        # Only found books and ISBNs with no items are cached, never connection errors.
+        # Returns the cache document of the result
+        ttl = self.negative_ttl if result == 0 else self.ttl
+        self.remember(isbn, result, time.time() + ttl)
+        return {
+            'data': result if result != 0 else None,
+            'expiresAt': datetime.utcnow() + timedelta(seconds=ttl)
+        }
+
+    def remember(self, isbn, result, expires_at):
+        with self.lock:
+            self.entries[isbn] = (result, expires_at)
+            self.entries.move_to_end(isbn)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, size=len(self.entries), max_size=self.max_size)
@@ -1,15 +1,63 @@
+import os
+import time
 import requests
+from common.metrics import observe_call
+from common.single_flight import SingleFlight
 
-GOOGLE_BOOK_BY_ISBN_API = "https://www.googleapis.com/books/v1/volumes?q=isbn:"
+# Volumes search of the Google Books API - may point at a stub server, e.g. for benchmarks
+GOOGLE_BOOKS_API_URL = os.getenv('GOOGLE_BOOKS_API_URL', "https://www.googleapis.com/books/v1/volumes")
+GOOGLE_BOOK_BY_ISBN_API = f"{GOOGLE_BOOKS_API_URL}?q=isbn:"
+
+# Seconds to wait for the Google Books API before giving up
+GOOGLE_BOOKS_TIMEOUT = float(os.getenv('GOOGLE_BOOKS_TIMEOUT', 5))
+
+# Reuse connections to the Google Books API between requests
+session = requests.Session()
+
+# Optional GoogleBooksCache of the lookups by ISBN
+cache = None
+
+# Concurrent lookups of the same ISBN share a single cache read and API call
+lookups = SingleFlight('google_books')
+
+
+def set_google_books_cache(google_books_cache):
+    global cache
+    cache = google_books_cache
 
 
 def get_book_authors_publisher_published_date(isbn):
+    return lookups.do(isbn, lambda: lookup_book_authors_publisher_published_date(isbn))
+
+
+def lookup_book_authors_publisher_published_date(isbn):
+    if cache:
+        found, result = cache.get(isbn)
+        if found:
+            return result
+
+    result = fetch_book_authors_publisher_published_date(isbn)
+
+    # Cache found books and ISBNs with no items, but not connection errors
+    if cache and result != -1:
+        cache.set(isbn, result)
+    return result
+
+
+def fetch_book_authors_publisher_published_date(isbn):
     # Make a request to Google books API to get the book's authors, publisher and published date
+    start = time.perf_counter()
     try:
-        response = requests.get(f'{GOOGLE_BOOK_BY_ISBN_API}{isbn}')
+        response = session.get(f'{GOOGLE_BOOK_BY_ISBN_API}{isbn}', timeout=GOOGLE_BOOKS_TIMEOUT)
     except:
+        observe_call('google_books', start)
         return -1
+    observe_call('google_books', start, response)
+
+    return parse_google_books_response(response)
+
 
+def parse_google_books_response(response):
     try:
         data = response.json()['items'][0]['volumeInfo']
         return data
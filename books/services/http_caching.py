@@ -0,0 +1,31 @@
+import os
+import hashlib
+from datetime import timezone
+
+# Seconds the clients and nginx may reuse a catalog read before revalidating it with its ETag - 0 to always revalidate
+CATALOG_CACHE_MAX_AGE = int(os.getenv('CATALOG_CACHE_MAX_AGE', 5))
+
+
+def catalog_etag(versions, collections, full_path):
+    # Tag of a catalog read - changes with its URL and with the version of any of the collections it reads.
+    # versions are the version documents of MongoDBService.get_versions
+    parts = [full_path]
+    for name in collections:
+        version = versions.get(name)
+        parts.append(f"{name}:{version['epoch']}:{version['version']}" if version else f"{name}:0")
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:20]
+
+
+def catalog_last_modified(versions):
+    dates = [version['updatedAt'] for version in versions.values()]
+    return max(dates).replace(tzinfo=timezone.utc) if dates else None
+
+
+def set_catalog_cache_headers(response, etag, last_modified):
+    # The ETag is weak, as nginx compresses the responses
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = CATALOG_CACHE_MAX_AGE
+    return response
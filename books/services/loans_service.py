@@ -0,0 +1,42 @@
+import os
+import time
+import logging
+import requests
+from common.metrics import observe_call
+
+logger = logging.getLogger(__name__)
+
+# The loans service replicas, tried in order - any of them applies the events to the shared loans database
+LOANS_SERVICE_URLS = os.getenv('LOANS_SERVICE_URLS', 'http://loans-service-1:5002,http://loans-service-2:5003')
+# Seconds to wait for the loans service - to connect, and for its response
+LOANS_SERVICE_CONNECT_TIMEOUT = float(os.getenv('LOANS_SERVICE_CONNECT_TIMEOUT', 1))
+LOANS_SERVICE_READ_TIMEOUT = float(os.getenv('LOANS_SERVICE_READ_TIMEOUT', 10))
+
+# API key of the books-service on the loans service
+API_KEY = 'books-service-api-key'
+
+
+class LoansServiceClient:
+    def __init__(self, urls=LOANS_SERVICE_URLS):
+        self.urls = [url.strip() for url in urls.split(',') if url.strip()]
+        self.session = requests.Session()
+        self.timeout = (LOANS_SERVICE_CONNECT_TIMEOUT, LOANS_SERVICE_READ_TIMEOUT)
+
+    def deliver_book_events(self, events):
+        # Send a batch of outbox events, raising if no replica applied it
+        error = None
+        for url in self.urls:
+            start = time.perf_counter()
+            response = None
+            try:
+                response = self.session.post(f"{url}/books-service/events", json={'events': events},
+                                             headers={'API-KEY': API_KEY}, timeout=self.timeout)
+                observe_call('loans_service', start, response)
+                response.raise_for_status()
+                return response.json()
+            except requests.exceptions.RequestException as e:
+                if response is None:
+                    observe_call('loans_service', start)
+                logger.warning("Error delivering %s book events to %s: %s", len(events), url, e)
+                error = e
+        raise error
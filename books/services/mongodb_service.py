@@ -1,104 +1,592 @@
 import os
+import re
 import logging
+from datetime import datetime, timedelta
 from bson import ObjectId
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from common.metrics import mongo_event_listeners
+from common.structured_logging import log_sampled, summarize
+from models.book import DERIVED_FIELDS, PENDING, with_derived_fields
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Projection of the returned books - without their derived fields
+BOOK_PROJECTION = {field: 0 for field in DERIVED_FIELDS}
+
+
 class MongoDBService:
     def __init__(self, host='mongo', port=27017, books_db_name='books', ratings_db_name='ratings'):
         mongo_uri = os.getenv('MONGO_URI', f'mongodb://{host}:{port}/')
-        self.client = MongoClient(mongo_uri)
+        self.client = MongoClient(mongo_uri, event_listeners=mongo_event_listeners())
         self.books_db = self.client[books_db_name]
         self.ratings_db = self.client[ratings_db_name]
         self.books_collection = self.books_db['books']
         self.ratings_collection = self.ratings_db['ratings']
-        logger.debug(f"MongoDBService initialized with URI: {mongo_uri}")
+        # Optional log of every rating value, on top of the ratings' aggregates
+        self.votes_collection = self.ratings_db['votes']
+        self.log_votes = os.getenv('RATINGS_VOTE_LOG', '0') == '1'
+        # Cached Google Books lookups, see GoogleBooksCache
+        self.google_books_cache_collection = self.books_db['google_books_cache']
+        # Queue of the books waiting for their Google Books data, see EnrichmentWorkers
+        self.enrichment_jobs_collection = self.books_db['enrichment_jobs']
+        # Version of the books and ratings collections, bumped by their writes - the ETags of the catalog reads
+        self.versions_collection = self.books_db['collection_versions']
+        # Events of the books mutations for the loans service, appended by the mutations' transactions - see OutboxRelay
+        self.outbox_collection = self.books_db['outbox']
+        self.counters_collection = self.books_db['counters']
+        self.locks_collection = self.books_db['locks']
+        # Progress of the resumable imports of POST /admin/import, by checkpoint name
+        self.import_checkpoints_collection = self.books_db['import_checkpoints']
+        # Whether MongoDB supports multi-document transactions, checked on the first write unit
+        self.transactions = None
+        logger.debug("MongoDBService initialized with URI: %s", mongo_uri)
 
     # Books Collection Operations
     def get_book(self, id):
-        logger.debug(f"Fetching book with ID: {id}")
-        book = self.books_collection.find_one({'_id': ObjectId(id)})
+        log_sampled(logger, "Fetching book with ID: %s", id)
+        book = self.books_collection.find_one({'_id': ObjectId(id)}, BOOK_PROJECTION)
         if book:
             book['id'] = str(book.pop('_id'))  # change _id to id and convert ObjectId to string
-        logger.debug(f"Found book: {book}")
+        log_sampled(logger, "Found book: %s", summarize(book))
         return book
 
     def get_book_by_isbn(self, isbn):
-        logger.debug(f"Fetching book with ISBN: {isbn}")
-        book = self.books_collection.find_one({'ISBN': isbn})
+        log_sampled(logger, "Fetching book with ISBN: %s", isbn)
+        book = self.books_collection.find_one({'ISBN': isbn}, BOOK_PROJECTION)
         if book:
             book['id'] = str(book.pop('_id'))
-        logger.debug(f"Found book: {book}")
+        log_sampled(logger, "Found book: %s", summarize(book))
         return book
 
-    def get_all_books(self):
-        logger.debug("Fetching all books")
+    def get_all_books(self, filters=None, fields=None):
+        log_sampled(logger, "Fetching all books with filters: %s", filters)
         try:
-            books = list(self.books_collection.find())
-            logger.debug(f"Raw books from DB: {books}")
-
-            for book in books:
-                book['id'] = str(book.pop('_id'))
-
-            logger.debug(f"Processed books: {books}")
+            books = list(self.iter_books(filters, fields=fields))
+            log_sampled(logger, "Found books: %s", summarize(books))
             return books
         except Exception as e:
-            logger.error(f"Error fetching books: {e}", exc_info=True)
+            logger.error("Error fetching books: %s", e, exc_info=True)
             raise
 
-    def insert_book(self, book):
-        book_dict = book.to_dict()
-        logger.debug(f"Inserting book into MongoDB: {book_dict}")
-        result = self.books_collection.insert_one(book_dict)
-        logger.debug(f"Inserted book with ID: {result.inserted_id}")
-        return result.inserted_id
+    def iter_books(self, filters=None, limit=None, after=None, fields=None, sort=None):
+        # Iterate over the matching books from the database cursor, optionally a page of them and only some fields,
+        # in the order of an optional (field, direction) sort
+        log_sampled(logger, "Iterating books with filters: %s, limit: %s, after: %s, fields: %s, sort: %s",
+                    filters, limit, after, fields, sort)
+        after_value = self.get_sort_value(after, sort[0]) if after and sort else None
+        pipeline = self.page_pipeline(self.build_books_query(filters), limit, after, 'id', fields, sort, after_value,
+                                      DERIVED_FIELDS)
+        return self.books_collection.aggregate(pipeline)
+
+    def get_sort_value(self, after, field):
+        # The sort field's value of the last book of the previous page
+        book = self.books_collection.find_one({'_id': ObjectId(after)}, {field: 1})
+        if not book:
+            raise ValueError("'after' must be an ID returned by a previous page")
+        return book.get(field)
+
+    @staticmethod
+    def page_pipeline(query, limit=None, after=None, id_key='id', fields=None, sort=None, after_value=None,
+                      hidden=()):
+        # Aggregation pipeline of a page of the documents matching the query. Pages are ordered by _id, or by a
+        # (field, direction) sort and then _id, 'after' being the last ID of the previous page and 'after_value' its
+        # sort field's value. The documents are projected to the given fields (all but the hidden ones by default)
+        # and _id is renamed to id_key as a string, by the database - the ID is always returned, as the position of
+        # the page
+        if after:
+            after_query = MongoDBService.after_query(after, sort, after_value)
+            query = {'$and': [query, after_query]} if query else after_query
+
+        pipeline = [{'$match': query}]
+        if sort:
+            pipeline.append({'$sort': {sort[0]: sort[1], '_id': sort[1]}})
+        elif limit or after:
+            pipeline.append({'$sort': {'_id': 1}})
+        if limit:
+            pipeline.append({'$limit': limit})
+        return pipeline + MongoDBService.project_stages(id_key, fields, hidden)
+
+    @staticmethod
+    def after_query(after, sort=None, after_value=None):
+        # The documents following the 'after' document in the page order. Null sort values come first in ascending
+        # order and last in descending order, as MongoDB sorts them
+        after = ObjectId(after)
+        if not sort:
+            return {'_id': {'$gt': after}}
+
+        field, direction = sort
+        following = '$gt' if direction == 1 else '$lt'
+        same_value = {field: after_value, '_id': {following: after}}
+        if after_value is None:
+            return {'$or': [{field: {'$ne': None}}, same_value]} if direction == 1 else same_value
+        conditions = [{field: {following: after_value}}, same_value]
+        if direction == -1:
+            conditions.append({field: None})
+        return {'$or': conditions}
+
+    @staticmethod
+    def project_stages(id_key='id', fields=None, hidden=()):
+        if fields:
+            projection = {field: 1 for field in fields if field != id_key}
+            return [{'$project': dict(projection, _id=0, **{id_key: {'$toString': '$_id'}})}]
+        return [{'$addFields': {id_key: {'$toString': '$_id'}}},
+                {'$project': dict({'_id': 0}, **{field: 0 for field in hidden})}]
+
+    @staticmethod
+    def search_pipeline(text, limit, fields=None):
+        # The books matching the words of the text in their title, authors or publisher - by the text index,
+        # most relevant first
+        return [
+            {'$match': {'$text': {'$search': text}}},
+            {'$sort': {'score': {'$meta': 'textScore'}, '_id': 1}},
+            {'$limit': limit},
+        ] + MongoDBService.project_stages('id', fields, DERIVED_FIELDS)
+
+    def search_books(self, text, limit, fields=None):
+        log_sampled(logger, "Searching books for: %s, limit: %s", text, limit)
+        return list(self.books_collection.aggregate(self.search_pipeline(text, limit, fields)))
+
+    def get_books_by_title_prefix(self, prefix, limit):
+        # The books whose title starts with the prefix, by the title index - case sensitive
+        books = self.books_collection.find({'title': {'$regex': f'^{re.escape(prefix)}'}}, {'title': 1})
+        return [{'id': str(book['_id']), 'title': book['title']} for book in books.sort('title', 1).limit(limit)]
+
+    @staticmethod
+    def build_books_query(filters):
+        # Turn a list of (field, value) filters into a single MongoDB query - all filters must match
+        conditions = []
+        for key, value in filters or []:
+            if key == 'id':
+                # An ID which is not a valid ObjectId can't match any book
+                conditions.append({'_id': ObjectId(value) if ObjectId.is_valid(value) else None})
+            elif key == 'publishedDate' and re.match(r'^\d{4}$', value):
+                # '2014' query will find either '2014' or '2014-MM-DD', by the derived year
+                conditions.append({'publishedYear': int(value)})
+            elif key.startswith('publishedDate['):
+                conditions.append(MongoDBService.published_date_range(key[len('publishedDate['):-1], value))
+            else:
+                conditions.append({key: value})
+
+        if not conditions:
+            return {}
+        if len(conditions) == 1:
+            return conditions[0]
+        return {'$and': conditions}
+
+    @staticmethod
+    def published_date_range(operator, value):
+        # A 'YYYY' bound covers the whole year - e.g. 'lte' 2015 includes 2015-12-31, while 'gt' 2015 doesn't
+        if operator in ('gte', 'lt'):
+            bound = value if len(value) > 4 else f'{value}-00-00'
+        else:
+            bound = value if len(value) > 4 else f'{value}-99-99'
+        return {'publishedDateSort': {f'${operator}': bound}}
+
+    def get_books_by_isbns(self, isbns):
+        # The books with the given ISBNs, by ISBN, with a single query
+        log_sampled(logger, "Fetching books of %s ISBNs", len(isbns))
+        if not isbns:
+            return {}
+        books = {}
+        for book in self.books_collection.find({'ISBN': {'$in': list(set(isbns))}}, BOOK_PROJECTION):
+            book['id'] = str(book.pop('_id'))
+            books[book['ISBN']] = book
+        return books
+
+    def get_existing_isbns(self, isbns):
+        # The ISBNs, out of the given ones, which already belong to a stored book
+        log_sampled(logger, "Fetching existing ISBNs out of %s ISBNs", len(isbns))
+        if not isbns:
+            return set()
+        books = self.books_collection.find({'ISBN': {'$in': list(isbns)}}, {'ISBN': 1, '_id': 0})
+        return {book['ISBN'] for book in books}
+
+    def insert_books_with_ratings(self, books, ratings):
+        # Insert the books in a single batch, then the ratings of those inserted with their IDs, and bump both
+        # versions once. Returns the books' IDs and errors - a None ID or error for each book
+        book_dicts = [with_derived_fields(book.to_dict()) for book in books]
+        log_sampled(logger, "Inserting %s books into MongoDB", len(book_dicts))
+        failed = {}
+        try:
+            try:
+                self.books_collection.insert_many(book_dicts, ordered=False)
+            except BulkWriteError as e:
+                failed = {error['index']: error['errmsg'] for error in e.details['writeErrors']}
+            rating_dicts = [dict(rating.to_dict(), _id=book_dict['_id'])
+                            for index, (book_dict, rating) in enumerate(zip(book_dicts, ratings))
+                            if index not in failed]
+            if rating_dicts:
+                self.ratings_collection.insert_many(rating_dicts, ordered=False)
+        finally:
+            self.bump_version('books', 'ratings')
+        log_sampled(logger, "Inserted %s books", len(book_dicts) - len(failed))
+
+        book_ids = [None if index in failed else book_dict['_id'] for index, book_dict in enumerate(book_dicts)]
+        errors = [failed.get(index) for index in range(len(book_dicts))]
+        return book_ids, errors
 
     def update_book(self, id, updated_data):
-        logger.debug(f"Updating book with ID: {id} with data: {updated_data}")
-        result = self.books_collection.update_one({'_id': ObjectId(id)}, {'$set': updated_data})
-        logger.debug(f"Updated book count: {result.modified_count}")
+        log_sampled(logger, "Updating book with ID: %s with data: %s", id, summarize(updated_data))
+        result = self.books_collection.update_one({'_id': ObjectId(id)}, {'$set': with_derived_fields(updated_data)})
+        log_sampled(logger, "Updated book count: %s", result.modified_count)
+        if result.modified_count:
+            self.bump_version('books')
+        return result.modified_count
+
+    def update_pending_book(self, id, updated_data):
+        # Update the book's fields loaded from the Google Books API, unless they were already set otherwise
+        log_sampled(logger, "Updating pending book with ID: %s with data: %s", id, summarize(updated_data))
+        result = self.books_collection.update_one({'_id': ObjectId(id), 'authors': PENDING},
+                                                  {'$set': with_derived_fields(updated_data)})
+        log_sampled(logger, "Updated book count: %s", result.modified_count)
+        if result.modified_count:
+            self.bump_version('books')
         return result.modified_count
 
     def delete_book(self, id):
-        logger.debug(f"Deleting book with ID: {id}")
+        log_sampled(logger, "Deleting book with ID: %s", id)
         result = self.books_collection.delete_one({'_id': ObjectId(id)})
-        logger.debug(f"Deleted book count: {result.deleted_count}")
+        log_sampled(logger, "Deleted book count: %s", result.deleted_count)
+        if result.deleted_count:
+            self.bump_version('books')
         return result.deleted_count
 
     # Ratings Collection Operations
     def get_rating(self, id):
-        logger.debug(f"Fetching rating with ID: {id}")
+        log_sampled(logger, "Fetching rating with ID: %s", id)
         rating = self.ratings_collection.find_one({'_id': ObjectId(id)})
-        logger.debug(f"Found rating: {rating}")
+        log_sampled(logger, "Found rating: %s", summarize(rating))
         return rating
 
-    def get_all_ratings(self):
-        logger.debug("Fetching all ratings")
-        ratings_list = list(self.ratings_collection.find())
-        for rating in ratings_list:
-            rating['id'] = str(rating.pop('_id'))
-        logger.debug(f"Found ratings: {ratings_list}")
+    def rating_exists(self, id):
+        # Whether the book has a rating, without reading its values - an invalid ID has none
+        return ObjectId.is_valid(id) and self.ratings_collection.find_one({'_id': ObjectId(id)}, {'_id': 1}) is not None
+
+    def get_all_ratings(self, fields=None):
+        log_sampled(logger, "Fetching all ratings")
+        ratings_list = list(self.iter_ratings(fields=fields))
+        log_sampled(logger, "Found ratings: %s", summarize(ratings_list))
         return ratings_list
 
-    def insert_rating(self, rating, book_id):
-        rating_dict = rating.to_dict()
-        rating_dict['_id'] = book_id
-        logger.debug(f"Inserting rating into MongoDB: {rating_dict}")
-        result = self.ratings_collection.insert_one(rating_dict)
-        logger.debug(f"Inserted rating with ID: {result.inserted_id}")
-        return result.inserted_id
+    def iter_ratings(self, limit=None, after=None, fields=None):
+        log_sampled(logger, "Iterating ratings with limit: %s, after: %s, fields: %s", limit, after, fields)
+        return self.ratings_collection.aggregate(self.page_pipeline({}, limit, after, 'id', fields))
+
+    def get_top_ratings(self, min_values, top_averages):
+        # Ratings with at least min_values values, whose average is one of the top_averages best distinct averages.
+        # Served by the 'top_rated' index, reading only the ratings returned plus one
+        log_sampled(logger, "Fetching ratings of the top %s averages", top_averages)
+        cursor = (self.ratings_collection.find({'count': {'$gte': min_values}}, {'title': 1, 'average': 1})
+                  .sort([('average', -1), ('_id', 1)]))
+        top_ratings = []
+        averages = set()
+        for rating in cursor:
+            if rating['average'] not in averages:
+                if len(averages) == top_averages:
+                    break
+                averages.add(rating['average'])
+            rating['id'] = str(rating.pop('_id'))
+            top_ratings.append(rating)
+        cursor.close()
+        return top_ratings
 
     def update_rating(self, rating_id, updated_data):
-        logger.debug(f"Updating rating with ID: {rating_id} with data: {updated_data}")
+        log_sampled(logger, "Updating rating with ID: %s with data: %s", rating_id, summarize(updated_data))
         result = self.ratings_collection.update_one({'_id': ObjectId(rating_id)}, {'$set': updated_data})
-        logger.debug(f"Updated rating count: {result.modified_count}")
+        log_sampled(logger, "Updated rating count: %s", result.modified_count)
+        if result.modified_count:
+            self.bump_version('ratings')
         return result.modified_count
 
+    def add_rating_value(self, id, value):
+        # Atomically add the value to the rating's count, sum and histogram and recompute its average.
+        # Returns the updated rating, or None if no rating was found. The ratings version isn't bumped - see
+        # VoteBuffer.add_written
+        value = int(value)
+        log_sampled(logger, "Adding value %s to rating with ID: %s", value, id)
+        rating = self.ratings_collection.find_one_and_update({'_id': ObjectId(id)}, [
+            {'$set': {'count': {'$add': ['$count', 1]},
+                      'sum': {'$add': ['$sum', value]},
+                      f'histogram.{value}': {'$add': [f'$histogram.{value}', 1]}}},
+            {'$set': {'average': {'$round': [{'$divide': ['$sum', '$count']}, 2]}}},
+        ], return_document=ReturnDocument.AFTER)
+
+        if rating and self.log_votes:
+            vote = {'ratingId': rating['_id'], 'value': value, 'createdAt': datetime.utcnow()}
+            self.votes_collection.insert_one(vote)
+        log_sampled(logger, "Updated rating: %s", summarize(rating))
+        return rating
+
+    def add_ratings_values(self, votes, bump=False):
+        # Add the values of many ratings - votes maps every rating's ID to a Counter of its values - with a single
+        # bulk write of one update per rating, and recompute their averages. The ratings version is bumped once, in
+        # the same write unit, if any rating was updated - or anyway with bump, for the votes written on their own.
+        # Returns (averages, errors) - the new averages by ID, missing for the ratings not found, and the errors of
+        # the ratings whose update failed by ID
+        ids = list(votes)
+        operations = {}
+        for id, values in votes.items():
+            increments = {'count': {'$add': ['$count', sum(values.values())]},
+                          'sum': {'$add': ['$sum', sum(value * count for value, count in values.items())]}}
+            for value, count in values.items():
+                increments[f'histogram.{value}'] = {'$add': [f'$histogram.{value}', count]}
+            operations[id] = UpdateOne({'_id': ObjectId(id)}, [
+                {'$set': increments},
+                {'$set': {'average': {'$round': [{'$divide': ['$sum', '$count']}, 2]}}},
+            ])
+        log_sampled(logger, "Adding the values of %s ratings", len(operations))
+        errors = {}
+
+        def write(session):
+            pending = [id for id in ids if id not in errors]
+            try:
+                if pending:
+                    self.ratings_collection.bulk_write([operations[id] for id in pending], ordered=False,
+                                                       session=session)
+            except BulkWriteError as e:
+                if e.details.get('writeConcernErrors'):
+                    raise
+                errors.update({pending[error['index']]: error['errmsg'] for error in e.details['writeErrors']})
+                if session is not None:
+                    # The failed update aborted the transaction
+                    raise
+                # The other updates were applied
+            if bump or len(errors) < len(ids):
+                self.bump_version('ratings', session=session)
+
+        while True:
+            try:
+                self.run_write_unit(write)
+                break
+            except BulkWriteError as e:
+                if e.details.get('writeConcernErrors'):
+                    raise
+                # Write the batch again, without the ratings whose update failed
+
+        written = [ObjectId(id) for id in ids if id not in errors]
+        ratings = self.ratings_collection.find({'_id': {'$in': written}}, {'average': 1})
+        averages = {str(rating['_id']): rating['average'] for rating in ratings}
+        if self.log_votes and averages:
+            now = datetime.utcnow()
+            self.votes_collection.insert_many([
+                {'ratingId': ObjectId(id), 'value': value, 'createdAt': now}
+                for id, values in votes.items() if id in averages for value in values.elements()])
+        return averages, errors
+
     def delete_rating(self, id):
-        logger.debug(f"Deleting rating with ID: {id}")
+        log_sampled(logger, "Deleting rating with ID: %s", id)
         result = self.ratings_collection.delete_one({'_id': ObjectId(id)})
-        logger.debug(f"Deleted rating count: {result.deleted_count}")
+        if self.log_votes:
+            self.votes_collection.delete_many({'ratingId': ObjectId(id)})
+        log_sampled(logger, "Deleted rating count: %s", result.deleted_count)
+        if result.deleted_count:
+            self.bump_version('ratings')
         return result.deleted_count
+
+    # Books Mutations with their Outbox Events
+    def insert_book_with_rating(self, book, rating):
+        # Insert a book and its rating, whose ID is the book's, and bump both versions - in a single transaction.
+        # Returns the book's ID
+        book_dict = with_derived_fields(book.to_dict())
+
+        def insert(session):
+            book_id = self.books_collection.insert_one(dict(book_dict), session=session).inserted_id
+            self.ratings_collection.insert_one(dict(rating.to_dict(), _id=book_id), session=session)
+            self.bump_version('books', 'ratings', session=session)
+            return book_id
+
+        log_sampled(logger, "Inserting book and rating into MongoDB: %s", summarize(book_dict))
+        book_id = self.run_write_unit(insert)
+        log_sampled(logger, "Inserted book and rating with ID: %s", book_id)
+        return book_id
+
+    def update_book_with_rating(self, id, updated_data):
+        # Update a book and the title of its rating, append a 'book.updated' event and bump both versions - in a
+        # single transaction
+        def update(session):
+            result = self.books_collection.update_one({'_id': ObjectId(id)},
+                                                      {'$set': with_derived_fields(updated_data)}, session=session)
+            if result.modified_count:
+                if 'title' in updated_data:
+                    self.ratings_collection.update_one({'_id': ObjectId(id)},
+                                                       {'$set': {'title': updated_data['title']}}, session=session)
+                event_data = {key: updated_data[key] for key in ('title', 'ISBN') if key in updated_data}
+                self.append_event('book.updated', id, event_data, session)
+                self.bump_version('books', 'ratings', session=session)
+            return result.modified_count
+
+        log_sampled(logger, "Updating book with ID: %s with data: %s", id, summarize(updated_data))
+        return self.run_write_unit(update)
+
+    def delete_book_with_rating(self, id):
+        # Delete a book and its rating, append a 'book.deleted' event and bump both versions - in a single
+        # transaction
+        def delete(session):
+            result = self.books_collection.delete_one({'_id': ObjectId(id)}, session=session)
+            if result.deleted_count:
+                self.ratings_collection.delete_one({'_id': ObjectId(id)}, session=session)
+                self.append_event('book.deleted', id, {}, session)
+                self.bump_version('books', 'ratings', session=session)
+            return result.deleted_count
+
+        log_sampled(logger, "Deleting book and rating with ID: %s", id)
+        deleted_count = self.run_write_unit(delete)
+        if deleted_count and self.log_votes:
+            self.votes_collection.delete_many({'ratingId': ObjectId(id)})
+        return deleted_count
+
+    def run_write_unit(self, write):
+        # Run write(session) in a transaction, retried on transient errors. Without transactions (a standalone
+        # MongoDB) the writes are applied one by one, the events after their mutations
+        if self.transactions is None:
+            self.transactions = self.supports_transactions()
+        if not self.transactions:
+            return write(None)
+        with self.client.start_session() as session:
+            return session.with_transaction(write)
+
+    def supports_transactions(self):
+        # Multi-document transactions need a replica set or a sharded cluster
+        try:
+            hello = self.client.admin.command('hello')
+            transactions = 'setName' in hello or hello.get('msg') == 'isdbgrid'
+        except Exception as e:
+            logger.warning("Error checking MongoDB transactions support: %s", e)
+            transactions = False
+        if not transactions:
+            logger.warning("MongoDB doesn't support transactions - outbox events are written after their mutations")
+        return transactions
+
+    # Outbox Collection Operations
+    def append_event(self, event_type, book_id, data, session=None):
+        # Events are numbered in the order of their transactions - which all update the same sequence counter
+        counter = self.counters_collection.find_one_and_update(
+            {'_id': 'outbox'}, {'$inc': {'seq': 1}}, upsert=True, return_document=ReturnDocument.AFTER,
+            session=session)
+        event = {'seq': counter['seq'], 'type': event_type, 'bookId': str(book_id), 'data': data,
+                 'status': 'pending', 'createdAt': datetime.utcnow()}
+        self.outbox_collection.insert_one(event, session=session)
+
+    def get_pending_events(self, limit):
+        return list(self.outbox_collection.find({'status': 'pending'}).sort('seq', 1).limit(limit))
+
+    def mark_events_delivered(self, event_ids, retention_seconds):
+        now = datetime.utcnow()
+        self.outbox_collection.update_many(
+            {'_id': {'$in': event_ids}},
+            {'$set': {'status': 'delivered', 'deliveredAt': now,
+                      'expiresAt': now + timedelta(seconds=retention_seconds)}})
+
+    def get_outbox_backlog(self):
+        # Number of pending events, and the creation time of the oldest one
+        pending = self.outbox_collection.count_documents({'status': 'pending'})
+        oldest = self.outbox_collection.find_one({'status': 'pending'}, {'createdAt': 1}, sort=[('seq', 1)])
+        return pending, oldest['createdAt'] if oldest else None
+
+    def acquire_lock(self, name, owner, lease_seconds):
+        # Take or renew a lease on a named lock, unless another owner holds it - the upsert of a held lock collides
+        # with it
+        now = datetime.utcnow()
+        try:
+            self.locks_collection.update_one(
+                {'_id': name, '$or': [{'owner': owner}, {'lockedUntil': {'$lt': now}}]},
+                {'$set': {'owner': owner, 'lockedUntil': now + timedelta(seconds=lease_seconds)}}, upsert=True)
+            return True
+        except DuplicateKeyError:
+            return False
+
+    # Statistics
+    def count_books_by(self, field):
+        # The number of books of every value of the field, most frequent first
+        return list(self.books_collection.aggregate([
+            {'$group': {'_id': f'${field}', 'books': {'$sum': 1}}},
+            {'$sort': {'books': -1, '_id': 1}},
+            {'$project': {'_id': 0, field: '$_id', 'books': 1}},
+        ]))
+
+    def get_ratings_by_genre(self):
+        # The number of books, rated books and votes, and the average vote, of every genre. The books and ratings
+        # are in different databases, which $lookup can't join - their cursors are merged by the shared _id, in order
+        books = self.books_collection.find({}, {'genre': 1}).sort('_id', 1)
+        ratings = self.ratings_collection.find({'count': {'$gt': 0}}, {'count': 1, 'sum': 1}).sort('_id', 1)
+        genres = {}
+        rating = next(ratings, None)
+        for book in books:
+            while rating and rating['_id'] < book['_id']:
+                rating = next(ratings, None)
+            totals = genres.setdefault(book.get('genre'), {'books': 0, 'ratedBooks': 0, 'votes': 0, 'sum': 0})
+            totals['books'] += 1
+            if rating and rating['_id'] == book['_id']:
+                totals['ratedBooks'] += 1
+                totals['votes'] += rating['count']
+                totals['sum'] += rating['sum']
+
+        return [{'genre': genre, 'books': totals['books'], 'ratedBooks': totals['ratedBooks'], 'votes': totals['votes'],
+                 'average': round(totals['sum'] / totals['votes'], 2) if totals['votes'] else None}
+                for genre, totals in sorted(genres.items(), key=lambda item: (-item[1]['books'], str(item[0])))]
+
+    # Collection Versions Operations
+    def bump_version(self, *names, session=None):
+        # Count the writes of the collections, with a single update once their version documents exist - in the
+        # session's transaction, with the writes, if given. The epoch tells apart the counters of a recreated
+        # versions collection
+        result = self.versions_collection.update_many(
+            {'_id': {'$in': list(names)}}, {'$inc': {'version': 1}, '$currentDate': {'updatedAt': True}},
+            session=session)
+        if result.matched_count == len(names):
+            return
+        # The first writes of some of the collections - the others were counted already
+        for name in names:
+            self.versions_collection.update_one(
+                {'_id': name}, {'$setOnInsert': {'version': 1, 'updatedAt': datetime.utcnow(),
+                                                 'epoch': str(ObjectId())}}, upsert=True, session=session)
+
+    def get_versions(self, names):
+        # The version documents of the given collections, by name - missing for never written collections
+        versions = self.versions_collection.find({'_id': {'$in': list(names)}})
+        return {version['_id']: version for version in versions}
+
+    # Export and Import
+    def finish_import(self, names):
+        # The imported collections were written around the books and ratings operations - invalidate their caches
+        names = [name for name in names if name in ('books', 'ratings')]
+        if names:
+            self.bump_version(*names)
+
+    # Enrichment Jobs Collection Operations
+    def insert_enrichment_job(self, book_id, isbn):
+        now = datetime.utcnow()
+        job = {'bookId': book_id, 'ISBN': isbn, 'status': 'queued', 'attempts': 0, 'error': None,
+               'nextAttemptAt': now, 'createdAt': now, 'updatedAt': now}
+        log_sampled(logger, "Inserting enrichment job for book with ID: %s", book_id)
+        result = self.enrichment_jobs_collection.insert_one(job)
+        return result.inserted_id
+
+    def claim_enrichment_job(self, lease_seconds):
+        # Atomically take the next due job - a queued one, or a running one whose worker's lease expired
+        now = datetime.utcnow()
+        return self.enrichment_jobs_collection.find_one_and_update(
+            {'$or': [{'status': 'queued', 'nextAttemptAt': {'$lte': now}},
+                     {'status': 'running', 'lockedUntil': {'$lt': now}}]},
+            {'$set': {'status': 'running', 'lockedUntil': now + timedelta(seconds=lease_seconds), 'updatedAt': now},
+             '$inc': {'attempts': 1}},
+            sort=[('nextAttemptAt', 1)], return_document=ReturnDocument.AFTER)
+
+    def finish_enrichment_job(self, job_id, status, error=None):
+        log_sampled(logger, "Finishing enrichment job with ID: %s as %s", job_id, status)
+        self.enrichment_jobs_collection.update_one(
+            {'_id': job_id}, {'$set': {'status': status, 'error': error, 'updatedAt': datetime.utcnow()},
+                              '$unset': {'lockedUntil': ''}})
+
+    def retry_enrichment_job(self, job_id, delay_seconds, error):
+        log_sampled(logger, "Retrying enrichment job with ID: %s in %s seconds", job_id, delay_seconds)
+        now = datetime.utcnow()
+        self.enrichment_jobs_collection.update_one(
+            {'_id': job_id}, {'$set': {'status': 'queued', 'error': error, 'updatedAt': now,
+                                       'nextAttemptAt': now + timedelta(seconds=delay_seconds)},
+                              '$unset': {'lockedUntil': ''}})
+
+    def get_enrichment_job(self, book_id):
+        log_sampled(logger, "Fetching enrichment job of book with ID: %s", book_id)
+        return self.enrichment_jobs_collection.find_one({'bookId': ObjectId(book_id)}, sort=[('_id', -1)])
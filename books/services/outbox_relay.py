@@ -0,0 +1,115 @@
+import os
+import time
+import socket
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Maximal number of events delivered by a single call to the loans service
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 100))
+# How often an idle relay checks for events appended by other processes, and waits after a failed delivery
+OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', 2))
+OUTBOX_RETRY_SECONDS = float(os.getenv('OUTBOX_RETRY_SECONDS', 5))
+# A single relay delivers at a time, holding a lease it renews on every batch - longer than a delivery's timeout
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', 30))
+# Seconds delivered events are kept before they expire
+OUTBOX_RETENTION_SECONDS = int(os.getenv('OUTBOX_RETENTION_SECONDS', 7 * 24 * 3600))
+# Seconds the delivery throughput is computed over
+THROUGHPUT_WINDOW_SECONDS = 60
+
+
+class OutboxRelay:
+    # Background thread delivering the outbox events, in batches and in order, to deliver(events) - which raises
+    # if the batch wasn't applied. Every worker process runs a relay, and the one holding the lease delivers.
+    # Events are delivered at least once, the consumer applies them idempotently
+    def __init__(self, mongodb_service, deliver):
+        self.mongodb_service = mongodb_service
+        self.deliver = deliver
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+        self.lock = threading.Lock()
+        self.deliveries = deque()
+        self.counters = {'delivered': 0, 'batches': 0, 'failures': 0}
+        self.last_delivered_seq = None
+        self.last_delivery_ms = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='outbox-relay', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def notify(self):
+        # Wake up the relay - an event was just appended
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                delivered = self.relay_batch()
+            except Exception as e:
+                logger.warning("Error relaying outbox events: %s", e)
+                with self.lock:
+                    self.counters['failures'] += 1
+                self.stopped.wait(OUTBOX_RETRY_SECONDS)
+                continue
+
+            if not delivered:
+                self.wakeup.wait(OUTBOX_POLL_SECONDS)
+                self.wakeup.clear()
+
+    def relay_batch(self):
+        # Deliver the next batch of pending events, returns their number
+        if not self.mongodb_service.acquire_lock('outbox_relay', self.owner, OUTBOX_LEASE_SECONDS):
+            return 0
+        events = self.mongodb_service.get_pending_events(OUTBOX_BATCH_SIZE)
+        if not events:
+            return 0
+
+        start = time.perf_counter()
+        self.deliver([{
+            'seq': event['seq'],
+            'type': event['type'],
+            'bookId': event['bookId'],
+            'data': event['data'],
+            'createdAt': event['createdAt'].isoformat(),
+        } for event in events])
+        duration = time.perf_counter() - start
+        self.mongodb_service.mark_events_delivered([event['_id'] for event in events], OUTBOX_RETENTION_SECONDS)
+
+        with self.lock:
+            now = time.time()
+            self.deliveries.append((now, len(events)))
+            while self.deliveries[0][0] < now - THROUGHPUT_WINDOW_SECONDS:
+                self.deliveries.popleft()
+            self.counters['delivered'] += len(events)
+            self.counters['batches'] += 1
+            self.last_delivered_seq = events[-1]['seq']
+            self.last_delivery_ms = round(duration * 1000, 2)
+        return len(events)
+
+    def stats(self):
+        # Delivery counters of this process's relay, and the backlog of all of them - the consumer lag
+        pending, oldest_created_at = self.mongodb_service.get_outbox_backlog()
+        with self.lock:
+            now = time.time()
+            recent = sum(count for delivered_at, count in self.deliveries
+                         if delivered_at >= now - THROUGHPUT_WINDOW_SECONDS)
+            stats = dict(self.counters, last_delivered_seq=self.last_delivered_seq,
+                         last_delivery_ms=self.last_delivery_ms)
+
+        stats['events_per_second'] = round(recent / THROUGHPUT_WINDOW_SECONDS, 2)
+        stats['pending'] = pending
+        stats['lag_seconds'] = (round((datetime.utcnow() - oldest_created_at).total_seconds(), 3)
+                                if oldest_created_at else 0)
+        return stats
@@ -0,0 +1,129 @@
+import sys
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, UpdateOne
+from common.schema_manager import SchemaManager, run_command
+from models.book import published_date_fields
+from models.rating import RATING_VALUES, TOP_RATED_MIN_VALUES
+
+# Indexes every collection is expected to have, keyed by the MongoDBService collection attribute
+INDEXES = {
+    'books_collection': [
+        # Looked up on every POST /books and by the loans service
+        IndexModel([('ISBN', ASCENDING)], name='isbn_unique', unique=True),
+        # GET /books query filters and sorts - pages are ordered by _id after the filtered or sorted field
+        IndexModel([('title', ASCENDING), ('_id', ASCENDING)], name='title_id'),
+        IndexModel([('authors', ASCENDING), ('_id', ASCENDING)], name='authors_id'),
+        IndexModel([('genre', ASCENDING), ('_id', ASCENDING)], name='genre_id'),
+        IndexModel([('publisher', ASCENDING), ('_id', ASCENDING)], name='publisher_id'),
+        IndexModel([('publishedDate', ASCENDING), ('_id', ASCENDING)], name='published_date_id'),
+        IndexModel([('publishedYear', ASCENDING), ('_id', ASCENDING)], name='published_year_id'),
+        IndexModel([('publishedDateSort', ASCENDING), ('_id', ASCENDING)], name='published_date_sort_id'),
+        # GET /books/search - a single text index per collection, titles ranking above authors and publishers
+        IndexModel([('title', TEXT), ('authors', TEXT), ('publisher', TEXT)], name='title_authors_publisher_text',
+                   weights={'title': 10, 'authors': 5, 'publisher': 1}),
+    ],
+    'ratings_collection': [
+        # GET /top - only ratings with enough values, best averages first
+        IndexModel([('average', DESCENDING), ('_id', ASCENDING)], name='top_rated',
+                   partialFilterExpression={'count': {'$gte': TOP_RATED_MIN_VALUES}}),
+    ],
+    'votes_collection': [
+        # Raw rating values log, kept when RATINGS_VOTE_LOG is enabled
+        IndexModel([('ratingId', ASCENDING)], name='rating_id'),
+    ],
+    'google_books_cache_collection': [
+        # Each cached lookup expires at its own 'expiresAt'
+        IndexModel([('expiresAt', ASCENDING)], name='expires_at_ttl', expireAfterSeconds=0),
+    ],
+    'enrichment_jobs_collection': [
+        # Claiming the next due job, and the job status of a book
+        IndexModel([('status', ASCENDING), ('nextAttemptAt', ASCENDING)], name='status_next_attempt'),
+        IndexModel([('bookId', ASCENDING)], name='book_id'),
+    ],
+    'outbox_collection': [
+        # The relay reads the pending events in order, the delivered events expire at their 'expiresAt'
+        IndexModel([('status', ASCENDING), ('seq', ASCENDING)], name='status_seq'),
+        IndexModel([('expiresAt', ASCENDING)], name='expires_at_ttl', expireAfterSeconds=0),
+    ],
+}
+
+
+def backfill_rating_counts(mongodb_service):
+    # The number of values of every rating, used by the 'top_rated' index
+    mongodb_service.ratings_collection.update_many(
+        {'count': {'$exists': False}}, [{'$set': {'count': {'$size': '$values'}}}])
+
+
+def aggregate_rating_values(mongodb_service):
+    # Replace the values array of every rating with its count, sum and histogram of values
+    histogram = {str(value): {'$size': {'$filter': {'input': '$values', 'cond': {'$eq': ['$$this', value]}}}}
+                 for value in RATING_VALUES}
+    mongodb_service.ratings_collection.update_many({'values': {'$exists': True}}, [
+        {'$set': {'count': {'$size': '$values'}, 'sum': {'$sum': '$values'}, 'histogram': histogram}},
+        {'$unset': 'values'},
+    ])
+
+
+def drop_book_field_indexes(mongodb_service):
+    # The single field indexes of the GET /books filters are replaced by (field, _id) ones, which also order the pages
+    existing = mongodb_service.books_collection.index_information()
+    for name in ('title', 'authors', 'genre', 'publisher', 'published_date'):
+        if name in existing:
+            mongodb_service.books_collection.drop_index(name)
+
+
+def backfill_published_date_fields(mongodb_service):
+    # The publishedYear and publishedDateSort of every book, derived from its publishedDate as on every write
+    update_published_date_fields(mongodb_service, {'publishedDateSort': {'$exists': False}})
+
+
+def recompute_published_date_fields(mongodb_service):
+    # The derived fields of the books whose publishedDate was only matched by its start, or had an out of range
+    # month or day, e.g. '2015-13' - which no longer have any
+    update_published_date_fields(mongodb_service, {'publishedDateSort': {'$ne': None}})
+
+
+def update_published_date_fields(mongodb_service, query):
+    # Derive the fields of the matching books again, writing those which changed
+    books = mongodb_service.books_collection.find(query, {'publishedDate': 1, 'publishedYear': 1,
+                                                          'publishedDateSort': 1})
+    updates = []
+    for book in books:
+        fields = published_date_fields(book.get('publishedDate'))
+        if all(book.get(name, ...) == value for name, value in fields.items()):
+            continue
+        updates.append(UpdateOne({'_id': book['_id']}, {'$set': fields}))
+        if len(updates) == BACKFILL_BATCH_SIZE:
+            mongodb_service.books_collection.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        mongodb_service.books_collection.bulk_write(updates, ordered=False)
+
+
+# Versioned data migrations, applied once each and in order - (version, description, function(mongodb_service))
+MIGRATIONS = [
+    (1, 'Backfill ratings count', backfill_rating_counts),
+    (2, 'Aggregate ratings values into count, sum and histogram', aggregate_rating_values),
+    (3, 'Drop the single field indexes of the books filters', drop_book_field_indexes),
+    (4, 'Backfill books publishedYear and publishedDateSort', backfill_published_date_fields),
+    (5, 'Recompute books publishedYear and publishedDateSort of invalid dates', recompute_published_date_fields),
+]
+
+# Number of documents updated by a single bulk write of a backfill
+BACKFILL_BATCH_SIZE = 1000
+
+
+def schema_manager(mongodb_service):
+    # The schema of the books database - see common.schema_manager
+    return SchemaManager(mongodb_service, mongodb_service.books_db, INDEXES, MIGRATIONS)
+
+
+def check_schema(mongodb_service):
+    return schema_manager(mongodb_service).check()
+
+
+# Run with 'python -m services.schema_manager [report|migrate]' from the service directory - the containers
+# migrate before starting the workers
+if __name__ == '__main__':
+    from services.mongodb_service import MongoDBService
+
+    run_command(schema_manager(MongoDBService()), sys.argv[1:])
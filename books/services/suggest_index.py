@@ -0,0 +1,146 @@
+import os
+import bisect
+import logging
+import threading
+import unicodedata
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Largest number of suggestions returned by a single lookup
+SUGGEST_MAX_LIMIT = int(os.getenv('SUGGEST_MAX_LIMIT', 50))
+# Without change streams (a standalone server), how often the books version is checked for writes
+SUGGEST_POLL_SECONDS = float(os.getenv('SUGGEST_POLL_SECONDS', 5))
+SUGGEST_RETRY_SECONDS = float(os.getenv('SUGGEST_RETRY_SECONDS', 5))
+
+# Changes to the books which affect their titles - the others end the stream, and the index is reloaded
+TITLE_CHANGES = [
+    {'$match': {'$or': [
+        {'operationType': {'$in': ['insert', 'replace', 'delete']}},
+        {'operationType': 'update', 'updateDescription.updatedFields.title': {'$exists': True}},
+        {'operationType': {'$in': ['drop', 'rename', 'dropDatabase', 'invalidate']}},
+    ]}},
+    {'$project': {'operationType': 1, 'documentKey': 1, 'fullDocument.title': 1}},
+]
+
+
+def normalize(text):
+    # Case and accent insensitive form of a title or a prefix, with single spaces between the words
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ' '.join(''.join(char for char in decomposed if not unicodedata.combining(char)).split())
+
+
+class SuggestIndex:
+    # In-memory sorted index of the books' normalized titles, answering title prefix lookups with a binary search -
+    # in time independent of the catalog size. A background thread loads it and then follows the writes of every
+    # process through a change stream, or polls the books version and reloads it without change streams
+    def __init__(self, mongodb_service):
+        self.mongodb_service = mongodb_service
+        self.stopped = threading.Event()
+        self.thread = None
+
+        self.lock = threading.Lock()
+        # Sorted 'normalized title\0id' keys, and the key and title of every book by ID
+        self.keys = []
+        self.books = {}
+        self.loaded = False
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='suggest-index', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def suggest(self, prefix, limit):
+        # The books whose title starts with the prefix, by title - None until the index is loaded
+        prefix = normalize(prefix)
+        with self.lock:
+            if not self.loaded:
+                return None
+            suggestions = []
+            index = bisect.bisect_left(self.keys, prefix)
+            while index < len(self.keys) and len(suggestions) < limit and self.keys[index].startswith(prefix):
+                book_id = self.keys[index].rsplit('\0', 1)[1]
+                suggestions.append({'id': book_id, 'title': self.books[book_id][1]})
+                index += 1
+        return suggestions
+
+    def set_title(self, book_id, title):
+        with self.lock:
+            self.remove_locked(book_id)
+            if not isinstance(title, str):
+                return
+            key = f'{normalize(title)}\0{book_id}'
+            bisect.insort(self.keys, key)
+            self.books[book_id] = (key, title)
+
+    def remove(self, book_id):
+        with self.lock:
+            self.remove_locked(book_id)
+
+    def remove_locked(self, book_id):
+        entry = self.books.pop(book_id, None)
+        if entry:
+            index = bisect.bisect_left(self.keys, entry[0])
+            if index < len(self.keys) and self.keys[index] == entry[0]:
+                del self.keys[index]
+
+    def load(self):
+        # Build the whole index aside, and swap it in
+        books = {}
+        for book in self.mongodb_service.books_collection.find({}, {'title': 1}):
+            if isinstance(book.get('title'), str):
+                book_id = str(book['_id'])
+                books[book_id] = (f"{normalize(book['title'])}\0{book_id}", book['title'])
+        keys = sorted(key for key, title in books.values())
+        with self.lock:
+            self.keys = keys
+            self.books = books
+            self.loaded = True
+        logger.info("Loaded the suggestions index of %s books", len(books))
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.follow_changes()
+            except (OperationFailure, NotImplementedError) as e:
+                logger.info("Polling for book writes, as change streams aren't available: %s", e)
+                self.poll_versions()
+            except Exception as e:
+                logger.warning("Error updating the suggestions index: %s", e)
+                self.stopped.wait(SUGGEST_RETRY_SECONDS)
+
+    def follow_changes(self):
+        # Open the change stream before loading, so no write is missed - changes already loaded apply twice, harmlessly
+        with self.mongodb_service.books_collection.watch(TITLE_CHANGES, full_document='updateLookup',
+                                                         max_await_time_ms=1000) as stream:
+            self.load()
+            while not self.stopped.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    continue
+                book_id = str(change['documentKey']['_id']) if 'documentKey' in change else None
+                if change['operationType'] == 'delete':
+                    self.remove(book_id)
+                elif change['operationType'] in ('insert', 'replace', 'update'):
+                    # The looked up document is missing if the book was deleted since
+                    full_document = change.get('fullDocument')
+                    if full_document:
+                        self.set_title(book_id, full_document.get('title'))
+                    else:
+                        self.remove(book_id)
+                else:
+                    return
+
+    def poll_versions(self):
+        version = None
+        while not self.stopped.is_set():
+            latest = self.mongodb_service.get_versions(['books']).get('books')
+            current = latest and (latest['epoch'], latest['version'])
+            if current != version or not self.loaded:
+                self.load()
+                version = current
+            self.stopped.wait(SUGGEST_POLL_SECONDS)
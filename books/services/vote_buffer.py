@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+import threading
+from collections import Counter
+from common.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Milliseconds between the flushes of the buffered votes, and the number of buffered votes flushed right away
+VOTE_FLUSH_MS = float(os.getenv('VOTE_FLUSH_MS', 50))
+VOTE_FLUSH_MAX = int(os.getenv('VOTE_FLUSH_MAX', 1000))
+# When a vote is acknowledged - 'flush': once it's written, with the rating's new average, or 'buffer': as soon as
+# it's buffered, losing it if the process dies or its flush fails
+VOTE_ACK = os.getenv('VOTE_ACK', 'flush')
+# Seconds a vote waits for its flush, before it's written on its own - or answered as accepted if it's being flushed
+VOTE_FLUSH_TIMEOUT = float(os.getenv('VOTE_FLUSH_TIMEOUT', 5))
+
+
+class VoteFailed(Exception):
+    pass
+
+
+class VoteBatch:
+    # The votes buffered between two flushes - the values of every rating by ID, and once flushed, the ratings' new
+    # averages and the errors of those whose update failed, or the flush's error
+    def __init__(self):
+        self.votes = {}
+        self.size = 0
+        self.averages = None
+        self.errors = {}
+        self.error = None
+        self.done = threading.Event()
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def add(self, id, value):
+        self.votes.setdefault(id, Counter())[value] += 1
+        self.size += 1
+
+    def remove(self, id, value):
+        values = self.votes[id]
+        values[value] -= 1
+        if not values[value]:
+            del values[value]
+        if not values:
+            del self.votes[id]
+        self.size -= 1
+
+    def add_done_callback(self, callback):
+        # Call callback() once the batch is flushed, from the flushing thread - or right away if it already is
+        with self.lock:
+            if not self.done.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def finish(self, averages=None, errors=None, error=None):
+        self.averages = averages
+        self.errors = errors or {}
+        self.error = error
+        with self.lock:
+            self.done.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def result(self, id):
+        # The rating's average after the flush, None if no rating was found - raises the flush's error, or VoteFailed
+        # if the rating's update failed
+        if self.error:
+            raise self.error
+        if id in self.errors:
+            raise VoteFailed(self.errors[id])
+        return self.averages.get(id)
+
+
+class VoteBuffer:
+    # Write-behind buffer of the ratings' votes. A background thread flushes them every VOTE_FLUSH_MS, or as soon as
+    # VOTE_FLUSH_MAX are buffered, coalesced into a single update per rating in a single bulk write - so the write
+    # rate follows the flushes rather than the votes. The votes written on their own, as in 'direct' write mode, are
+    # counted by the ratings version of the next flush as well, so that no vote writes the shared versions document.
+    # Stopping drains the buffer
+    def __init__(self, mongodb_service):
+        self.mongodb_service = mongodb_service
+        self.lock = threading.Lock()
+        self.full = threading.Event()
+        self.stopped = threading.Event()
+        self.batch = VoteBatch()
+        self.written = False
+        self.thread = None
+        registry.gauge('rating_votes_buffered', "Votes waiting for their flush", (), self.buffered_votes)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='vote-buffer', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        with self.lock:
+            self.stopped.set()
+        self.full.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def buffered_votes(self):
+        with self.lock:
+            return {(): self.batch.size}
+
+    def add(self, id, value):
+        # Buffer a vote, returns its batch - see VoteBatch.result
+        with self.lock:
+            if self.stopped.is_set():
+                raise RuntimeError("The votes buffer is stopped")
+            batch = self.batch
+            batch.add(id, value)
+            if batch.size >= VOTE_FLUSH_MAX:
+                self.full.set()
+        return batch
+
+    def add_written(self):
+        # Count a vote written on its own - the next flush bumps the ratings version
+        self.written = True
+
+    def withdraw(self, batch, id, value):
+        # Take a vote back out of its batch, unless the batch is already being flushed - returns whether it was
+        with self.lock:
+            if batch is not self.batch:
+                return False
+            batch.remove(id, value)
+            return True
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.full.wait(VOTE_FLUSH_MS / 1000)
+            self.full.clear()
+            self.flush()
+        # Drain the votes buffered until the stop
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            batch, self.batch = self.batch, VoteBatch()
+            written, self.written = self.written, False
+        if not batch.votes:
+            batch.finish({})
+            if written:
+                self.bump_written()
+            return
+
+        start = time.perf_counter()
+        try:
+            averages, errors = self.mongodb_service.add_ratings_values(batch.votes, bump=written)
+        except Exception as e:
+            logger.warning("Error flushing %s votes of %s ratings: %s", batch.size, len(batch.votes), e)
+            batch.finish(error=e)
+            if written:
+                self.bump_written()
+            return
+        if errors:
+            logger.warning("Error flushing the votes of %s out of %s ratings: %s", len(errors), len(batch.votes),
+                           next(iter(errors.values())))
+        logger.debug("Flushed %s votes of %s ratings in %.3f seconds", batch.size, len(batch.votes),
+                     time.perf_counter() - start)
+        batch.finish(averages, errors)
+
+    def bump_written(self):
+        # The ratings version of the votes written on their own - counted again by the next flush if it fails
+        try:
+            self.mongodb_service.bump_version('ratings')
+        except Exception as e:
+            logger.warning("Error bumping the ratings version of the votes written directly: %s", e)
+            self.written = True
@@ -0,0 +1,115 @@
+import os
+import sys
+import asyncio
+import mongomock
+import mongomock.aggregate
+import motor.motor_asyncio
+import mongomock_motor
+import pymongo
+import pytest
+from flask import Response
+
+# The service's modules import from its directory and the shared ones from the repository root. MongoDB is replaced
+# by mongomock - both drivers' clients sharing a single in-memory server, patched before the services import them
+service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [service_dir, os.path.dirname(service_dir)]
+store = mongomock.store.ServerStore()
+pymongo.MongoClient = lambda *args, **kwargs: mongomock.MongoClient(*args, _store=store, **kwargs)
+motor.motor_asyncio.AsyncIOMotorClient = lambda *args, **kwargs: mongomock_motor.AsyncMongoMockClient(
+    mock_mongo_client=mongomock.MongoClient(*args, _store=store, **kwargs))
+
+
+handle_arithmetic_operator = mongomock.aggregate._Parser._handle_arithmetic_operator
+
+
+def handle_round_operator(parser, operator, values):
+    # mongomock has no $round
+    if operator == '$round':
+        return round(parser.parse(values[0]), values[1])
+    return handle_arithmetic_operator(parser, operator, values)
+
+
+mongomock.aggregate._Parser._handle_arithmetic_operator = handle_round_operator
+mongomock.aggregate.arithmetic_operators.add('$round')
+
+import controllers  # noqa: E402
+from app import app as flask_app  # noqa: E402
+from asgi_app import app as quart_app  # noqa: E402
+from services import async_google_books_service, google_books_service  # noqa: E402
+from services.schema_manager import schema_manager  # noqa: E402
+
+# The Google Books volumes by ISBN - any other ISBN has none
+GOOGLE_BOOKS = {}
+
+
+class QuartClient:
+    # The test client of the Quart app with the blocking interface of Flask's, serving on an event loop of its own -
+    # which runs the app's background tasks during the requests
+    def __init__(self, app):
+        self.loop = asyncio.new_event_loop()
+        self.test_app = app.test_app()
+        self.loop.run_until_complete(self.test_app.__aenter__())
+        self.client = self.test_app.test_client()
+
+    def open(self, path, method='GET', **kwargs):
+        async def request():
+            response = await self.client.open(path, method=method, **kwargs)
+            return Response(await response.get_data(), response.status_code, response.headers)
+        return self.loop.run_until_complete(request())
+
+    def get(self, path, **kwargs):
+        return self.open(path, 'GET', **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, 'POST', **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.open(path, 'PUT', **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open(path, 'DELETE', **kwargs)
+
+    def close(self):
+        self.loop.run_until_complete(self.test_app.__aexit__(None, None, None))
+        self.loop.close()
+
+
+@pytest.fixture(autouse=True)
+def google_books(monkeypatch):
+    def fetch(isbn):
+        return GOOGLE_BOOKS.get(isbn, 0)
+
+    async def fetch_async(isbn):
+        return fetch(isbn)
+
+    monkeypatch.setattr(google_books_service, 'fetch_book_authors_publisher_published_date', fetch)
+    monkeypatch.setattr(async_google_books_service, 'fetch_book_authors_publisher_published_date', fetch_async)
+    GOOGLE_BOOKS.clear()
+    return GOOGLE_BOOKS
+
+
+@pytest.fixture(scope='session', autouse=True)
+def schema():
+    # Applied once, as by the migrate command before the workers start
+    schema_manager(controllers.mongodb_service.instance()).run()
+
+
+@pytest.fixture(autouse=True)
+def empty_databases():
+    # The documents of the previous test are deleted, keeping the indexes
+    client = mongomock.MongoClient(_store=store)
+    for db_name in client.list_database_names():
+        for collection_name in client[db_name].list_collection_names():
+            client[db_name][collection_name].delete_many({})
+
+
+@pytest.fixture(params=['flask', 'quart'])
+def client(request):
+    # Every test using the client runs against the Flask app and the Quart one
+    if request.param == 'flask':
+        controllers.mongodb_service.instance()
+        yield flask_app.test_client()
+        return
+    client = QuartClient(quart_app)
+    yield client
+    client.close()
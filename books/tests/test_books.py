@@ -0,0 +1,235 @@
+import json
+import pytest
+from bson import ObjectId
+import controllers
+from services.schema_manager import recompute_published_date_fields
+
+
+def add_book(client, google_books, title, isbn, genre='Fiction', authors=('Ann Author',), published_date='2010-01-01'):
+    google_books[isbn] = {'authors': list(authors), 'publisher': 'Publisher', 'publishedDate': published_date}
+    response = client.post('/books', json={'title': title, 'ISBN': isbn, 'genre': genre})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['bookID']
+
+
+@pytest.fixture
+def catalog(client, google_books):
+    # Five books, by title: (ID, genre, published date)
+    books = {
+        'Dune': ('9780000000001', 'Science Fiction', '1965-08-01'),
+        'Emma': ('9780000000002', 'Fiction', '1815-12-23'),
+        'Hobbit': ('9780000000003', 'Fantasy', '1937-09-21'),
+        'Matilda': ('9780000000004', 'Children', '1988'),
+        'Neuromancer': ('9780000000005', 'Science Fiction', '1984-07'),
+    }
+    return {title: (add_book(client, google_books, title, isbn, genre, published_date=published_date), genre,
+                    published_date)
+            for title, (isbn, genre, published_date) in books.items()}
+
+
+def titles(response):
+    assert response.status_code == 200, response.get_json()
+    return [book['title'] for book in response.get_json()]
+
+
+def test_add_book_loads_google_books_fields(client, google_books):
+    id = add_book(client, google_books, 'Dune', '9780000000001', authors=('Frank Herbert',),
+                  published_date='1965-08-01')
+
+    response = client.get(f'/books/{id}')
+    assert response.status_code == 200
+    assert response.get_json() == {'id': id, 'title': 'Dune', 'ISBN': '9780000000001', 'genre': 'Fiction',
+                                   'authors': 'Frank Herbert', 'publisher': 'Publisher',
+                                   'publishedDate': '1965-08-01'}
+
+
+def test_filters(client, catalog):
+    assert sorted(titles(client.get('/books?genre=Science Fiction'))) == ['Dune', 'Neuromancer']
+    assert titles(client.get('/books?title=Emma')) == ['Emma']
+    assert titles(client.get('/books?isbn=9780000000003')) == ['Hobbit']
+    assert titles(client.get('/books?genre=Fantasy&title=Emma')) == []
+    assert sorted(titles(client.get('/books?publishedDate[gte]=1960&publishedDate[lt]=1985-01-01'))) == [
+        'Dune', 'Neuromancer']
+
+
+def test_year_filters_skip_invalid_dates(client, google_books, monkeypatch):
+    id = add_book(client, google_books, 'Dune', '9780000000013', published_date='2014-13')
+    # A book stored before migration 5, with the derived fields of its date's year
+    books_collection = controllers.mongodb_service.instance().books_collection
+    books_collection.update_one({'_id': ObjectId(id)}, {'$set': {'publishedYear': 2014,
+                                                                 'publishedDateSort': '2014-13-00'}})
+    monkeypatch.setattr(books_collection, 'bulk_write', lambda operations, ordered: [
+        books_collection.update_one(operation._filter, operation._doc) for operation in operations])
+    recompute_published_date_fields(controllers.mongodb_service.instance())
+
+    # The invalid date is kept, but has no year
+    assert client.get(f'/books/{id}').get_json()['publishedDate'] == '2014-13'
+    assert titles(client.get('/books?publishedDate=2014')) == []
+    assert titles(client.get('/books?publishedDate[gte]=2014')) == []
+    assert titles(client.get('/books?publishedDate[lt]=2015')) == []
+
+
+def test_fields(client, catalog):
+    response = client.get('/books?title=Emma&fields=title,genre')
+    assert response.get_json() == [{'id': catalog['Emma'][0], 'title': 'Emma', 'genre': 'Fiction'}]
+
+
+def test_pagination(client, catalog):
+    pages = []
+    after = None
+    while True:
+        response = client.get('/books?limit=2' + (f'&after={after}' if after else ''))
+        pages.append(titles(response))
+        after = response.headers.get('X-Next-After')
+        if not after:
+            break
+
+    # The pages, of the books in _id order, are full but for the last one
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [title for page in pages for title in page] == list(catalog)
+
+
+@pytest.mark.parametrize('sort, expected', [
+    ('title', ['Dune', 'Emma', 'Hobbit', 'Matilda', 'Neuromancer']),
+    ('-title', ['Neuromancer', 'Matilda', 'Hobbit', 'Emma', 'Dune']),
+    ('publishedDate', ['Emma', 'Hobbit', 'Dune', 'Neuromancer', 'Matilda']),
+    ('-publishedDate', ['Matilda', 'Neuromancer', 'Dune', 'Hobbit', 'Emma']),
+])
+def test_sort_pages(client, catalog, sort, expected):
+    assert titles(client.get(f'/books?sort={sort}')) == expected
+
+    first_page = client.get(f'/books?sort={sort}&limit=3')
+    after = first_page.headers['X-Next-After']
+    second_page = client.get(f'/books?sort={sort}&limit=3&after={after}')
+    assert titles(first_page) + titles(second_page) == expected
+
+
+@pytest.mark.parametrize('stream', ['', '&stream=json', '&stream=ndjson'])
+def test_sort_after_unknown_book(client, catalog, stream):
+    response = client.get(f'/books?sort=title&after={ObjectId()}{stream}')
+    assert response.status_code == 422
+    assert 'after' in response.get_json()['error']
+
+
+def test_stream_json(client, catalog):
+    response = client.get('/books?stream=json&sort=title&fields=title')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert [book['title'] for book in json.loads(response.get_data())] == sorted(catalog)
+
+
+def test_stream_ndjson(client, catalog):
+    response = client.get('/books?stream=ndjson&genre=Science Fiction')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    books = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(book['title'] for book in books) == ['Dune', 'Neuromancer']
+    assert all(book['id'] == catalog[book['title']][0] for book in books)
+
+
+@pytest.mark.parametrize('query', [
+    'color=red',
+    'genre=Poetry',
+    'isbn=123',
+    'limit=0',
+    'limit=abc',
+    'after=123',
+    'stream=xml',
+    'fields=title,color',
+    'publishedDate[gte]=1965-08',
+    'publishedDate[gte]=1965-13-01',
+    'publishedDate[lt]=2015-02-29',
+])
+def test_invalid_query(client, catalog, query):
+    response = client.get(f'/books?{query}')
+    assert response.status_code == 422
+    assert 'error' in response.get_json()
+
+
+def test_add_book_errors(client, google_books):
+    add_book(client, google_books, 'Dune', '9780000000001')
+
+    response = client.post('/books', data='title=Dune', headers={'Content-Type': 'text/plain'})
+    assert response.status_code == 415
+    response = client.post('/books', json={'title': 'Dune', 'genre': 'Fiction'})
+    assert response.status_code == 422
+    response = client.post('/books', json={'title': 'Dune', 'ISBN': '9780000000001', 'genre': 'Fiction'})
+    assert response.status_code == 422
+    # Not found by Google Books
+    response = client.post('/books', json={'title': 'Emma', 'ISBN': '9780000000999', 'genre': 'Fiction'})
+    assert response.status_code == 400
+
+
+def test_unknown_book(client):
+    assert client.get(f'/books/{ObjectId()}').status_code == 404
+    assert client.delete(f'/books/{ObjectId()}').status_code == 404
+
+
+def test_rating_values(client, catalog):
+    id = catalog['Dune'][0]
+    averages = [client.post(f'/ratings/{id}/values', json={'value': value}) for value in (5, 4, 4)]
+    assert [response.status_code for response in averages] == [201, 201, 201]
+    assert [response.get_json()['average'] for response in averages] == ['5.0', '4.5', '4.33']
+
+    rating = client.get(f'/ratings/{id}').get_json()
+    assert (rating['count'], rating['sum'], rating['average']) == (3, 13, 4.33)
+    assert rating['histogram'] == {'1': 0, '2': 0, '3': 0, '4': 2, '5': 1}
+
+
+@pytest.mark.parametrize('body, status', [
+    ({'value': 0}, 422),
+    ({'value': 6}, 422),
+    ({'value': '5'}, 422),
+    ({}, 422),
+])
+def test_invalid_rating_value(client, catalog, body, status):
+    response = client.post(f"/ratings/{catalog['Dune'][0]}/values", json=body)
+    assert response.status_code == status
+
+
+def test_rating_value_of_unknown_book(client):
+    assert client.post(f'/ratings/{ObjectId()}/values', json={'value': 5}).status_code == 404
+    # Whatever the request body, and the ID
+    assert client.post(f'/ratings/{ObjectId()}/values', json={'value': 9}).status_code == 404
+    assert client.post(f'/ratings/{ObjectId()}/values', json={}).status_code == 404
+    assert client.post(f'/ratings/{ObjectId()}/values', data='5').status_code == 404
+    assert client.post('/ratings/unknown/values', json={'value': 5}).status_code == 404
+    assert client.get(f'/ratings/{ObjectId()}').status_code == 404
+
+
+def test_top(client, catalog):
+    votes = {'Dune': (5, 5, 4), 'Emma': (3, 3, 3), 'Hobbit': (5, 5, 5), 'Matilda': (4, 4, 4), 'Neuromancer': (5, 5)}
+    for title, values in votes.items():
+        for value in values:
+            assert client.post(f'/ratings/{catalog[title][0]}/values', json={'value': value}).status_code == 201
+
+    # The books with the top 3 averages, of those with at least 3 votes
+    response = client.get('/top')
+    assert response.status_code == 200
+    assert [(book['title'], book['average']) for book in response.get_json()] == [
+        ('Hobbit', 5.0), ('Dune', 4.67), ('Matilda', 4.0)]
+
+
+def test_versions_bumped_once_per_write(client, google_books):
+    versions_collection = controllers.mongodb_service.instance().versions_collection
+
+    def versions():
+        return {version['_id']: version['version'] for version in versions_collection.find()}
+
+    id = add_book(client, google_books, 'Dune', '9780000000001')
+    assert versions() == {'books': 1, 'ratings': 1}
+
+    google_books['9780000000002'] = google_books['9780000000003'] = {
+        'authors': ['Ann Author'], 'publisher': 'Publisher', 'publishedDate': '2010'}
+    response = client.post('/books/bulk', json=[{'title': 'Emma', 'ISBN': '9780000000002', 'genre': 'Fiction'},
+                                                {'title': 'Hobbit', 'ISBN': '9780000000003', 'genre': 'Fantasy'}])
+    assert response.get_json()['created'] == 2
+    assert versions() == {'books': 2, 'ratings': 2}
+
+    book = {'title': 'Dune Messiah', 'ISBN': '9780000000001', 'genre': 'Science Fiction', 'authors': 'Ann Author',
+            'publisher': 'Publisher', 'publishedDate': '1969'}
+    assert client.put(f'/books/{id}', json=book).status_code == 200
+    assert versions() == {'books': 3, 'ratings': 3}
+
+    assert client.delete(f'/books/{id}').status_code == 200
+    assert versions() == {'books': 4, 'ratings': 4}
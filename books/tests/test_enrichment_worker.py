@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+from services.async_enrichment_worker import AsyncEnrichmentWorkers
+from services.enrichment_worker import EnrichmentWorkers
+
+
+class StubJobs:
+    # The enrichment jobs service of the workers, recording the finished jobs
+    def __init__(self):
+        self.finished = []
+
+    def finish_enrichment_job(self, id, status, error=None):
+        self.finished.append((id, status))
+
+
+class AsyncStubJobs(StubJobs):
+    async def finish_enrichment_job(self, id, status, error=None):
+        super().finish_enrichment_job(id, status, error)
+
+
+def give_up(job):
+    raise RuntimeError("Connection lost")
+
+
+async def async_give_up(job):
+    give_up(job)
+
+
+def not_found(job):
+    return {'error': "No book found with the provided ISBN"}, 400
+
+
+async def async_not_found(job):
+    return not_found(job)
+
+
+def process_sync(job):
+    jobs = StubJobs()
+    with pytest.raises(RuntimeError):
+        EnrichmentWorkers(jobs, not_found, give_up).process(job)
+    return jobs
+
+
+def process_async(job):
+    jobs = AsyncStubJobs()
+    with pytest.raises(RuntimeError):
+        asyncio.run(AsyncEnrichmentWorkers(jobs, async_not_found, async_give_up).process(job))
+    return jobs
+
+
+@pytest.mark.parametrize('process', [process_sync, process_async], ids=['sync', 'async'])
+def test_failed_job_is_given_up_before_it_is_finished(process):
+    # A job whose give_up fails stays running, to be taken again once its lease expires
+    jobs = process({'_id': 'job', 'ISBN': '9780000000001', 'attempts': 1})
+    assert jobs.finished == []
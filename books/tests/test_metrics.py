@@ -0,0 +1,71 @@
+import os
+import json
+import subprocess
+import sys
+import pytest
+import common.metrics
+from common.metrics import LATENCY_BUCKETS, Registry
+
+
+@pytest.fixture
+def registry():
+    registry = Registry()
+    registry.counter('calls_total', "Calls", ('outcome',))
+    registry.histogram('call_duration_seconds', "Latency of the calls", ('outcome',))
+    registry.gauge('calls_in_flight', "Running calls", (), lambda: {(): 1})
+    return registry
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(common.metrics, 'METRICS_DIR', str(tmp_path))
+    return tmp_path
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def write_snapshot(metrics_dir, pid, ok_calls, in_flight):
+    # The snapshot of a worker process, whose calls all took 0.5ms
+    buckets = [ok_calls] + [0] * (len(LATENCY_BUCKETS) - 1)
+    snapshot = {'pid': pid,
+                'histograms': {'call_duration_seconds': [[['ok'], buckets + [ok_calls * 0.0005, ok_calls]]]},
+                'counters': {'calls_total': [[['ok'], ok_calls]]},
+                'gauges': {'calls_in_flight': [[[], in_flight]]}}
+    (metrics_dir / f'{pid}.json').write_text(json.dumps(snapshot))
+
+
+def test_metrics_of_the_worker_processes_are_summed(registry, metrics_dir):
+    registry.inc('calls_total', 'ok')
+    registry.observe('call_duration_seconds', 0.0001, 'ok')
+    write_snapshot(metrics_dir, os.getppid(), 2, 3)
+    # An exited process's counters and histograms still count, but not its gauges
+    write_snapshot(metrics_dir, exited_pid(), 4, 5)
+    lines = registry.render().splitlines()
+
+    assert 'calls_total{outcome="ok"} 7' in lines
+    assert 'call_duration_seconds_bucket{outcome="ok",le="0.0005"} 7' in lines
+    assert 'call_duration_seconds_count{outcome="ok"} 7' in lines
+    assert 'calls_in_flight{} 4' in lines
+    assert (metrics_dir / f'{os.getpid()}.json').exists()
+
+
+def test_unreadable_snapshots_are_skipped(registry, metrics_dir):
+    registry.inc('calls_total', 'ok')
+    # A snapshot being written, and a torn one
+    (metrics_dir / f'{os.getppid()}.json.tmp').write_text('{')
+    (metrics_dir / '1.json').write_text('{"pid": 1, "counters"')
+
+    assert 'calls_total{outcome="ok"} 1' in registry.render().splitlines()
+
+
+def test_metrics_of_this_process_alone_without_a_directory(registry, tmp_path, monkeypatch):
+    monkeypatch.setattr(common.metrics, 'METRICS_DIR', None)
+    write_snapshot(tmp_path, os.getppid(), 2, 3)
+    registry.inc('calls_total', 'ok')
+
+    assert [snapshot['pid'] for snapshot in registry.collect()] == [os.getpid()]
+    assert 'calls_total{outcome="ok"} 1' in registry.render().splitlines()
@@ -0,0 +1,20 @@
+import pytest
+from models.book import published_date_fields
+
+
+@pytest.mark.parametrize('published_date, year, sort_date', [
+    ('2015', 2015, '2015-00-00'),
+    ('2015-02', 2015, '2015-02-00'),
+    ('2016-02-29', 2016, '2016-02-29'),
+    ('2015-02-29', None, None),
+    ('2015-13', None, None),
+    ('2015-00-10', None, None),
+    ('2015-01-32', None, None),
+    ('2015-01-01T10:00:00', None, None),
+    ('2015-01-1', None, None),
+    ('missing', None, None),
+    ('pending', None, None),
+    (None, None, None),
+])
+def test_published_date_fields(published_date, year, sort_date):
+    assert published_date_fields(published_date) == {'publishedYear': year, 'publishedDateSort': sort_date}
@@ -0,0 +1,93 @@
+import time
+import pytest
+from datetime import datetime, timedelta
+import controllers
+from services.outbox_relay import OutboxRelay
+
+
+class Deliveries:
+    # The consumer of a relay, recording the delivered batches - failing while it's down
+    def __init__(self):
+        self.batches = []
+        self.down = False
+
+    def __call__(self, events):
+        if self.down:
+            raise ConnectionError("Loans service unavailable")
+        self.batches.append([event['seq'] for event in events])
+
+
+@pytest.fixture
+def mongodb_service():
+    mongodb_service = controllers.mongodb_service.instance()
+    for id in ('a', 'b', 'c'):
+        mongodb_service.append_event('book.deleted', id, {})
+    return mongodb_service
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+def relay(mongodb_service, owner):
+    relay = OutboxRelay(mongodb_service, Deliveries())
+    relay.owner = owner
+    return relay
+
+
+def test_events_delivered_in_order_once(mongodb_service):
+    first = relay(mongodb_service, 'first')
+
+    assert first.relay_batch() == 3
+    assert first.relay_batch() == 0
+    assert first.deliver.batches == [[1, 2, 3]]
+    assert mongodb_service.get_outbox_backlog() == (0, None)
+    assert first.stats()['delivered'] == 3
+
+
+def test_lease_holder_delivers_alone_until_its_lease_expires(mongodb_service):
+    first, second = relay(mongodb_service, 'first'), relay(mongodb_service, 'second')
+    assert first.relay_batch() == 3
+    mongodb_service.append_event('book.deleted', 'd', {})
+
+    # The first relay holds the lease, and renews it
+    assert second.relay_batch() == 0
+    assert first.relay_batch() == 1
+    mongodb_service.append_event('book.deleted', 'e', {})
+
+    # Its process died - the lease expires and the second relay takes over
+    mongodb_service.locks_collection.update_one({'_id': 'outbox_relay'},
+                                                {'$set': {'lockedUntil': datetime.utcnow() - timedelta(seconds=1)}})
+    assert second.relay_batch() == 1
+    assert second.deliver.batches == [[5]]
+    assert first.relay_batch() == 0
+
+
+def test_failed_delivery_is_retried(mongodb_service):
+    first = relay(mongodb_service, 'first')
+    first.deliver.down = True
+
+    with pytest.raises(ConnectionError):
+        first.relay_batch()
+    assert mongodb_service.get_outbox_backlog()[0] == 3
+
+    first.deliver.down = False
+    assert first.relay_batch() == 3
+    assert first.deliver.batches == [[1, 2, 3]]
+
+
+def test_relay_thread_counts_failures_and_keeps_delivering(mongodb_service, monkeypatch):
+    monkeypatch.setattr('services.outbox_relay.OUTBOX_RETRY_SECONDS', 0.01)
+    first = relay(mongodb_service, 'first')
+    first.deliver.down = True
+    first.start()
+    try:
+        wait_until(lambda: first.stats()['failures'])
+        first.deliver.down = False
+        wait_until(lambda: first.stats()['delivered'] == 3)
+    finally:
+        first.stop(timeout=5)
+    assert first.deliver.batches == [[1, 2, 3]]
@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+import controllers
+from services.mongodb_service import MongoDBService
+from services.schema_manager import MIGRATIONS, check_schema, schema_manager
+
+
+def test_workers_only_check_the_schema():
+    # The migrations collection is emptied before every test
+    manager = schema_manager(controllers.mongodb_service.instance())
+    MongoDBService()
+    assert check_schema(controllers.mongodb_service.instance()) == 0
+    assert manager.migrations_collection.count_documents({}) == 0
+
+    manager.run()
+    assert check_schema(controllers.mongodb_service.instance()) == MIGRATIONS[-1][0]
+
+
+def test_abandoned_migration_is_taken_over():
+    manager = schema_manager(controllers.mongodb_service.instance())
+    other = schema_manager(controllers.mongodb_service.instance())
+    other.owner = 'other-replica'
+    assert other.claim_migration(1, 'Backfill ratings count')
+    # Running, within its lease
+    assert not manager.claim_migration(1, 'Backfill ratings count')
+
+    manager.migrations_collection.update_one({'_id': 1}, {'$set': {'leaseUntil': datetime.utcnow() - timedelta(1)}})
+    assert manager.claim_migration(1, 'Backfill ratings count')
+    assert manager.migrations_collection.find_one({'_id': 1})['owner'] == manager.owner
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import pytest
+from common.metrics import registry
+from common.single_flight import SingleFlight
+from test_outbox_relay import wait_until
+
+
+class Computation:
+    # A computation counting its executions, blocked until released, then failing or returning its result
+    def __init__(self, error=None):
+        self.error = error
+        self.executions = 0
+        self.released = threading.Event()
+
+    def __call__(self):
+        self.executions += 1
+        self.released.wait(5)
+        if self.error:
+            raise self.error
+        return 'result'
+
+
+def shared_calls(flight):
+    return registry.counters['single_flight_calls_total'].get((flight.name, 'shared'), 0)
+
+
+def test_concurrent_callers_get_the_error_of_the_single_execution():
+    flight, compute = SingleFlight('test_error'), Computation(ValueError("Lookup failed"))
+    shared = shared_calls(flight)
+    errors = []
+
+    def call():
+        try:
+            flight.do('key', compute)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: shared_calls(flight) == shared + 2)
+    compute.released.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert compute.executions == 1
+    assert len(errors) == 3 and all(error is errors[0] for error in errors)
+    assert flight.in_flight() == 0
+
+
+def test_call_after_a_failure_executes_again():
+    flight, compute = SingleFlight('test_retry'), Computation(ValueError("Lookup failed"))
+    compute.released.set()
+    with pytest.raises(ValueError):
+        flight.do('key', compute)
+
+    compute.error = None
+    assert flight.do('key', compute) == 'result'
+    assert compute.executions == 2
+
+
+def test_async_callers_get_the_error_of_the_single_execution():
+    flight = SingleFlight('test_async_error')
+    executions = []
+
+    async def compute():
+        executions.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("Lookup failed")
+
+    async def calls():
+        return await asyncio.gather(*(flight.do_async('key', compute) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(calls())
+
+    assert len(executions) == 1
+    assert all(isinstance(error, ValueError) and error is errors[0] for error in errors)
+    assert flight.in_flight() == 0
+
+
+def test_cancelled_async_caller_does_not_cancel_the_others():
+    flight = SingleFlight('test_async_cancel')
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def calls():
+        cancelled = asyncio.ensure_future(flight.do_async('key', compute))
+        other = asyncio.ensure_future(flight.do_async('key', compute))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        return await other, cancelled.cancelled()
+
+    assert asyncio.run(calls()) == ('result', True)
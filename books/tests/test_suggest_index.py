@@ -0,0 +1,103 @@
+import pytest
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+import controllers
+import services.suggest_index
+from services.suggest_index import SuggestIndex
+from test_outbox_relay import wait_until
+
+
+class ChangeStream:
+    # A change stream returning the given changes, and dying once they are all returned
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.alive = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def try_next(self):
+        if not self.changes:
+            self.alive = False
+            return None
+        return self.changes.pop(0)
+
+
+class WatchedBooks:
+    # A books collection whose change streams are the given ones - mongomock doesn't support watch
+    def __init__(self, collection, streams):
+        self.collection = collection
+        self.streams = streams
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def watch(self, pipeline, **kwargs):
+        stream = self.streams.pop(0)
+        if isinstance(stream, Exception):
+            raise stream
+        return stream
+
+
+@pytest.fixture
+def mongodb_service():
+    mongodb_service = controllers.mongodb_service.instance()
+    mongodb_service.books_collection.insert_many([{'title': 'Émile', 'ISBN': '9780000000001'},
+                                                  {'title': 'Emma', 'ISBN': '9780000000002'}])
+    return mongodb_service
+
+
+def change(operation, book_id, title=None):
+    change = {'operationType': operation, 'documentKey': {'_id': book_id}}
+    if title is not None:
+        change['fullDocument'] = {'_id': book_id, 'title': title}
+    return change
+
+
+def test_suggestions_ignore_case_and_accents(mongodb_service):
+    index = SuggestIndex(mongodb_service)
+    assert index.suggest('em', 10) is None
+    index.load()
+
+    assert [book['title'] for book in index.suggest('EM', 10)] == ['Émile', 'Emma']
+    assert [book['title'] for book in index.suggest('emi', 10)] == ['Émile']
+    assert len(index.suggest('em', 1)) == 1
+
+
+def test_change_stream_followed_after_loading(mongodb_service, monkeypatch):
+    inserted, updated, deleted = ObjectId(), ObjectId(), ObjectId()
+    stream = ChangeStream([change('insert', inserted, 'Dune'), change('insert', updated, 'Emily'),
+                           change('insert', deleted, 'Emperor'), change('update', updated, 'Edda'),
+                           change('delete', deleted),
+                           # The looked up document of a book deleted since its update is missing
+                           change('update', inserted), change('invalidate', None)])
+    monkeypatch.setattr(mongodb_service, 'books_collection', WatchedBooks(mongodb_service.books_collection, [stream]))
+
+    index = SuggestIndex(mongodb_service)
+    index.follow_changes()
+
+    assert [book['title'] for book in index.suggest('e', 10)] == ['Edda', 'Émile', 'Emma']
+    assert index.suggest('dune', 10) == []
+    # Following ended at the invalidation, leaving the index to be reloaded from a new stream
+    assert stream.alive
+
+
+def test_polls_the_books_version_without_change_streams(mongodb_service, monkeypatch):
+    monkeypatch.setattr(services.suggest_index, 'SUGGEST_POLL_SECONDS', 0.01)
+    monkeypatch.setattr(mongodb_service, 'books_collection',
+                        WatchedBooks(mongodb_service.books_collection,
+                                     [OperationFailure("The $changeStream stage is only supported on replica sets")]))
+    index = SuggestIndex(mongodb_service)
+    index.start()
+    try:
+        wait_until(lambda: index.suggest('em', 10) is not None)
+        mongodb_service.books_collection.insert_one({'title': 'Emperor', 'ISBN': '9780000000003'})
+        assert len(index.suggest('em', 10)) == 2
+
+        mongodb_service.bump_version('books')
+        wait_until(lambda: len(index.suggest('em', 10)) == 3)
+    finally:
+        index.stop(timeout=5)
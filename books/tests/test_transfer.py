@@ -0,0 +1,42 @@
+import json
+from bson import ObjectId
+from test_books import add_book
+
+ADMIN_HEADERS = {'API-KEY': 'admin-api-key'}
+
+
+def import_lines(client, lines):
+    return client.post('/admin/import', data=''.join(f'{json.dumps(line)}\n' for line in lines),
+                       headers=dict(ADMIN_HEADERS, **{'Content-Type': 'application/x-ndjson'}))
+
+
+def test_import_keeps_existing_books(client, google_books):
+    add_book(client, google_books, 'Dune', '9780000000001')
+    add_book(client, google_books, 'Emma', '9780000000002')
+    export = client.get('/admin/export?collections=books', headers=ADMIN_HEADERS)
+    assert export.status_code == 200
+
+    response = client.post('/admin/import', data=export.get_data(),
+                           headers=dict(ADMIN_HEADERS, **{'Content-Type': 'application/x-ndjson'}))
+    assert response.status_code == 200
+    summary = response.get_json()
+    assert summary['collections'] == {'books': {'written': 0, 'existing': 2, 'errors': 0}}
+    assert summary['errors'] == []
+
+
+def test_import_reports_isbn_collisions(client, google_books):
+    add_book(client, google_books, 'Dune', '9780000000001')
+    new_id, colliding_id = str(ObjectId()), str(ObjectId())
+
+    response = import_lines(client, [
+        {'collection': 'books', 'document': {'_id': {'$oid': new_id}, 'title': 'Emma', 'ISBN': '9780000000002'}},
+        {'collection': 'books', 'document': {'_id': {'$oid': colliding_id}, 'title': 'Dune 2',
+                                             'ISBN': '9780000000001'}},
+    ])
+    assert response.status_code == 200
+    summary = response.get_json()
+    # The book whose ISBN is another book's isn't counted as existing
+    assert summary['collections'] == {'books': {'written': 1, 'existing': 0, 'errors': 1}}
+    assert [(error['collection'], error['id']) for error in summary['errors']] == [('books', colliding_id)]
+    assert client.get(f'/books/{new_id}').status_code == 200
+    assert client.get(f'/books/{colliding_id}').status_code == 404
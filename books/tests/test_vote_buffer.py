@@ -0,0 +1,128 @@
+import pytest
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+import async_controllers
+import controllers
+from services.vote_buffer import VoteBuffer, VoteFailed
+from test_books import add_book
+
+
+class FailingBulkWrites:
+    # A collection whose bulk writes apply every update one at a time, failing those of the given IDs - mongomock's
+    # bulk_write doesn't take the current driver's operations
+    def __init__(self, collection, failing_ids):
+        self.collection = collection
+        self.failing_ids = failing_ids
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, operations, ordered=True, session=None):
+        errors = []
+        for index, operation in enumerate(operations):
+            if operation._filter['_id'] in self.failing_ids:
+                errors.append({'index': index, 'code': 121, 'errmsg': 'Document failed validation'})
+            else:
+                self.collection.update_one(operation._filter, operation._doc)
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'writeConcernErrors': [], 'nModified': 0})
+
+
+class StubRatings:
+    # The ratings service of a vote buffer, with the averages and errors of its flushes
+    def __init__(self, averages, errors):
+        self.averages = averages
+        self.errors = errors
+
+    def add_ratings_values(self, votes, bump=False):
+        return self.averages, self.errors
+
+
+def test_failed_rating_update_fails_its_votes_only(client, google_books, monkeypatch):
+    ids = [add_book(client, google_books, title, isbn) for title, isbn in (('Dune', '9780000000001'),
+                                                                           ('Emma', '9780000000002'))]
+    mongodb_service = controllers.mongodb_service.instance()
+    monkeypatch.setattr(mongodb_service, 'ratings_collection',
+                        FailingBulkWrites(mongodb_service.ratings_collection, {ObjectId(ids[1])}))
+
+    buffer = VoteBuffer(mongodb_service)
+    batches = [buffer.add(ids[0], 4), buffer.add(ids[0], 5), buffer.add(ids[1], 3)]
+    buffer.flush()
+
+    assert batches[0].result(ids[0]) == 4.5
+    with pytest.raises(VoteFailed):
+        batches[2].result(ids[1])
+    assert mongodb_service.ratings_collection.find_one({'_id': ObjectId(ids[1])})['count'] == 0
+
+
+def test_flush_results():
+    buffer = VoteBuffer(StubRatings({'a': 4.5}, {'b': 'Document failed validation'}))
+    batch = buffer.add('a', 5)
+    buffer.add('b', 1)
+    buffer.add('c', 2)
+    buffer.flush()
+
+    assert batch.done.is_set()
+    assert batch.result('a') == 4.5
+    assert batch.result('c') is None
+    with pytest.raises(VoteFailed, match='Document failed validation'):
+        batch.result('b')
+
+
+def test_withdraw_until_flushed():
+    buffer = VoteBuffer(StubRatings({}, {}))
+    batch = buffer.add('a', 5)
+    buffer.add('a', 4)
+
+    assert buffer.withdraw(batch, 'a', 5)
+    assert (batch.votes, batch.size) == ({'a': {4: 1}}, 1)
+    buffer.flush()
+    assert not buffer.withdraw(batch, 'a', 4)
+
+
+@pytest.fixture
+def unflushed_votes(monkeypatch):
+    # Buffered votes, which nothing flushes - the buffers aren't started
+    monkeypatch.setattr(controllers, 'RATINGS_WRITE_MODE', 'buffered')
+    monkeypatch.setattr(async_controllers, 'RATINGS_WRITE_MODE', 'buffered')
+    monkeypatch.setattr(controllers, 'VOTE_FLUSH_TIMEOUT', 0.05)
+    monkeypatch.setattr(async_controllers, 'VOTE_FLUSH_TIMEOUT', 0.05)
+    monkeypatch.setattr(async_controllers, 'vote_buffer', VoteBuffer(controllers.mongodb_service))
+
+
+def test_vote_not_flushed_in_time_is_written_directly(client, google_books, unflushed_votes):
+    id = add_book(client, google_books, 'Dune', '9780000000001')
+
+    averages = [client.post(f'/ratings/{id}/values', json={'value': value}) for value in (5, 4)]
+    assert [response.status_code for response in averages] == [201, 201]
+    assert [response.get_json()['average'] for response in averages] == ['5.0', '4.5']
+    # Once, not buffered as well
+    assert client.get(f'/ratings/{id}').get_json()['count'] == 2
+    assert controllers.vote_buffer.batch.size == async_controllers.vote_buffer.batch.size == 0
+
+
+def test_ratings_version_bumped_once_per_flush(client, google_books, monkeypatch):
+    id = add_book(client, google_books, 'Dune', '9780000000001')
+    mongodb_service = controllers.mongodb_service.instance()
+    monkeypatch.setattr(mongodb_service, 'ratings_collection',
+                        FailingBulkWrites(mongodb_service.ratings_collection, set()))
+
+    def version():
+        return mongodb_service.versions_collection.find_one({'_id': 'ratings'})['version']
+
+    buffer = VoteBuffer(mongodb_service)
+    initial = version()
+    for value in (5, 4, 3):
+        mongodb_service.add_rating_value(id, value)
+        buffer.add_written()
+    assert version() == initial
+    buffer.flush()
+    buffer.flush()
+    assert version() == initial + 1
+
+    # The votes written directly and the buffered ones of a flush are counted together
+    buffer.add_written()
+    buffer.add(id, 2)
+    buffer.flush()
+    assert version() == initial + 2
+    assert mongodb_service.ratings_collection.find_one({'_id': ObjectId(id)})['count'] == 4
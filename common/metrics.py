@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import logging
+import threading
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Directory the worker processes share their metrics through, so that /metrics reports the totals of all of them -
+# set by gunicorn.conf.py. Without it every process reports its own metrics
+METRICS_DIR = os.getenv('METRICS_DIR')
+# Seconds between the writes of a worker process's metrics to METRICS_DIR
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+
+# Upper bounds, in seconds, of the latency histograms' buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Registry:
+    # Latency histograms, counters and gauges of the process, in the Prometheus text format
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.descriptions = {}
+        # Histograms by name, then by label values - the buckets' counts, then the sum and the count
+        self.histograms = {}
+        # Counters by name, then by label values
+        self.counters = {}
+        # Gauges by name - a function returning the values by label values, called when the metrics are collected
+        self.gauges = {}
+
+    def histogram(self, name, description, label_names):
+        self.descriptions[name] = ('histogram', description, label_names)
+        self.histograms[name] = {}
+
+    def counter(self, name, description, label_names):
+        self.descriptions[name] = ('counter', description, label_names)
+        self.counters[name] = {}
+
+    def gauge(self, name, description, label_names, collect):
+        self.descriptions[name] = ('gauge', description, label_names)
+        self.gauges[name] = collect
+
+    def observe(self, name, seconds, *label_values):
+        label_values = tuple(str(value) for value in label_values)
+        with self.lock:
+            values = self.histograms[name].get(label_values)
+            if values is None:
+                values = self.histograms[name][label_values] = [0] * (len(LATENCY_BUCKETS) + 2)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    values[index] += 1
+                    break
+            values[-2] += seconds
+            values[-1] += 1
+
+    def inc(self, name, *label_values):
+        label_values = tuple(str(value) for value in label_values)
+        with self.lock:
+            self.counters[name][label_values] = self.counters[name].get(label_values, 0) + 1
+
+    def snapshot(self):
+        # The process's metrics - JSON serializable, with the label values as lists
+        with self.lock:
+            histograms = {name: [[list(labels), list(values)] for labels, values in samples.items()]
+                          for name, samples in self.histograms.items()}
+            counters = {name: [[list(labels), value] for labels, value in samples.items()]
+                        for name, samples in self.counters.items()}
+        gauges = {}
+        for name, collect in self.gauges.items():
+            gauges[name] = [[list(labels), value] for labels, value in collect().items()]
+        return {'pid': os.getpid(), 'histograms': histograms, 'counters': counters, 'gauges': gauges}
+
+    def write_snapshot(self):
+        path = os.path.join(METRICS_DIR, f'{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(f'{path}.tmp', path)
+
+    def collect(self):
+        # The metrics of all the processes sharing METRICS_DIR, or of this process alone.
+        # Exited processes' histograms and counters still count, but not their gauges
+        if not METRICS_DIR:
+            return [self.snapshot()]
+
+        self.write_snapshot()
+        snapshots = []
+        for file_name in os.listdir(METRICS_DIR):
+            if not file_name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, file_name)) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            if not process_alive(snapshot['pid']):
+                snapshot['gauges'] = {}
+            snapshots.append(snapshot)
+        return snapshots
+
+    def render(self):
+        histograms = {name: {} for name in self.histograms}
+        counters = {name: {} for name in self.counters}
+        gauges = {name: {} for name in self.gauges}
+        for snapshot in self.collect():
+            for name, samples in snapshot['histograms'].items():
+                for labels, values in samples:
+                    total = histograms.setdefault(name, {}).setdefault(tuple(labels), [0] * len(values))
+                    for index, value in enumerate(values):
+                        total[index] += value
+            for name, samples in snapshot.get('counters', {}).items():
+                for labels, value in samples:
+                    counter = counters.setdefault(name, {})
+                    counter[tuple(labels)] = counter.get(tuple(labels), 0) + value
+            for name, samples in snapshot['gauges'].items():
+                for labels, value in samples:
+                    gauge = gauges.setdefault(name, {})
+                    gauge[tuple(labels)] = gauge.get(tuple(labels), 0) + value
+
+        lines = []
+        for name, samples in histograms.items():
+            kind, description, label_names = self.descriptions[name]
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+            for label_values, values in sorted(samples.items()):
+                labels = format_labels(label_names, label_values)
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, values):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {values[-1]}')
+                lines.append(f'{name}_sum{{{labels.rstrip(",")}}} {values[-2]}')
+                lines.append(f'{name}_count{{{labels.rstrip(",")}}} {values[-1]}')
+        for name, samples in list(counters.items()) + list(gauges.items()):
+            kind, description, label_names = self.descriptions[name]
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+            for label_values, value in sorted(samples.items()):
+                lines.append(f'{name}{{{format_labels(label_names, label_values).rstrip(",")}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(label_names, label_values):
+    # 'name="value",' for every label, escaped
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in label_values)
+    return ''.join(f'{name}="{value}",' for name, value in zip(label_names, escaped))
+
+
+def format_address(address):
+    return f'{address[0]}:{address[1]}'
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+registry = Registry()
+registry.histogram('http_request_duration_seconds', "Latency of the served requests, until their response headers",
+                   ('route', 'method', 'status'))
+registry.histogram('http_client_request_duration_seconds', "Latency of the calls to other services",
+                   ('upstream', 'status'))
+registry.histogram('mongodb_command_duration_seconds', "Latency of the MongoDB commands", ('command', 'outcome'))
+registry.histogram('mongodb_pool_checkout_duration_seconds', "Time waited for a MongoDB connection", ('address',))
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    # Times every MongoDB command of the clients it's registered with
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        registry.observe('mongodb_command_duration_seconds', event.duration_micros / 1e6, event.command_name,
+                         'succeeded')
+
+    def failed(self, event):
+        registry.observe('mongodb_command_duration_seconds', event.duration_micros / 1e6, event.command_name,
+                         'failed')
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    # Open and checked out connections of the connection pools, by server address
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = {}
+        self.checked_out = {}
+
+    def add(self, counts, address, delta):
+        address = format_address(address)
+        with self.lock:
+            counts[address] = counts.get(address, 0) + delta
+
+    def connection_created(self, event):
+        self.add(self.connections, event.address, 1)
+
+    def connection_closed(self, event):
+        self.add(self.connections, event.address, -1)
+
+    def connection_checked_out(self, event):
+        self.add(self.checked_out, event.address, 1)
+        # The wait is only reported by recent drivers
+        duration = getattr(event, 'duration', None)
+        if duration is not None:
+            registry.observe('mongodb_pool_checkout_duration_seconds', duration, format_address(event.address))
+
+    def connection_checked_in(self, event):
+        self.add(self.checked_out, event.address, -1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def open_connections(self):
+        with self.lock:
+            return {(address,): count for address, count in self.connections.items()}
+
+    def checked_out_connections(self):
+        with self.lock:
+            return {(address,): count for address, count in self.checked_out.items()}
+
+
+pool_listener = MongoPoolListener()
+registry.gauge('mongodb_pool_connections', "Open MongoDB connections", ('address',), pool_listener.open_connections)
+registry.gauge('mongodb_pool_connections_in_use', "Checked out MongoDB connections", ('address',),
+               pool_listener.checked_out_connections)
+
+
+def mongo_event_listeners():
+    # Event listeners of the MongoDB clients - MongoClient(uri, event_listeners=mongo_event_listeners())
+    return [MongoCommandListener(), pool_listener]
+
+
+def observe_call(upstream, start, response=None):
+    # Record a call to another service, started at 'start' (time.perf_counter()), without a response if it failed
+    status = response.status_code if response is not None else 'error'
+    registry.observe('http_client_request_duration_seconds', time.perf_counter() - start, upstream, status)
+
+
+def request_route(request):
+    # The route's pattern rather than the path, so that the label values are bounded
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def configure_metrics(app):
+    # Time every request of the Flask app
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            registry.observe('http_request_duration_seconds', time.perf_counter() - start, request_route(request),
+                             request.method, response.status_code)
+        return response
+
+    start_flushing()
+
+
+def configure_async_metrics(app):
+    # Time every request of the Quart app
+    from quart import g, request
+
+    @app.before_request
+    async def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    async def observe_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            registry.observe('http_request_duration_seconds', time.perf_counter() - start, request_route(request),
+                             request.method, response.status_code)
+        return response
+
+    start_flushing()
+
+
+def start_flushing():
+    # Share the process's metrics with the other worker processes every METRICS_FLUSH_SECONDS
+    if not METRICS_DIR:
+        return
+
+    def flush():
+        while True:
+            try:
+                registry.write_snapshot()
+            except OSError as e:
+                logger.warning("Error writing the metrics to %s: %s", METRICS_DIR, e)
+            time.sleep(METRICS_FLUSH_SECONDS)
+
+    threading.Thread(target=flush, name='metrics-flush', daemon=True).start()
@@ -0,0 +1,92 @@
+import os
+from bson import ObjectId
+from flask import Response, current_app, jsonify, stream_with_context
+
+# Query parameters accepted by every list endpoint, on top of its own filters
+PAGINATION_PARAMS = {'limit', 'after', 'stream', 'fields'}
+
+# Largest page returned in a single (non-streamed) JSON response
+MAX_PAGE_LIMIT = int(os.getenv('MAX_PAGE_LIMIT', 1000))
+
+# Supported streaming formats - a single JSON array, or one JSON document per line
+STREAM_FORMATS = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
+
+# Size of the chunks written to the client while streaming
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def get_pagination_args(params, fields_allowed=()):
+    # Validate the 'limit', 'after', 'stream' and 'fields' query parameters, returns (pagination, errors)
+    errors = []
+
+    stream = params.get('stream')
+    if stream is not None and stream not in STREAM_FORMATS:
+        errors.append(f"'stream' must be one of {', '.join(STREAM_FORMATS)}")
+
+    limit = params.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            errors.append("'limit' must be a positive integer")
+        elif not stream and int(limit) > MAX_PAGE_LIMIT:
+            errors.append(f"'limit' must be at most {MAX_PAGE_LIMIT}, use 'stream' for larger reads")
+        else:
+            limit = int(limit)
+
+    after = params.get('after')
+    if after is not None and not ObjectId.is_valid(after):
+        errors.append("'after' must be an ID returned by a previous page")
+
+    # A comma separated list of the fields to return, instead of the whole documents
+    fields = params.get('fields')
+    if fields is not None:
+        fields = [field for field in fields.split(',') if field]
+        invalid_fields = [field for field in fields if field not in fields_allowed]
+        if not fields or invalid_fields:
+            errors.append(f"'fields' must be a comma separated list of {', '.join(sorted(fields_allowed))}")
+
+    if errors:
+        return None, {"error": "; ".join(errors)}
+    return {'limit': limit, 'after': after, 'stream': stream, 'fields': fields}, None
+
+
+def list_response(items, pagination, id_key):
+    # Return the items either streamed straight from the database cursor or as a single JSON array.
+    # A full page carries the 'X-Next-After' header, to be passed as 'after' to get the next page
+    if pagination['stream']:
+        chunks = stream_items(items, pagination['stream'])
+        return Response(stream_with_context(chunks), mimetype=STREAM_FORMATS[pagination['stream']]), 200
+
+    items = list(items)
+    response = jsonify(items)
+    if pagination['limit'] and len(items) == pagination['limit']:
+        response.headers['X-Next-After'] = items[-1][id_key]
+    return response, 200
+
+
+def stream_delimiters(stream_format):
+    # The opening, separator and closing of the streamed documents
+    if stream_format == 'ndjson':
+        return '', '\n', '\n'
+    return '[', ',', ']'
+
+
+def stream_items(items, stream_format):
+    dumps = current_app.json.dumps
+    opening, separator, closing = stream_delimiters(stream_format)
+
+    buffer = [opening]
+    buffer_size = 0
+    first = True
+    for item in items:
+        document = dumps(item)
+        buffer.append(document if first else separator + document)
+        buffer_size += len(document) + 1
+        first = False
+        if buffer_size >= STREAM_CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            buffer_size = 0
+
+    if not first or stream_format == 'json':
+        buffer.append(closing)
+    yield ''.join(buffer)
@@ -0,0 +1,24 @@
+import os
+import threading
+
+
+class ProcessLocal:
+    # Creates its object on first use in every process, and forwards attribute access to it.
+    # An object created before a fork - e.g. a MongoClient of a pre-forking server's master - is never
+    # used by the forked workers, which create their own
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._instance = None
+        self._pid = None
+
+    def instance(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._instance = self._factory()
+                    self._pid = os.getpid()
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self.instance(), name)
@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import time
+import socket
+import logging
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# A migration claimed by a replica which didn't finish it within the lease is considered abandoned
+MIGRATION_LEASE_SECONDS = int(os.getenv('MIGRATION_LEASE_SECONDS', 300))
+MIGRATION_POLL_SECONDS = 1
+
+
+class SchemaManager:
+    # The schema of a service's database - indexes maps every MongoDBService collection attribute to its expected
+    # indexes, migrations lists the versioned data migrations, applied once each and in order, as
+    # (version, description, function(mongodb_service)). Their progress is kept in the database's schema_migrations
+    def __init__(self, mongodb_service, db, indexes, migrations):
+        self.mongodb_service = mongodb_service
+        self.indexes = indexes
+        self.migrations = migrations
+        self.migrations_collection = db['schema_migrations']
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def collections(self):
+        return {name: getattr(self.mongodb_service, name) for name in self.indexes}
+
+    def latest_version(self):
+        return self.migrations[-1][0] if self.migrations else 0
+
+    def run(self):
+        # Safe to run from several replicas at once - index creation is idempotent and
+        # each migration is claimed by a single replica while the others wait for it.
+        # The migrations run first, as they may drop the indexes replaced by new declared ones
+        self.apply_migrations()
+        self.ensure_indexes()
+
+    def check(self):
+        # The workers only check the schema version - the schema is applied before they start, by the migrate command
+        version, latest = self.current_version(), self.latest_version()
+        if version < latest:
+            logger.error("Schema version %s is behind %s - run 'python -m services.schema_manager migrate'",
+                         version, latest)
+        return version
+
+    def ensure_indexes(self):
+        for name, collection in self.collections().items():
+            if not self.indexes[name]:
+                continue
+            try:
+                collection.create_indexes(self.indexes[name])
+            except OperationFailure as e:
+                # E.g. duplicate values of a unique index already stored - keep serving, the report will show the
+                # index as missing
+                logger.error("Failed creating indexes on '%s': %s", collection.full_name, e)
+
+    def current_version(self):
+        done = self.migrations_collection.find({'status': 'done'}, {'_id': 1}).sort('_id', -1).limit(1)
+        for migration in done:
+            return migration['_id']
+        return 0
+
+    def apply_migrations(self):
+        for version, description, migrate in self.migrations:
+            if not self.acquire_migration(version, description):
+                continue
+            logger.info("Applying schema migration %s: %s", version, description)
+            migrate(self.mongodb_service)
+            self.migrations_collection.update_one(
+                {'_id': version}, {'$set': {'status': 'done', 'finishedAt': datetime.utcnow()}})
+
+    def acquire_migration(self, version, description):
+        # Returns True if this replica should run the migration, False once it was applied by any replica
+        while not self.claim_migration(version, description):
+            migration = self.migrations_collection.find_one({'_id': version})
+            if migration and migration['status'] == 'done':
+                return False
+            # Another replica is running this migration - wait for it to finish
+            time.sleep(MIGRATION_POLL_SECONDS)
+        return True
+
+    def claim_migration(self, version, description):
+        now = datetime.utcnow()
+        try:
+            self.migrations_collection.insert_one({
+                '_id': version, 'description': description, 'status': 'running',
+                'owner': self.owner, 'startedAt': now, 'leaseUntil': now + timedelta(seconds=MIGRATION_LEASE_SECONDS)
+            })
+            return True
+        except DuplicateKeyError:
+            pass
+
+        # Take over a migration whose owner died while running it
+        result = self.migrations_collection.update_one(
+            {'_id': version, 'status': 'running', 'leaseUntil': {'$lt': now}},
+            {'$set': {'owner': self.owner, 'startedAt': now,
+                      'leaseUntil': now + timedelta(seconds=MIGRATION_LEASE_SECONDS)}})
+        return result.modified_count == 1
+
+    def report(self):
+        # Compare the declared indexes with the existing ones and their usage since the server started
+        report = {'version': self.current_version(), 'latest': self.latest_version(), 'collections': {}}
+        for name, collection in self.collections().items():
+            declared = {index.document['name'] for index in self.indexes[name]}
+            usage = {stats['name']: stats['accesses']['ops']
+                     for stats in collection.aggregate([{'$indexStats': {}}])}
+            report['collections'][collection.full_name] = {
+                'missing': sorted(declared - set(usage)),
+                'undeclared': sorted(set(usage) - declared - {'_id_'}),
+                'unused': sorted(index for index, ops in usage.items() if ops == 0 and index != '_id_'),
+            }
+        return report
+
+
+def run_command(manager, args):
+    # The 'python -m services.schema_manager [report|migrate]' command of every service
+    command = args[0] if args else 'report'
+    if command == 'migrate':
+        manager.run()
+    elif command != 'report':
+        sys.exit(f"Unknown command '{command}' - use 'report' or 'migrate'")
+    print(json.dumps(manager.report(), indent=2))
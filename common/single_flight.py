@@ -0,0 +1,84 @@
+import asyncio
+import threading
+from common.metrics import registry
+
+registry.counter('single_flight_calls_total', "Calls of the coalesced computations - 'executed' ones ran the "
+                 "computation, 'shared' ones got the result of a concurrent identical call", ('name', 'outcome'))
+
+# Every SingleFlight of the process, by name
+flights = {}
+
+
+def in_flight():
+    return {(name,): flight.in_flight() for name, flight in flights.items()}
+
+
+registry.gauge('single_flight_in_flight', "Coalesced computations running", ('name',), in_flight)
+
+
+class Call:
+    # A running computation, and once done its result or exception
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Collapses the concurrent calls of the same computation - same key - into a single execution, whose result or
+    # exception every caller gets. Nothing is cached: a call after the execution finished executes again.
+    # The shared results must not be modified by the callers
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+        # The running computations of the asyncio callers, on the event loop of the process
+        self.tasks = {}
+        flights[name] = self
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls) + len(self.tasks)
+
+    def do(self, key, compute):
+        # compute() once for all the concurrent callers with the key, from any thread
+        with self.lock:
+            call = self.calls.get(key)
+            executing = call is None
+            if executing:
+                call = self.calls[key] = Call()
+
+        if not executing:
+            registry.inc('single_flight_calls_total', self.name, 'shared')
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        registry.inc('single_flight_calls_total', self.name, 'executed')
+        try:
+            call.result = compute()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    async def do_async(self, key, compute):
+        # await compute() once for all the concurrent callers with the key, on the event loop. The computation is
+        # a task of its own, so that a cancelled caller doesn't cancel it for the others
+        task = self.tasks.get(key)
+        if task is None:
+            registry.inc('single_flight_calls_total', self.name, 'executed')
+            task = self.tasks[key] = asyncio.ensure_future(compute())
+            task.add_done_callback(lambda done: self.forget(key, done))
+        else:
+            registry.inc('single_flight_calls_total', self.name, 'shared')
+        return await asyncio.shield(task)
+
+    def forget(self, key, task):
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
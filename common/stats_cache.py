@@ -0,0 +1,52 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from common.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Seconds a computed statistic is served for even if its collections were written since - bounds the aggregations
+# to one per statistic and process in that time, however frequent the writes
+STATS_MIN_AGE_SECONDS = float(os.getenv('STATS_MIN_AGE_SECONDS', 5))
+
+
+class StatsCache:
+    # Statistics computed by aggregations, cached until one of the collections they're computed from is written -
+    # as told by the collections' version counters. 'statistics' maps every statistic's name to its
+    # (collection names, compute function)
+    def __init__(self, mongodb_service, statistics):
+        self.mongodb_service = mongodb_service
+        self.statistics = statistics
+        self.lock = threading.Lock()
+        # Computed statistics by name - (versions, monotonic time computed, entry)
+        self.entries = {}
+        # The requests missing the cache together share a single computation
+        self.computations = SingleFlight('stats')
+
+    def names(self):
+        return list(self.statistics)
+
+    def get(self, name):
+        collections = self.statistics[name][0]
+        versions = self.mongodb_service.get_versions(collections)
+        versions = tuple((versions[collection]['epoch'], versions[collection]['version'])
+                         if collection in versions else None for collection in collections)
+
+        with self.lock:
+            cached = self.entries.get(name)
+            if cached and (cached[0] == versions or time.monotonic() - cached[1] < STATS_MIN_AGE_SECONDS):
+                return cached[2]
+
+        return self.computations.do(name, lambda: self.compute(name, versions))
+
+    def compute(self, name, versions):
+        # The versions are read before the statistic is computed, so it's never cached as newer than its data
+        computation = self.statistics[name][1]
+        start = time.monotonic()
+        entry = {'computedAt': datetime.now(timezone.utc).isoformat(), 'values': computation()}
+        logger.info("Computed the '%s' statistics in %.3f seconds", name, time.monotonic() - start)
+        with self.lock:
+            self.entries[name] = (versions, start, entry)
+        return entry
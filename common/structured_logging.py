@@ -0,0 +1,79 @@
+import os
+import json
+import random
+import logging
+from datetime import datetime, timezone
+
+# Log level, and format - 'json' (one JSON object per line) or 'text'
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+# Fraction of the per-request debug lines which are emitted
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1))
+# Maximal number of document IDs listed in a payload summary
+LOG_PAYLOAD_MAX_IDS = int(os.getenv('LOG_PAYLOAD_MAX_IDS', 5))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+configured = False
+
+
+def configure_logging():
+    # Set up the root logger of the service once, from the environment
+    global configured
+    if configured:
+        return
+    configured = True
+
+    root = logging.getLogger()
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+
+def log_sampled(logger, message, *args, **fields):
+    # A per-request debug line - only emitted, and formatted, if debug is enabled and for a sample of the requests.
+    # The fields are added to the JSON log entry
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_DEBUG_SAMPLE_RATE:
+        logger.debug(message, *args, extra={'fields': fields})
+
+
+class PayloadSummary:
+    # Size-capped description of a document or a list of documents - counts and IDs instead of whole documents.
+    # Computed only when the log line is actually emitted
+    def __init__(self, payload, id_key='id'):
+        self.payload = payload
+        self.id_key = id_key
+
+    def document_id(self, document):
+        return str(document.get(self.id_key, document.get('_id')))
+
+    def __str__(self):
+        if self.payload is None:
+            return 'none'
+        if isinstance(self.payload, dict):
+            return f"{{{self.id_key}={self.document_id(self.payload)}, fields={len(self.payload)}}}"
+
+        ids = [self.document_id(document) for document in self.payload[:LOG_PAYLOAD_MAX_IDS]]
+        more = ', ...' if len(self.payload) > LOG_PAYLOAD_MAX_IDS else ''
+        return f"[count={len(self.payload)}, ids={', '.join(ids)}{more}]"
+
+
+def summarize(payload, id_key='id'):
+    return PayloadSummary(payload, id_key)
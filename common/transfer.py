@@ -0,0 +1,263 @@
+import os
+import zlib
+import logging
+from datetime import datetime
+from bson import json_util
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Documents written by a single insert_many or bulk_write of an import
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+# Bytes of the request body read at a time by an import
+IMPORT_READ_SIZE = 64 * 1024
+# Documents fetched by every round trip of an export's cursors
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+# Size of the chunks written to the client by an export, before compression
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+GZIP_CONTENT_TYPE = 'application/gzip'
+
+# How an import writes documents whose _id already exists - kept, or replaced by the imported ones
+IMPORT_MODES = ('insert', 'replace')
+# Documents refused by an import which are listed in its summary, on top of being counted
+IMPORT_MAX_ERRORS = int(os.getenv('IMPORT_MAX_ERRORS', 100))
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def get_export_args(params, collections_allowed):
+    # Validate the 'collections' and 'gzip' query parameters of an export, returns (export, errors)
+    errors = []
+    collections = params.get('collections')
+    collections = [name for name in collections.split(',') if name] if collections else list(collections_allowed)
+    if not collections or any(name not in collections_allowed for name in collections):
+        errors.append(f"'collections' must be a comma separated list of {', '.join(collections_allowed)}")
+
+    gzip = params.get('gzip', '0')
+    if gzip not in ('0', '1'):
+        errors.append("'gzip' must be 0 or 1")
+
+    if errors:
+        return None, {"error": "; ".join(errors)}
+    # In the declared order, which an import of the export follows
+    return {'collections': [name for name in collections_allowed if name in collections], 'gzip': gzip == '1'}, None
+
+
+def get_import_args(params):
+    # Validate the 'mode' and 'checkpoint' query parameters of an import, returns (import, errors)
+    errors = []
+    mode = params.get('mode', 'insert')
+    if mode not in IMPORT_MODES:
+        errors.append(f"'mode' must be one of {', '.join(IMPORT_MODES)}")
+
+    checkpoint = params.get('checkpoint')
+    if checkpoint is not None and not checkpoint:
+        errors.append("'checkpoint' must be a non-empty name")
+
+    if errors:
+        return None, {"error": "; ".join(errors)}
+    return {'mode': mode, 'checkpoint': checkpoint}, None
+
+
+def export_headers(service_name, gzip):
+    file_name = f"{service_name}-export.ndjson{'.gz' if gzip else ''}"
+    return {'Content-Type': GZIP_CONTENT_TYPE if gzip else NDJSON_CONTENT_TYPE,
+            'Content-Disposition': f'attachment; filename="{file_name}"'}
+
+
+def export_cursor(collection):
+    # Every document of the collection, in _id order, fetched EXPORT_BATCH_SIZE at a time
+    return collection.find({}, batch_size=EXPORT_BATCH_SIZE).sort('_id', 1)
+
+
+class ExportWriter:
+    # Encodes the exported documents as lines of NDJSON - {"collection": name, "document": document} in Extended
+    # JSON, keeping the ObjectIds and dates - in chunks of about EXPORT_CHUNK_SIZE bytes, optionally gzipped
+    def __init__(self, gzip):
+        self.compressor = zlib.compressobj(wbits=31) if gzip else None
+        self.buffer = []
+        self.buffer_size = 0
+
+    def write(self, name, document):
+        # The next chunk once the buffered lines fill one, otherwise None
+        line = json_util.dumps({'collection': name, 'document': document},
+                               json_options=json_util.RELAXED_JSON_OPTIONS)
+        self.buffer.append(line)
+        self.buffer_size += len(line) + 1
+        if self.buffer_size < EXPORT_CHUNK_SIZE:
+            return None
+        return self.flush()
+
+    def flush(self):
+        data = ''.join(f'{line}\n' for line in self.buffer).encode()
+        self.buffer = []
+        self.buffer_size = 0
+        return self.compressor.compress(data) if self.compressor else data
+
+    def close(self):
+        data = self.flush()
+        return data + self.compressor.flush() if self.compressor else data
+
+
+def export_chunks(collections, gzip):
+    # The export of the given (name, collection) pairs, see ExportWriter - streamed from their cursors in constant
+    # memory. Documents written during the export may or may not be part of it
+    writer = ExportWriter(gzip)
+    for name, collection in collections:
+        for document in export_cursor(collection):
+            chunk = writer.write(name, document)
+            if chunk:
+                yield chunk
+    yield writer.close()
+
+
+class ImportFailed(ValueError):
+    pass
+
+
+class Importer:
+    # Writes the documents of an export, fed to it in chunks of its NDJSON - optionally gzipped - IMPORT_BATCH_SIZE
+    # documents at a time, keeping their _id. With a checkpoint name, the number of lines written is saved after
+    # every batch, and an import of the same export with the same checkpoint resumes after them
+    def __init__(self, collections, checkpoints_collection, mode='insert', checkpoint=None, gzip=False):
+        self.collections = collections
+        self.checkpoints_collection = checkpoints_collection
+        self.mode = mode
+        self.checkpoint = checkpoint
+        self.decompressor = zlib.decompressobj(wbits=31) if gzip else None
+        self.pending = b''
+
+        # Lines read so far, the last line of the batch, and the lines written so far - up to the end of the last
+        # written batch
+        self.lines = 0
+        self.batch_lines = 0
+        self.batch_name = None
+        self.batch = []
+        self.counts = {}
+        self.errors = []
+
+        saved = checkpoints_collection.find_one({'_id': checkpoint}) if checkpoint else None
+        self.skip_lines = saved['lines'] if saved else 0
+        self.skip_last_id = saved.get('lastId') if saved else None
+        self.written_lines = self.skip_lines
+
+    def feed(self, data):
+        if self.decompressor:
+            data = self.decompress(data)
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.read_line(line)
+
+    def decompress(self, data):
+        # Concatenated gzip members are decompressed one after the other, like gunzip does
+        output = self.decompressor.decompress(data)
+        while self.decompressor.eof and self.decompressor.unused_data:
+            unused_data = self.decompressor.unused_data
+            self.decompressor = zlib.decompressobj(wbits=31)
+            output += self.decompressor.decompress(unused_data)
+        return output
+
+    def finish(self):
+        # Write the last batch, returns the import's summary
+        if self.decompressor and not self.decompressor.eof:
+            raise ImportFailed("The gzipped stream is truncated")
+        if self.pending.strip():
+            self.read_line(self.pending)
+            self.pending = b''
+        self.write_batch()
+        return self.summary()
+
+    def summary(self):
+        # The lines written include those skipped, written by the import resumed
+        return {'lines': self.written_lines, 'resumedAfter': self.skip_lines, 'collections': self.counts,
+                'errors': self.errors}
+
+    def read_line(self, line):
+        if not line.strip():
+            return
+        self.lines += 1
+        if self.lines < self.skip_lines:
+            return
+
+        try:
+            record = json_util.loads(line)
+            name, document = record['collection'], record['document']
+        except (ValueError, TypeError, KeyError) as e:
+            raise ImportFailed(f"Line {self.lines} isn't an exported document: {e}")
+        if name not in self.collections:
+            raise ImportFailed(f"Line {self.lines} is of an unknown collection '{name}' - "
+                               f"one of {', '.join(self.collections)}")
+        if not isinstance(document, dict) or '_id' not in document:
+            raise ImportFailed(f"Line {self.lines} has no document with an _id")
+
+        if self.lines == self.skip_lines:
+            # The last line written before the checkpoint - a different stream than the checkpoint's otherwise
+            if self.skip_last_id is not None and document['_id'] != self.skip_last_id:
+                raise ImportFailed(f"Line {self.lines} isn't the last document written by checkpoint "
+                                   f"'{self.checkpoint}' - the stream isn't the one imported with it")
+            return
+
+        if name != self.batch_name or len(self.batch) >= IMPORT_BATCH_SIZE:
+            self.write_batch()
+            self.batch_name = name
+        self.batch.append(document)
+        self.batch_lines = self.lines
+
+    def write_batch(self):
+        if not self.batch:
+            return
+        collection = self.collections[self.batch_name]
+        counts = self.counts.setdefault(self.batch_name, {'written': 0, 'existing': 0, 'errors': 0})
+        try:
+            if self.mode == 'replace':
+                result = collection.bulk_write([ReplaceOne({'_id': document['_id']}, document, upsert=True)
+                                                for document in self.batch], ordered=False)
+                counts['written'] += result.upserted_count + result.matched_count
+            else:
+                result = collection.insert_many(self.batch, ordered=False)
+                counts['written'] += len(result.inserted_ids)
+        except BulkWriteError as e:
+            if any(error['code'] != DUPLICATE_KEY_ERROR for error in e.details['writeErrors']):
+                raise
+            counts['written'] += sum(e.details.get(key, 0) for key in ('nInserted', 'nUpserted', 'nMatched'))
+            for error in e.details['writeErrors']:
+                document = self.batch[error['index']]
+                if self.mode == 'insert' and duplicate_id(collection, document, error):
+                    # Already imported, e.g. by an interrupted import without a checkpoint - kept
+                    counts['existing'] += 1
+                else:
+                    # Colliding with another document on a unique field, e.g. a book's ISBN
+                    counts['errors'] += 1
+                    if len(self.errors) < IMPORT_MAX_ERRORS:
+                        self.errors.append({'collection': self.batch_name, 'id': str(document['_id']),
+                                            'error': error['errmsg']})
+
+        self.written_lines = self.batch_lines
+        if self.checkpoint:
+            self.checkpoints_collection.update_one({'_id': self.checkpoint}, {'$set': {
+                'lines': self.written_lines, 'lastId': self.batch[-1]['_id'], 'updatedAt': datetime.utcnow()}},
+                upsert=True)
+        logger.info("Imported %s %s documents, %s lines so far", len(self.batch), self.batch_name, self.written_lines)
+        self.batch = []
+
+
+def duplicate_id(collection, document, error):
+    # Whether the duplicate key error of the document's insert is of its _id, rather than of another unique index -
+    # as reported by the server, or else found in the collection
+    if 'keyPattern' in error:
+        return list(error['keyPattern']) == ['_id']
+    return collection.count_documents({'_id': document['_id']}, limit=1) > 0
+
+
+def import_stream(read, importer):
+    # Feed the importer the request body, read IMPORT_READ_SIZE bytes at a time by 'read'
+    while True:
+        data = read(IMPORT_READ_SIZE)
+        if not data:
+            break
+        importer.feed(data)
+    return importer.finish()
@@ -1,40 +1,63 @@
-from flask import Blueprint, jsonify, request
-from models.loans import Loan
+import os
 import re
-from services.mongodb_service import MongoDBService
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from common.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry as metrics_registry
+from common.process_local import ProcessLocal
+from common.stats_cache import StatsCache
+from common.transfer import (GZIP_CONTENT_TYPE, NDJSON_CONTENT_TYPE, Importer, ImportFailed, export_chunks,
+                             export_headers, get_export_args, get_import_args, import_stream)
+from common.pagination import PAGINATION_PARAMS, get_pagination_args, list_response
+from models.loans import Loan, LOAN_FIELDS, MAX_MEMBER_LOANS
+from services.books_service import BooksServiceUnavailable
+from services.mongodb_service import MemberLoansLimit, MongoDBService
+from services.schema_manager import check_schema
 
 controllers_bp = Blueprint('controllers', __name__)
 
-# Create a global instance of MongoDBService
-mongodb_service = MongoDBService()
+# API key of the books-service, delivering its events
+BOOKS_SERVICE_API_KEY = 'books-service-api-key'
+
+# Create a global instance of MongoDBService, connecting on first use in every worker process
+mongodb_service = ProcessLocal(lambda: MongoDBService())
+
+# The statistics of GET /stats - by name, the collections each is computed from and its computation, cached until
+# the loans are written
+stats_cache = ProcessLocal(lambda: StatsCache(mongodb_service, {
+    'members': (['loans'], mongodb_service.count_loans_by_member),
+}))
+
+
+def init_worker_process():
+    # Connect to MongoDB and check its schema was migrated, once per worker process
+    check_schema(mongodb_service.instance())
 
 
 # Define /loans route for GET and POST requests
 @controllers_bp.route('/loans', methods=['GET', 'POST'])
 def loans():
     if request.method == 'GET':
-        try:
-            res_loans_list = mongodb_service.get_all_loans()
-        except Exception as e:
-            error_message = f"Error fetching loans from the database: {str(e)}"
-            return jsonify({'error': error_message}), 500
-
         keys = list(request.args.keys())
 
         # Define a list of allowed query parameters
         allowed_params = {'memberName', 'isbn', 'ISBN', 'title', 'loanID', 'loanDate', 'loanID'}
         # Check for invalid query parameters
-        invalid_params = [key for key in keys if key not in allowed_params]
+        invalid_params = [key for key in keys if key not in allowed_params | PAGINATION_PARAMS]
         if invalid_params:
+            parameters_allowed = (allowed_params | PAGINATION_PARAMS) - {'isbn'}
             return jsonify({"error": f"Invalid query parameters: {', '.join(invalid_params)}. "
-                                     f"Parameters allowed - {allowed_params - {'isbn'} }"}), 422
+                                     f"Parameters allowed - {parameters_allowed}"}), 422
 
         # Validate parameters' values
-        errors = validate_query_params()
+        errors = validate_query_params(request.args)
+        if errors:
+            return jsonify(errors), 422
+
+        pagination, errors = get_pagination_args(request.args, LOAN_FIELDS)
         if errors:
             return jsonify(errors), 422
 
-        # Filter loans according to query
+        # Collect the (field, value) filters of the query, to be matched by the database
+        filters = []
         for key in keys:
             # Check if loans need to be filtered by some field
             fields = allowed_params
@@ -42,11 +65,16 @@ def loans():
                 values = request.args.getlist(key)
                 for value in values:
                     if key == 'isbn': key = 'ISBN'
-                    if key == 'ID': key = 'id'
-                    res_loans_list = [loan for loan in res_loans_list if loan[key] == value]
+                    filters.append((key, value))
 
-        # Return a list of all the loans
-        return jsonify(res_loans_list), 200
+        try:
+            # Return a list of all the loans, or a page of them
+            res_loans = mongodb_service.iter_loans(filters, pagination['limit'], pagination['after'],
+                                                   pagination['fields'])
+            return list_response(res_loans, pagination, 'loanID')
+        except Exception as e:
+            error_message = f"Error fetching loans from the database: {str(e)}"
+            return jsonify({'error': error_message}), 500
 
     elif request.method == 'POST':
         # Check if the request content type is JSON
@@ -78,19 +106,22 @@ def loans():
             if not book_data['id']:
                 return jsonify({"error": "The book with the provided ISBN wasn't found"}), 422
 
-            found_loan = mongodb_service.get_loan_by_isbn(isbn)
-            if found_loan:
-                return jsonify({"error": "There already exists a loan for the book with the provided ISBN"}), 422
-
-            number_of_member_loans = mongodb_service.count_loans_by_member_name(member_name)
-            if number_of_member_loans >= 2:
-                return jsonify({"error": "Member already has 2 or more books on loan"}), 422
-
             # Set new loan instance with received data - 'memberName', 'ISBN', 'loanDate'
             new_loan = Loan(member_name, isbn, loan_date, book_data['title'], book_data['id'])
 
-            # Insert the new loan instance to the Mongo databases
-            loan_id = mongodb_service.insert_loan(new_loan)
+            # Count the new loan of the member and insert it, in a single transaction - each write enforcing one
+            # limit atomically, so that concurrent requests, to any of the replicas, can't both pass the checks
+            try:
+                loan_id = mongodb_service.insert_member_loan(new_loan, MAX_MEMBER_LOANS)
+            except MemberLoansLimit:
+                if mongodb_service.get_loan_by_isbn(isbn):
+                    return jsonify({"error": "There already exists a loan for the book with the provided ISBN"}), 422
+                return jsonify({"error": f"Member already has {MAX_MEMBER_LOANS} or more books on loan"}), 422
+            if not loan_id:
+                return jsonify({"error": "There already exists a loan for the book with the provided ISBN"}), 422
+
+        except BooksServiceUnavailable as e:
+            return jsonify({'error': f"Error fetching book data: {str(e)}"}), 503
 
         except Exception as e:
             error_message = f"Error storing data in database: {str(e)}"
@@ -100,8 +131,7 @@ def loans():
         return jsonify({"loanID": f"{loan_id}"}), 201
 
 
-def validate_query_params():
-    params = request.args
+def validate_query_params(params):
     errors = []
 
     # Validate memberName
@@ -165,3 +195,120 @@ def loan_by_id(id):
     except Exception as e:
         error_message = f"Error accessing the database: {str(e)}"
         return jsonify({'error': error_message}), 500
+
+
+# Define /books-service/events route for POST request - the books' update and delete events, from the books-service
+@controllers_bp.route('/books-service/events', methods=['POST'])
+def apply_books_service_events():
+    # Check for the API key in the request headers
+    api_key = request.headers.get('API-KEY')
+    if api_key != BOOKS_SERVICE_API_KEY:
+        return jsonify({'error': 'Forbidden: Invalid API key'}), 403
+
+    events = (request.get_json(silent=True) or {}).get('events')
+    if not isinstance(events, list) or not all(isinstance(event, dict) and 'type' in event and 'bookId' in event
+                                               for event in events):
+        return jsonify({"error": "Please provide 'events' - a list of books-service events"}), 422
+
+    try:
+        modified = mongodb_service.apply_book_events([dict(event, data=event.get('data') or {}) for event in events])
+    except Exception as e:
+        error_message = f"Error storing data in database: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+    return jsonify({"applied": len(events), "modifiedLoans": modified}), 200
+
+
+# Define /books-service/stats route for GET request - the books-service client's calls and latency stats
+@controllers_bp.route('/books-service/stats', methods=['GET'])
+def get_books_service_stats():
+    return jsonify(mongodb_service.books_service.stats()), 200
+
+
+# Define /stats route for GET request - all the loans statistics, for the dashboards
+@controllers_bp.route('/stats', methods=['GET'])
+def get_all_stats():
+    try:
+        return jsonify({name: stats_cache.get(name) for name in stats_cache.names()}), 200
+    except Exception as e:
+        error_message = f"Error computing statistics: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+# Define /stats/<name> route for GET request - a single loans statistic
+@controllers_bp.route('/stats/<name>', methods=['GET'])
+def get_stats(name):
+    if name not in stats_cache.names():
+        return jsonify({"error": f"No statistics named '{name}' - one of {', '.join(stats_cache.names())}"}), 404
+    try:
+        return jsonify(stats_cache.get(name)), 200
+    except Exception as e:
+        error_message = f"Error computing statistics: {str(e)}"
+        return jsonify({'error': error_message}), 500
+
+
+# Secure API key of the admin routes - exports and imports of all the loans
+ADMIN_API_KEY = os.getenv('ADMIN_API_KEY', 'admin-api-key')
+
+# Collections of GET /admin/export and POST /admin/import - the members' loans counters are recounted by the imports
+TRANSFER_COLLECTIONS = ('loans',)
+
+
+def transfer_collections(mongodb_service, names=TRANSFER_COLLECTIONS):
+    return {name: getattr(mongodb_service, f'{name}_collection') for name in names}
+
+
+def get_import_gzip():
+    # Whether the body of an import is gzipped, None if it isn't NDJSON at all
+    if request.mimetype == GZIP_CONTENT_TYPE or request.content_encoding == 'gzip':
+        return True
+    return False if request.mimetype == NDJSON_CONTENT_TYPE else None
+
+
+# Define /admin/export route for GET request - the loans as NDJSON, streamed from the database
+@controllers_bp.route('/admin/export', methods=['GET'])
+def admin_export():
+    if request.headers.get('API-KEY') != ADMIN_API_KEY:
+        return jsonify({'error': 'Forbidden: Invalid API key'}), 403
+
+    export, errors = get_export_args(request.args, TRANSFER_COLLECTIONS)
+    if errors:
+        return jsonify(errors), 422
+
+    collections = transfer_collections(mongodb_service, export['collections'])
+    chunks = export_chunks(collections.items(), export['gzip'])
+    return Response(stream_with_context(chunks), headers=export_headers('loans', export['gzip'])), 200
+
+
+# Define /admin/import route for POST request - write an export's loans, keeping their IDs
+@controllers_bp.route('/admin/import', methods=['POST'])
+def admin_import():
+    if request.headers.get('API-KEY') != ADMIN_API_KEY:
+        return jsonify({'error': 'Forbidden: Invalid API key'}), 403
+
+    gzip = get_import_gzip()
+    if gzip is None:
+        return jsonify({"error": f"Unsupported media type. Only {NDJSON_CONTENT_TYPE} data, "
+                                 f"optionally gzipped, is supported."}), 415
+
+    args, errors = get_import_args(request.args)
+    if errors:
+        return jsonify(errors), 422
+
+    importer = Importer(transfer_collections(mongodb_service), mongodb_service.import_checkpoints_collection,
+                        args['mode'], args['checkpoint'], gzip)
+    try:
+        return jsonify(import_stream(request.stream.read, importer)), 200
+    except ImportFailed as e:
+        return jsonify(dict(importer.summary(), error=str(e))), 422
+    except Exception as e:
+        error_message = f"Error importing into the database: {str(e)}"
+        return jsonify(dict(importer.summary(), error=error_message)), 500
+    finally:
+        mongodb_service.finish_import(importer.counts)
+
+
+# Define a /metrics route for GET request - the requests, MongoDB commands and outgoing calls, for Prometheus
+@controllers_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    return metrics_registry.render(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
@@ -0,0 +1,30 @@
+import os
+import tempfile
+import multiprocessing
+
+# Production server settings - run with 'gunicorn -c gunicorn.conf.py app:app'.
+# The master process forks the workers, each of them connects to MongoDB on its own
+bind = f"0.0.0.0:{os.getenv('PORT', 5002)}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# 'gthread' serves every worker's requests with a thread pool, 'gevent' with greenlets (requires gevent)
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+# Seconds the workers get to finish their in-flight requests on SIGTERM (shutdown) or SIGHUP (reload)
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# Recycle the workers after this many requests, 0 to never recycle them
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
+# Import the app in every worker after the fork, so no client is ever shared between processes
+preload_app = False
+
+# The workers share their metrics through this directory, so that /metrics reports the totals of all of them
+if 'METRICS_DIR' not in os.environ:
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='metrics-')
+
+
+def post_worker_init(worker):
+    from controllers import init_worker_process
+    init_worker_process()
@@ -1,3 +1,7 @@
+# Maximal number of books a member may have on loan at once
+MAX_MEMBER_LOANS = 2
+
+
 class Loan:
     def __init__(self, member_name, isbn, loan_date, title, book_id):
         self.member_name = member_name
@@ -15,3 +19,7 @@ class Loan:
             'title': self.title,
             'bookID': self.book_id,
         }
+
+
+# Fields of a returned loan, which may be selected with the 'fields' query parameter
+LOAN_FIELDS = {'loanID', 'memberName', 'ISBN', 'loanDate', 'title', 'bookID'}
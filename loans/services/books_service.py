@@ -1,21 +1,162 @@
 import os
+import time
+import logging
+import threading
+from collections import deque
 import requests
+from requests.adapters import HTTPAdapter
+from common.metrics import observe_call
+from common.single_flight import SingleFlight
 
+logger = logging.getLogger(__name__)
 
-def get_book_title_and_id(isbn):
-    # books_service_host = os.getenv('BOOKS_SERVICE_HOST', 'books_service')
-    books_service_host = os.getenv('BOOKS_SERVICE_HOST', 'localhost')
-    books_service_port = os.getenv('BOOKS_SERVICE_PORT', '5000')
-    api_key = os.getenv('BOOKS_SERVICE_API_KEY', 'your-secure-api-key')
-
-    try:
-        # Construct the URL using environment variables and the provided ISBN
-        url = f'http://{books_service_host}:{books_service_port}/books/isbn/{isbn}'
-        headers = {'API-KEY': api_key}
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        book_data = response.json()
-        return book_data['title'], book_data['id']
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching book data: {e}")
-        return None, None
+# Seconds to wait for the books-service - to connect, and for its response
+BOOKS_SERVICE_CONNECT_TIMEOUT = float(os.getenv('BOOKS_SERVICE_CONNECT_TIMEOUT', 1))
+BOOKS_SERVICE_READ_TIMEOUT = float(os.getenv('BOOKS_SERVICE_READ_TIMEOUT', 3))
+# Number of kept-alive connections to the books-service
+BOOKS_SERVICE_POOL_SIZE = int(os.getenv('BOOKS_SERVICE_POOL_SIZE', 20))
+# Seconds a found book's title and ID are cached
+BOOKS_SERVICE_CACHE_TTL = float(os.getenv('BOOKS_SERVICE_CACHE_TTL', 30))
+BOOKS_SERVICE_CACHE_SIZE = int(os.getenv('BOOKS_SERVICE_CACHE_SIZE', 10000))
+# Number of ISBNs resolved by a single batch call, at most the books-service's ISBN_BATCH_MAX
+BOOKS_SERVICE_BATCH_SIZE = int(os.getenv('BOOKS_SERVICE_BATCH_SIZE', 100))
+# Consecutive failures opening the circuit, and seconds before a trial call is let through
+BOOKS_SERVICE_FAILURE_THRESHOLD = int(os.getenv('BOOKS_SERVICE_FAILURE_THRESHOLD', 5))
+BOOKS_SERVICE_RESET_SECONDS = float(os.getenv('BOOKS_SERVICE_RESET_SECONDS', 10))
+# Number of recent calls the latency percentiles are computed over
+LATENCY_WINDOW = 1000
+
+
+class BooksServiceUnavailable(Exception):
+    pass
+
+
+class BooksServiceClient:
+    # Client of the books-service, with a keep-alive connection pool, per call timeouts,
+    # a short-lived cache of found books and a circuit breaker failing fast while the books-service is down
+    def __init__(self, url, api_key):
+        self.url = url
+        self.api_key = api_key
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=BOOKS_SERVICE_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = (BOOKS_SERVICE_CONNECT_TIMEOUT, BOOKS_SERVICE_READ_TIMEOUT)
+
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.consecutive_failures = 0
+        self.open_until = 0
+        self.trial_call = False
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {'calls': 0, 'errors': 0, 'cache_hits': 0, 'rejected': 0}
+        # Concurrent lookups of the same uncached ISBN share a single call
+        self.lookups = SingleFlight('books_service')
+
+    def get_book_title_and_id(self, isbn):
+        with self.lock:
+            entry = self.cache.get(isbn)
+            if entry and entry[1] > time.time():
+                self.counters['cache_hits'] += 1
+                return dict(entry[0])
+
+        return dict(self.lookups.do(isbn, lambda: self.fetch_book_title_and_id(isbn)))
+
+    def fetch_book_title_and_id(self, isbn):
+        book_data = self.call('GET', f"/books/isbn/{isbn}").json()
+        return self.remember(isbn, {"title": book_data.get("title"), "id": book_data.get("id")})
+
+    def get_books_titles_and_ids(self, isbns):
+        # Resolve many ISBNs at once - from the cache when possible, and the rest with a single batch call.
+        # Returns a dict of ISBN to {"title", "id"}, with None values for the books which aren't found
+        books = {}
+        now = time.time()
+        with self.lock:
+            for isbn in isbns:
+                entry = self.cache.get(isbn)
+                if entry and entry[1] > now:
+                    self.counters['cache_hits'] += 1
+                    books[isbn] = dict(entry[0])
+
+        # Each missing ISBN is requested once, however many times it was given
+        missing_isbns = list(dict.fromkeys(isbn for isbn in isbns if isbn not in books))
+        for start in range(0, len(missing_isbns), BOOKS_SERVICE_BATCH_SIZE):
+            batch = missing_isbns[start:start + BOOKS_SERVICE_BATCH_SIZE]
+            books_data = self.call('POST', '/books/isbn:batch', json={'isbns': batch}).json()
+            for isbn in batch:
+                book_data = books_data.get(isbn) or {}
+                books[isbn] = self.remember(isbn, {"title": book_data.get("title"), "id": book_data.get("id")})
+
+        return books
+
+    def remember(self, isbn, book):
+        with self.lock:
+            if book['id']:
+                if len(self.cache) >= BOOKS_SERVICE_CACHE_SIZE:
+                    self.cache.pop(next(iter(self.cache)))
+                self.cache[isbn] = (book, time.time() + BOOKS_SERVICE_CACHE_TTL)
+            else:
+                # The book isn't found (anymore)
+                self.cache.pop(isbn, None)
+        return dict(book)
+
+    def forget(self, book_ids):
+        # Evict the cached books with the given IDs - updated or deleted since they were cached
+        book_ids = set(book_ids)
+        with self.lock:
+            for isbn in [isbn for isbn, (book, expiry) in self.cache.items() if book['id'] in book_ids]:
+                del self.cache[isbn]
+
+    def call(self, method, path, **kwargs):
+        self.before_call()
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{self.url}{path}", headers={'API-KEY': self.api_key},
+                                             timeout=self.timeout, **kwargs)
+            failed = response.status_code >= 500
+        except requests.exceptions.RequestException:
+            self.after_call(time.perf_counter() - start, failed=True)
+            observe_call('books_service', start)
+            raise
+        observe_call('books_service', start, response)
+        self.after_call(time.perf_counter() - start, failed)
+
+        response.raise_for_status()  # raise an exception for HTTP errors
+        return response
+
+    def before_call(self):
+        with self.lock:
+            if self.consecutive_failures < BOOKS_SERVICE_FAILURE_THRESHOLD:
+                return
+            # The circuit is open - let a single trial call through once the reset time passed
+            if time.time() >= self.open_until and not self.trial_call:
+                self.trial_call = True
+                return
+            self.counters['rejected'] += 1
+        raise BooksServiceUnavailable("The books-service is unavailable")
+
+    def after_call(self, duration, failed):
+        with self.lock:
+            self.latencies.append(duration)
+            self.counters['calls'] += 1
+            self.trial_call = False
+            if failed:
+                self.counters['errors'] += 1
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= BOOKS_SERVICE_FAILURE_THRESHOLD:
+                    self.open_until = time.time() + BOOKS_SERVICE_RESET_SECONDS
+                    logger.warning("Books-service circuit open after %s consecutive failures",
+                                   self.consecutive_failures)
+            else:
+                self.consecutive_failures = 0
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            circuit_open = self.consecutive_failures >= BOOKS_SERVICE_FAILURE_THRESHOLD
+            stats = dict(self.counters, circuit='open' if circuit_open else 'closed', cache_size=len(self.cache))
+
+        for percentile in [50, 95, 99]:
+            index = min(len(latencies) - 1, len(latencies) * percentile // 100)
+            stats[f'p{percentile}_ms'] = round(latencies[index] * 1000, 2) if latencies else None
+        return stats
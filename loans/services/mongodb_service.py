@@ -1,56 +1,247 @@
 import os
-import requests
+import logging
 from bson import ObjectId
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateMany
+from pymongo.errors import DuplicateKeyError
+from common.metrics import mongo_event_listeners
+from common.structured_logging import log_sampled, summarize
+from services.books_service import BooksServiceClient
+from services.schema_manager import count_member_loans
+
+logger = logging.getLogger(__name__)
+
+
+class MemberLoansLimit(Exception):
+    pass
 
 
 class MongoDBService:
     def __init__(self, host='mongo', port=27017, loans_db_name='loans'):
         mongo_uri = os.getenv('MONGO_URI', f'mongodb://{host}:{port}/{loans_db_name}')
-        self.client = MongoClient(mongo_uri)
+        self.client = MongoClient(mongo_uri, event_listeners=mongo_event_listeners())
         self.loans_db = self.client.get_database()
         self.loans_collection = self.loans_db['loans']
+        # Number of loans of every member, by member name - kept up to date by every loan insert and delete
+        self.member_loans_collection = self.loans_db['member_loans']
+        # Version of the loans collection, bumped by its inserts and deletes - invalidates the cached statistics
+        self.versions_collection = self.loans_db['collection_versions']
+        # Progress of the resumable imports of POST /admin/import, by checkpoint name
+        self.import_checkpoints_collection = self.loans_db['import_checkpoints']
         self.books_service_url = os.getenv('BOOKS_SERVICE_URL', 'http://books-service:5001')
         self.api_key = 'loans-service-api-key'  # API key for the books-service
+        self.books_service = BooksServiceClient(self.books_service_url, self.api_key)
+        # Whether MongoDB supports multi-document transactions, checked on the first write unit
+        self.transactions = None
+        logger.debug("MongoDBService initialized with URI: %s", mongo_uri)
 
     def get_loan(self, id):
+        log_sampled(logger, "Fetching loan with ID: %s", id)
         loan = self.loans_collection.find_one({'_id': ObjectId(id)})
         if loan:
             loan['loanID'] = str(loan.pop('_id'))  # change _id to id and convert ObjectId to string
+        log_sampled(logger, "Found loan: %s", summarize(loan, 'loanID'))
         return loan
 
     def get_book_title_and_id(self, isbn):
-        url = f"{self.books_service_url}/books/isbn/{isbn}"
-        headers = {'API-KEY': self.api_key}
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # raise an exception for HTTP errors
-        book_data = response.json()
-        return {
-            "title": book_data.get("title"),
-            "id": book_data.get("id")
-        }
+        return self.books_service.get_book_title_and_id(isbn)
+
+    def get_books_titles_and_ids(self, isbns):
+        return self.books_service.get_books_titles_and_ids(isbns)
 
     def get_loan_by_isbn(self, isbn):
+        log_sampled(logger, "Fetching loan with ISBN: %s", isbn)
         loan = self.loans_collection.find_one({'ISBN': isbn})
         if loan:
             loan['loanID'] = str(loan.pop('_id'))
         return loan
 
-    def get_all_loans(self):
-        loans = list(self.loans_collection.find())
-        for loan in loans:
-            loan['loanID'] = str(loan.pop('_id'))
-        return loans
+    def get_all_loans(self, fields=None):
+        return list(self.iter_loans(fields=fields))
+
+    def iter_loans(self, filters=None, limit=None, after=None, fields=None):
+        # Iterate over the matching loans from the database cursor, optionally a page of them and only some fields
+        log_sampled(logger, "Iterating loans with filters: %s, limit: %s, after: %s, fields: %s",
+                    filters, limit, after, fields)
+        pipeline = self.page_pipeline(self.build_loans_query(filters), limit, after, 'loanID', fields)
+        return self.loans_collection.aggregate(pipeline)
+
+    @staticmethod
+    def page_pipeline(query, limit=None, after=None, id_key='loanID', fields=None):
+        # Aggregation pipeline of a page of the documents matching the query. Pages are ordered by _id, 'after' being
+        # the last ID of the previous page. The documents are projected to the given fields (all by default) and _id
+        # is renamed to id_key as a string, by the database - the ID is always returned, as the position of the page
+        if after:
+            after_query = {'_id': {'$gt': ObjectId(after)}}
+            query = {'$and': [query, after_query]} if query else after_query
+
+        pipeline = [{'$match': query}]
+        if limit or after:
+            pipeline.append({'$sort': {'_id': 1}})
+        if limit:
+            pipeline.append({'$limit': limit})
+
+        if fields:
+            projection = {field: 1 for field in fields if field != id_key}
+            pipeline.append({'$project': dict(projection, _id=0, **{id_key: {'$toString': '$_id'}})})
+        else:
+            pipeline.append({'$addFields': {id_key: {'$toString': '$_id'}}})
+            pipeline.append({'$project': {'_id': 0}})
+        return pipeline
+
+    @staticmethod
+    def build_loans_query(filters):
+        # Turn a list of (field, value) filters into a single MongoDB query - all filters must match
+        conditions = []
+        for key, value in filters or []:
+            if key == 'loanID':
+                # An ID which is not a valid ObjectId can't match any loan
+                conditions.append({'_id': ObjectId(value) if ObjectId.is_valid(value) else None})
+            else:
+                conditions.append({key: value})
+
+        if not conditions:
+            return {}
+        if len(conditions) == 1:
+            return conditions[0]
+        return {'$and': conditions}
 
     def count_loans_by_member_name(self, member_name):
         count = self.loans_collection.count_documents({'memberName': member_name})
         return count
 
-    def insert_loan(self, loan):
+    def apply_book_events(self, events):
+        # Apply the books-service's events, in order, to the loans' copies of the books' data - in a single batch.
+        # Applying an event again has no further effect. A deleted book's loans keep their title, with a 'missing' ID.
+        # The books are evicted from the books-service client's cache too, so that new loans get their current data
+        self.books_service.forget(event['bookId'] for event in events)
+        operations = []
+        for event in events:
+            if event['type'] == 'book.updated' and 'title' in event['data']:
+                operations.append(UpdateMany({'bookID': event['bookId']}, {'$set': {'title': event['data']['title']}}))
+            elif event['type'] == 'book.deleted':
+                operations.append(UpdateMany({'bookID': event['bookId']}, {'$set': {'bookID': 'missing'}}))
+
+        log_sampled(logger, "Applying %s book events", len(events))
+        if not operations:
+            return 0
+        result = self.loans_collection.bulk_write(operations, ordered=True)
+        return result.modified_count
+
+    def reserve_member_loan(self, member_name, max_loans, session=None):
+        # Count a new loan of the member, unless they already have max_loans - a single conditional update, once the
+        # member's counter exists. Its upsert would collide with the counter on its _id when the member is at the
+        # limit, so the counter of a new member is created on its own first - outside any transaction, as a counter
+        # of 0 is valid whatever happens to the loan - and the update retried once
+        result = self.member_loans_collection.update_one({'_id': member_name, 'count': {'$lt': max_loans}},
+                                                         {'$inc': {'count': 1}}, session=session)
+        if result.modified_count:
+            return True
+        try:
+            created = self.member_loans_collection.update_one({'_id': member_name}, {'$setOnInsert': {'count': 0}},
+                                                              upsert=True)
+        except DuplicateKeyError:
+            # A concurrent reservation created it
+            created = None
+        if created is not None and not created.upserted_id:
+            # The member's counter already existed - they are at the limit
+            return False
+        result = self.member_loans_collection.update_one({'_id': member_name, 'count': {'$lt': max_loans}},
+                                                         {'$inc': {'count': 1}}, session=session)
+        return result.modified_count == 1
+
+    def release_member_loan(self, member_name, session=None):
+        self.member_loans_collection.update_one({'_id': member_name, 'count': {'$gt': 0}}, {'$inc': {'count': -1}},
+                                                session=session)
+
+    def insert_member_loan(self, loan, max_loans):
+        # Count the member's new loan and insert it - in a single transaction, so that no failure in between leaves
+        # the loan counted. Raises MemberLoansLimit if the member already has max_loans, returns None if the book is
+        # already on loan, as enforced by the unique ISBN index. Without transactions the count is given back if the
+        # insert fails - only a crash in between leaves it counted, until the members' loans are recounted
         loan_dict = loan.to_dict()
-        result = self.loans_collection.insert_one(loan_dict)
-        return result.inserted_id
+
+        def insert(session):
+            if not self.reserve_member_loan(loan.member_name, max_loans, session):
+                raise MemberLoansLimit(max_loans)
+            try:
+                return self.loans_collection.insert_one(dict(loan_dict), session=session).inserted_id
+            except Exception:
+                if session is None:
+                    self.release_member_loan(loan.member_name)
+                raise
+
+        log_sampled(logger, "Inserting loan into MongoDB: %s", summarize(loan_dict, 'loanID'))
+        try:
+            inserted_id = self.run_write_unit(insert)
+        except DuplicateKeyError:
+            return None
+        self.bump_version('loans')
+        log_sampled(logger, "Inserted loan with ID: %s", inserted_id)
+        return inserted_id
 
     def delete_loan(self, id):
-        result = self.loans_collection.delete_one({'_id': ObjectId(id)})
-        return result.deleted_count
+        # Delete the loan and give the member's loan back - in a single transaction
+        def delete(session):
+            loan = self.loans_collection.find_one_and_delete({'_id': ObjectId(id)}, {'memberName': 1},
+                                                             session=session)
+            if loan:
+                self.release_member_loan(loan['memberName'], session)
+            return loan
+
+        log_sampled(logger, "Deleting loan with ID: %s", id)
+        loan = self.run_write_unit(delete)
+        if loan:
+            self.bump_version('loans')
+        log_sampled(logger, "Deleted loan: %s", summarize(loan, 'loanID'))
+        return 1 if loan else 0
+
+    def run_write_unit(self, write):
+        # Run write(session) in a transaction, retried on transient errors. Without transactions (a standalone
+        # MongoDB) the writes are applied one by one
+        if self.transactions is None:
+            self.transactions = self.supports_transactions()
+        if not self.transactions:
+            return write(None)
+        with self.client.start_session() as session:
+            return session.with_transaction(write)
+
+    def supports_transactions(self):
+        # Multi-document transactions need a replica set or a sharded cluster
+        try:
+            hello = self.client.admin.command('hello')
+            transactions = 'setName' in hello or hello.get('msg') == 'isdbgrid'
+        except Exception as e:
+            logger.warning("Error checking MongoDB transactions support: %s", e)
+            transactions = False
+        if not transactions:
+            logger.warning("MongoDB doesn't support transactions - the members' loans are counted apart from the loans")
+        return transactions
+
+    # Export and Import
+    def finish_import(self, names):
+        # The imported loans were written around the loans operations - recount the members' loans, and invalidate
+        # the cached statistics
+        if 'loans' in names:
+            count_member_loans(self)
+            self.bump_version('loans')
+
+    # Statistics
+    def count_loans_by_member(self):
+        # The number of loans of every member with any, most first - from the members' loans counters
+        return list(self.member_loans_collection.aggregate([
+            {'$match': {'count': {'$gt': 0}}},
+            {'$sort': {'count': -1, '_id': 1}},
+            {'$project': {'_id': 0, 'memberName': '$_id', 'loans': '$count'}},
+        ]))
+
+    # Collection Versions Operations
+    def bump_version(self, name):
+        # Count the writes of a collection. The epoch tells apart the counters of a recreated versions collection
+        self.versions_collection.update_one(
+            {'_id': name}, {'$inc': {'version': 1}, '$currentDate': {'updatedAt': True},
+                            '$setOnInsert': {'epoch': str(ObjectId())}}, upsert=True)
+
+    def get_versions(self, names):
+        # The version documents of the given collections, by name - missing for never written collections
+        versions = self.versions_collection.find({'_id': {'$in': list(names)}})
+        return {version['_id']: version for version in versions}
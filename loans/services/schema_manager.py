@@ -0,0 +1,73 @@
+import sys
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from common.schema_manager import SchemaManager, run_command
+
+# Indexes every collection is expected to have, keyed by the MongoDBService collection attribute
+INDEXES = {
+    'loans_collection': [
+        # A book can only be loaned once - enforced on every POST /loans
+        IndexModel([('ISBN', ASCENDING)], name='isbn_unique', unique=True),
+        IndexModel([('memberName', ASCENDING)], name='member_name'),
+        # The books' update and delete events apply to their loans
+        IndexModel([('bookID', ASCENDING)], name='book_id'),
+    ],
+    'member_loans_collection': [
+        # The loans per member statistics, most first
+        IndexModel([('count', DESCENDING), ('_id', ASCENDING)], name='count_id'),
+    ],
+}
+
+
+def drop_isbn_index(mongodb_service):
+    # The non-unique ISBN index is replaced by 'isbn_unique', with the same key
+    if 'isbn' in mongodb_service.loans_collection.index_information():
+        mongodb_service.loans_collection.drop_index('isbn')
+
+
+def count_member_loans(mongodb_service):
+    # Recompute the loans counter of every member from the loans. The counters keep taking reservations meanwhile, so
+    # they are never replaced as a whole: the counts are computed into a temporary collection, then merged into the
+    # counters one member at a time, and the members left without any loan are counted again one by one
+    loans_collection, counters_collection = mongodb_service.loans_collection, mongodb_service.member_loans_collection
+    recount_collection = mongodb_service.loans_db[f'{counters_collection.name}_recount_{ObjectId()}']
+    try:
+        loans_collection.aggregate([
+            {'$group': {'_id': '$memberName', 'count': {'$sum': 1}}},
+            {'$out': recount_collection.name},
+        ])
+        recount_collection.aggregate([
+            {'$merge': {'into': counters_collection.name, 'on': '_id', 'whenMatched': 'replace',
+                        'whenNotMatched': 'insert'}},
+        ])
+        counted = set(recount_collection.distinct('_id'))
+        for counter in counters_collection.find({'count': {'$gt': 0}}, {'_id': 1}):
+            if counter['_id'] not in counted:
+                count = loans_collection.count_documents({'memberName': counter['_id']})
+                counters_collection.update_one({'_id': counter['_id']}, {'$set': {'count': count}})
+    finally:
+        recount_collection.drop()
+
+
+# Versioned data migrations, applied once each and in order - (version, description, function(mongodb_service))
+MIGRATIONS = [
+    (1, 'Drop the non-unique loans ISBN index', drop_isbn_index),
+    (2, 'Count the loans of every member', count_member_loans),
+]
+
+
+def schema_manager(mongodb_service):
+    # The schema of the loans database - see common.schema_manager
+    return SchemaManager(mongodb_service, mongodb_service.loans_db, INDEXES, MIGRATIONS)
+
+
+def check_schema(mongodb_service):
+    return schema_manager(mongodb_service).check()
+
+
+# Run with 'python -m services.schema_manager [report|migrate]' from the service directory - the containers
+# migrate before starting the workers
+if __name__ == '__main__':
+    from services.mongodb_service import MongoDBService
+
+    run_command(schema_manager(MongoDBService()), sys.argv[1:])
@@ -0,0 +1,49 @@
+import os
+import sys
+import mongomock
+import mongomock.aggregate
+import pymongo
+import pytest
+
+# The service's modules import from its directory and the shared ones from the repository root. MongoDB is replaced
+# by mongomock - patched before the services import MongoClient
+service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [service_dir, os.path.dirname(service_dir)]
+pymongo.MongoClient = mongomock.MongoClient
+
+
+def handle_merge_stage(in_collection, database, options):
+    # mongomock has no $merge - only its replacement of the matched documents on _id, inserting the others
+    into = database.get_collection(options['into'])
+    for document in in_collection:
+        into.replace_one({'_id': document['_id']}, document, upsert=True)
+    return []
+
+
+mongomock.aggregate._PIPELINE_HANDLERS['$merge'] = handle_merge_stage
+
+import controllers  # noqa: E402
+from app import app as flask_app  # noqa: E402
+from services.schema_manager import schema_manager  # noqa: E402
+
+
+@pytest.fixture(scope='session', autouse=True)
+def schema():
+    # Applied once, as by the migrate command before the workers start
+    schema_manager(controllers.mongodb_service.instance()).run()
+
+
+@pytest.fixture
+def mongodb_service(monkeypatch):
+    service = controllers.mongodb_service.instance()
+    service.loans_collection.delete_many({})
+    service.member_loans_collection.delete_many({})
+    # Every ISBN is of a book of the books-service
+    monkeypatch.setattr(service.books_service, 'get_book_title_and_id',
+                        lambda isbn: {'title': f'Title {isbn}', 'id': f'book-{isbn}'})
+    return service
+
+
+@pytest.fixture
+def client(mongodb_service):
+    return flask_app.test_client()
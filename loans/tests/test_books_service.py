@@ -0,0 +1,120 @@
+import time
+import pytest
+import requests
+import controllers
+from services.books_service import BOOKS_SERVICE_FAILURE_THRESHOLD, BooksServiceClient, BooksServiceUnavailable
+
+
+class StubResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error")
+
+
+class StubSession:
+    # The HTTP session of a client, answering with the books by ISBN - or failing while the books-service is down
+    def __init__(self, books):
+        self.books = books
+        self.down = False
+        self.requests = 0
+
+    def request(self, method, url, **kwargs):
+        self.requests += 1
+        if self.down:
+            raise requests.exceptions.ConnectionError("Connection refused")
+        isbn = url.rsplit('/', 1)[-1]
+        if isbn in self.books:
+            return StubResponse(200, self.books[isbn])
+        return StubResponse(404, {'error': 'Not found'})
+
+
+@pytest.fixture
+def books_client():
+    client = BooksServiceClient('http://books-service', 'api-key')
+    client.session = StubSession({'9780000000001': {'title': 'Dune', 'id': 'dune-id'}})
+    return client
+
+
+def fail(client, times):
+    for _ in range(times):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client.get_book_title_and_id('9780000000002')
+
+
+def test_circuit_opens_after_consecutive_failures(books_client):
+    books_client.session.down = True
+    fail(books_client, BOOKS_SERVICE_FAILURE_THRESHOLD)
+    assert books_client.stats()['circuit'] == 'open'
+
+    # Failing fast, without calling the books-service
+    with pytest.raises(BooksServiceUnavailable):
+        books_client.get_book_title_and_id('9780000000002')
+    assert books_client.session.requests == BOOKS_SERVICE_FAILURE_THRESHOLD
+    assert books_client.stats()['rejected'] == 1
+
+
+def test_success_resets_the_failures(books_client):
+    books_client.session.down = True
+    fail(books_client, BOOKS_SERVICE_FAILURE_THRESHOLD - 1)
+    books_client.session.down = False
+    assert books_client.get_book_title_and_id('9780000000001') == {'title': 'Dune', 'id': 'dune-id'}
+
+    books_client.session.down = True
+    fail(books_client, BOOKS_SERVICE_FAILURE_THRESHOLD - 1)
+    assert books_client.stats()['circuit'] == 'closed'
+
+
+def test_half_open_circuit_lets_a_single_trial_call_through(books_client):
+    books_client.session.down = True
+    fail(books_client, BOOKS_SERVICE_FAILURE_THRESHOLD)
+    # The reset time passed
+    books_client.open_until = time.time() - 1
+
+    books_client.before_call()
+    # Another call while the trial call is running
+    with pytest.raises(BooksServiceUnavailable):
+        books_client.before_call()
+    books_client.after_call(0.01, failed=True)
+
+    # The trial call failed - open again, for another reset time
+    assert books_client.open_until > time.time()
+    with pytest.raises(BooksServiceUnavailable):
+        books_client.get_book_title_and_id('9780000000001')
+
+    books_client.open_until = time.time() - 1
+    books_client.session.down = False
+    assert books_client.get_book_title_and_id('9780000000001')['id'] == 'dune-id'
+    assert books_client.stats()['circuit'] == 'closed'
+
+
+def test_found_books_are_cached(books_client):
+    assert books_client.get_book_title_and_id('9780000000001')['title'] == 'Dune'
+    assert books_client.get_book_title_and_id('9780000000001')['title'] == 'Dune'
+    assert books_client.session.requests == 1
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        books_client.get_book_title_and_id('9780000000002')
+    with pytest.raises(requests.exceptions.HTTPError):
+        books_client.get_book_title_and_id('9780000000002')
+    assert books_client.session.requests == 3
+
+
+def test_book_events_evict_the_cached_books(client, mongodb_service, monkeypatch):
+    books_service = mongodb_service.books_service
+    monkeypatch.setattr(books_service, 'cache', {})
+    books_service.remember('9780000000001', {'title': 'Dune', 'id': 'dune-id'})
+    books_service.remember('9780000000002', {'title': 'Emma', 'id': 'emma-id'})
+
+    # Dune's ISBN changed
+    response = client.post('/books-service/events', headers={'API-KEY': controllers.BOOKS_SERVICE_API_KEY},
+                           json={'events': [{'type': 'book.updated', 'bookId': 'dune-id',
+                                             'data': {'ISBN': '9780000000003'}}]})
+    assert response.status_code == 200
+    assert list(books_service.cache) == ['9780000000002']
@@ -0,0 +1,141 @@
+import time
+import threading
+import pytest
+from pymongo.results import UpdateResult
+from models.loans import MAX_MEMBER_LOANS
+
+# Concurrent requests for the same member
+CONCURRENT_LOANS = 8
+
+
+class RacingUpserts:
+    # A collection whose upserts matching no document insert it without checking the filter again - as concurrent
+    # upserts do on a MongoDB server, colliding on the new document's _id, which mongomock running them one after
+    # the other wouldn't
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def update_one(self, filter, update, upsert=False, session=None):
+        if not upsert or self.collection.find_one(filter):
+            return self.collection.update_one(filter, update, upsert=upsert, session=session)
+        time.sleep(0.01)
+        document = {key: value for key, value in filter.items() if not isinstance(value, dict)}
+        document.update(update.get('$setOnInsert', {}))
+        document.update(update.get('$inc', {}))
+        self.collection.insert_one(document)
+        return UpdateResult({'n': 1, 'nModified': 0, 'upserted': document['_id']}, True)
+
+
+def post_loan(client, member_name, isbn):
+    return client.post('/loans', json={'memberName': member_name, 'ISBN': isbn, 'loanDate': '2024-01-01'})
+
+
+def post_loans_concurrently(member_name, isbns):
+    from app import app
+    statuses = []
+    barrier = threading.Barrier(len(isbns))
+
+    def post(isbn):
+        client = app.test_client()
+        barrier.wait()
+        statuses.append(post_loan(client, member_name, isbn).status_code)
+
+    threads = [threading.Thread(target=post, args=(isbn,)) for isbn in isbns]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+
+@pytest.mark.parametrize('existing_loans', [0, 1], ids=['new-member', 'existing-member'])
+def test_concurrent_loans_of_a_member_respect_the_limit(client, mongodb_service, monkeypatch, existing_loans):
+    monkeypatch.setattr(mongodb_service, 'member_loans_collection',
+                        RacingUpserts(mongodb_service.member_loans_collection))
+    for i in range(existing_loans):
+        assert post_loan(client, 'Ann', f'{i:013d}').status_code == 201
+
+    isbns = [f'{i:013d}' for i in range(existing_loans, existing_loans + CONCURRENT_LOANS)]
+    statuses = post_loans_concurrently('Ann', isbns)
+
+    assert statuses.count(201) == MAX_MEMBER_LOANS - existing_loans
+    assert statuses.count(422) == CONCURRENT_LOANS - statuses.count(201)
+    assert mongodb_service.loans_collection.count_documents({'memberName': 'Ann'}) == MAX_MEMBER_LOANS
+    assert mongodb_service.member_loans_collection.find_one({'_id': 'Ann'})['count'] == MAX_MEMBER_LOANS
+
+
+def test_member_at_the_limit_is_refused(client):
+    for i in range(MAX_MEMBER_LOANS):
+        assert post_loan(client, 'Ann', f'{i:013d}').status_code == 201
+
+    response = post_loan(client, 'Ann', '9999999999999')
+    assert response.status_code == 422
+    assert 'books on loan' in response.get_json()['error']
+
+
+def test_returned_loan_frees_the_member(client, mongodb_service):
+    loan_ids = [post_loan(client, 'Ann', f'{i:013d}').get_json()['loanID'] for i in range(MAX_MEMBER_LOANS)]
+
+    assert client.delete(f'/loans/{loan_ids[0]}').status_code == 200
+    assert post_loan(client, 'Ann', '9999999999999').status_code == 201
+
+
+def test_book_already_on_loan_is_refused(client, mongodb_service):
+    assert post_loan(client, 'Ann', '0000000000001').status_code == 201
+
+    response = post_loan(client, 'Bob', '0000000000001')
+    assert response.status_code == 422
+    assert 'already exists a loan' in response.get_json()['error']
+    # The refused loan isn't counted
+    assert mongodb_service.member_loans_collection.find_one({'_id': 'Bob'})['count'] == 0
+
+
+class CountedUpdates:
+    # A collection counting its update_one calls
+    def __init__(self, collection):
+        self.collection = collection
+        self.updates = 0
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def update_one(self, *args, **kwargs):
+        self.updates += 1
+        return self.collection.update_one(*args, **kwargs)
+
+
+def test_existing_member_loan_is_counted_in_a_single_write(client, mongodb_service, monkeypatch):
+    assert post_loan(client, 'Ann', '0000000000001').status_code == 201
+    counted = CountedUpdates(mongodb_service.member_loans_collection)
+    monkeypatch.setattr(mongodb_service, 'member_loans_collection', counted)
+
+    assert post_loan(client, 'Ann', '0000000000002').status_code == 201
+    assert counted.updates == 1
+
+
+def test_failed_insert_gives_the_member_loan_back(client, mongodb_service, monkeypatch):
+    # Without transactions, as with mongomock, the count is given back by the write unit
+    def insert_one(*args, **kwargs):
+        raise RuntimeError("Connection lost")
+
+    monkeypatch.setattr(mongodb_service.loans_collection, 'insert_one', insert_one)
+    response = post_loan(client, 'Ann', '0000000000001')
+    assert response.status_code == 500
+    assert mongodb_service.member_loans_collection.find_one({'_id': 'Ann'})['count'] == 0
+
+
+def test_import_recounts_the_member_loans_in_place(client, mongodb_service):
+    assert post_loan(client, 'Ann', '0000000000001').status_code == 201
+    # Loans imported around the counters, and a stale counter
+    mongodb_service.loans_collection.insert_many([{'memberName': 'Bob', 'ISBN': f'{i:013d}'} for i in (2, 3)])
+    mongodb_service.member_loans_collection.insert_one({'_id': 'Eve', 'count': 2})
+    collections = set(mongodb_service.loans_db.list_collection_names())
+
+    mongodb_service.finish_import({'loans': {'written': 2}})
+
+    counts = {counter['_id']: counter['count'] for counter in mongodb_service.member_loans_collection.find()}
+    assert counts == {'Ann': 1, 'Bob': 2, 'Eve': 0}
+    assert set(mongodb_service.loans_db.list_collection_names()) == collections